@@ -1,29 +1,44 @@
 import os
 import math
-import jieba
-import jieba.analyse
-import thulac
-import nltk
 import re
-import pandas as pd
-from nltk import PorterStemmer
-from nltk.corpus import stopwords
-from sentence_transformers import SentenceTransformer
-from sklearn.feature_extraction.text import TfidfVectorizer
-
-# Initialize jieba (for Traditional Chinese)
-jieba.set_dictionary("jeiba/dict.txt.big")
-
-# Initialize THULAC (for Simplified Chinese)
-thulac_model = thulac.thulac(seg_only=True)
-
-# Initialize Porter Stemmer (for English)
-stemmer = PorterStemmer()
-
-# Download NLTK resources
-nltk.download("punkt")
-nltk.download("stopwords")
-nltk.download('punkt_tab')
+from functools import partial
+from core.tokenisers.lazy_resource import LazyResource
+
+# The models, stemmer and stopwords below (and pandas) are slow to load, and NLTK downloads its data, so each is a
+# `LazyResource`: only loaded the first time it is needed, then kept, with its load time in `loading_report`.
+
+def _load_pandas():
+    import pandas
+    return pandas
+
+# jieba (for Traditional Chinese)
+def _load_jieba():
+    import jieba
+    jieba.set_dictionary("jeiba/dict.txt.big")
+    return jieba
+
+# THULAC (for Simplified Chinese)
+def _load_thulac_model():
+    import thulac
+    return thulac.thulac(seg_only=True)
+
+# Porter Stemmer (for English)
+def _load_stemmer():
+    from nltk import PorterStemmer
+    return PorterStemmer()
+
+# NLTK, with its resources downloaded
+def _load_nltk():
+    import nltk
+    nltk.download("punkt")
+    nltk.download("stopwords")
+    nltk.download('punkt_tab')
+    return nltk
+
+# SentenceTransformers model (for the embeddings)
+def _load_sentence_model():
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
 
 # Function to load stopwords from file
 def load_stopwords(filepath):
@@ -31,12 +46,44 @@ def load_stopwords(filepath):
         return set(f.read().splitlines())
 
 # Load stopwords for various languages
-STOPWORDS = {
-    "zh_trad": load_stopwords("stop_words.txt"),   # Traditional Chinese
-    "zh_simp": load_stopwords("hit_stopwords.txt"),  # Simplified Chinese
-    "en": set(stopwords.words("english")),
-    "tr": set(stopwords.words("turkish"))
-}
+def _load_stopwords(lang):
+    if lang == "zh_trad":
+        return load_stopwords("stop_words.txt")   # Traditional Chinese
+    if lang == "zh_simp":
+        return load_stopwords("hit_stopwords.txt")  # Simplified Chinese
+    nltk.get()
+    from nltk.corpus import stopwords
+    return set(stopwords.words({"en": "english", "tr": "turkish"}[lang]))
+
+pandas = LazyResource("TopNSearch pandas", _load_pandas)
+jieba = LazyResource("TopNSearch jieba dictionary", _load_jieba)
+thulac_model = LazyResource("TopNSearch THULAC model", _load_thulac_model)
+stemmer = LazyResource("TopNSearch english stemmer", _load_stemmer)
+nltk = LazyResource("TopNSearch NLTK data", _load_nltk)
+sentence_model = LazyResource("TopNSearch sentence model", _load_sentence_model)
+stopwords = {lang: LazyResource(f"TopNSearch {lang} stopwords", partial(_load_stopwords, lang)) for lang in ["zh_trad", "zh_simp", "en", "tr"]}
+
+def warm_up(lang=None, embeddings=False):
+    """
+    Loads the resources `tokenize` needs for the given language now (and the sentence model, if `embeddings`), rather than when they are first used.
+
+    Args:
+        lang (str): The language, one of `zh_trad`, `zh_simp`, `en` or `tr`. Default is `None` (nothing language specific).
+        embeddings (bool): Whether to load the sentence model used by `compute_sentence_embedding` as well. Default is `False`.
+    """
+    if lang == "zh_trad":
+        jieba.get()
+    elif lang == "zh_simp":
+        thulac_model.get()
+    elif lang in ["en", "tr"]:
+        nltk.get()
+        if lang == "en":
+            stemmer.get()
+    if lang in stopwords:
+        stopwords[lang].get()
+    if embeddings:
+        sentence_model.get()
+    pandas.get()
 
 
 # Tokenize function using a specified language if provided
@@ -44,18 +91,18 @@ def tokenize(text, lang=None):
     if lang in ["zh_trad", "zh_simp"]:
         # For Chinese, we don't filter out single characters.
         if lang == "zh_trad":
-            words = jieba.cut_for_search(text)
+            words = jieba.get().cut_for_search(text)
         else:
             text = re.sub(r'[^\u4e00-\u9fff]', ' ', text)
-            words = thulac_model.cut(text, text=True).split()
-        tokens = [w for w in words if w not in STOPWORDS[lang]]
+            words = thulac_model.get().cut(text, text=True).split()
+        tokens = [w for w in words if w not in stopwords[lang].get()]
     elif lang == "en":
-        words = nltk.word_tokenize(text)
-        words = [stemmer.stem(word.lower()) for word in words if word.isalpha()]
-        tokens = [w for w in words if w not in STOPWORDS[lang] and len(w) > 1]
+        words = nltk.get().word_tokenize(text)
+        words = [stemmer.get().stem(word.lower()) for word in words if word.isalpha()]
+        tokens = [w for w in words if w not in stopwords[lang].get() and len(w) > 1]
     elif lang == "tr":
-        words = nltk.word_tokenize(text, language="turkish")
-        tokens = [w for w in words if w not in STOPWORDS[lang] and len(w) > 1]
+        words = nltk.get().word_tokenize(text, language="turkish")
+        tokens = [w for w in words if w not in stopwords[lang].get() and len(w) > 1]
     else:
         tokens = text.split()
     
@@ -63,11 +110,11 @@ def tokenize(text, lang=None):
 
 # Compute BERT embeddings using SentenceTransformers
 def compute_sentence_embedding(texts):
-    model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
-    embeddings = model.encode(texts)
+    embeddings = sentence_model.get().encode(texts)
     return embeddings
 
 def compute_tfidf(corpus):
+    from sklearn.feature_extraction.text import TfidfVectorizer
     vectorizer = TfidfVectorizer()
     tfidf_matrix = vectorizer.fit_transform(corpus)
     feature_names = vectorizer.get_feature_names_out()
@@ -82,6 +129,7 @@ def compute_tfidf(corpus):
 
 # merge message by same doc_n
 def merge_messages_by_doc_id(df):
+    pd = pandas.get()
     # merge the same doc_n messages
     merged_df = df.groupby("doc_id")["message"].apply(
         lambda msgs: " ".join([str(msg) for msg in msgs if pd.notnull(msg)])
@@ -90,6 +138,7 @@ def merge_messages_by_doc_id(df):
 
 # pre_process the message and make into tokenized csv file
 def preprocess_messages(df, default_lang=None):
+    pd = pandas.get()
     # merge doc_n message to comput score
     merged_df = merge_messages_by_doc_id(df)
     
@@ -113,6 +162,7 @@ def preprocess_messages(df, default_lang=None):
 
 # Build the positional inverted index (PII)
 def build_positional_inverted_index_from_csv(csv_path):
+    pd = pandas.get()
     df = pd.read_csv(csv_path)
     index = {}
     position_track = {}
@@ -146,6 +196,7 @@ def write_positional_index_to_file(index, output_path):
             f.write("\n")
 
 def read_csv_file(filepath):
+    pd = pandas.get()
     # sep
     df = pd.read_csv(filepath)
     
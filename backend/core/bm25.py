@@ -0,0 +1,88 @@
+from .pii import get_collection_stats, get_term_frequencies
+import numpy as np
+
+# BM25 parameters used by every scoring engine
+BM25_K1 = 0.75 # default - 1.2
+BM25_B = 0.75 # default - 0.75
+
+
+def doc_sort_key(docNo):
+    """
+    The sort key used to break ties in score (by ascending docNo), shared by every scoring engine so they return identical rankings. Handles the docNo strings of per-chat PIIs as well as the `(chat_id, docNo)` keys of unified PIIs.
+    """
+    return int(docNo) if isinstance(docNo, str) else docNo
+
+def term_arrays(positional_index, term:str) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the postings of a term as NumPy arrays of docNos (as ints) and term frequencies. On-disk PIIs decode these straight from their frequency stream; pickled PIIs have them converted from their postings.
+
+    Args:
+        positional_index (dict): The PII.
+        term (str): The term (which must be in the PII).
+
+    Returns:
+        (tuple[np.ndarray, np.ndarray]) The docNos and the term frequency in each.
+    """
+    term_entry = positional_index[term]
+    if hasattr(term_entry, "frequency_arrays"):
+        return term_entry.frequency_arrays()
+    frequencies = get_term_frequencies(term_entry)
+    doc_ids = np.fromiter(map(int, frequencies.keys()), dtype=np.int64, count=len(frequencies))
+    tfs = np.fromiter(frequencies.values(), dtype=np.int64, count=len(frequencies))
+    return doc_ids, tfs
+
+def doc_length_array(positional_index) -> np.ndarray:
+    """
+    Returns the document lengths of a PII as a NumPy array indexed by docNo (0 for docNos with no tokens).
+
+    On-disk PIIs build this straight from their stats section. For pickled PIIs it is built from the `doc_lengths` dict once, and kept in the (in-memory) stats dict for the following queries.
+
+    Args:
+        positional_index (dict): The PII.
+    """
+    if hasattr(positional_index, "doc_length_array"):
+        return positional_index.doc_length_array()
+    stats = get_collection_stats(positional_index)
+    if "_doc_length_array" not in stats:
+        doc_lengths = stats["doc_lengths"]
+        doc_ids = np.fromiter(map(int, doc_lengths.keys()), dtype=np.int64, count=len(doc_lengths))
+        lengths = np.zeros(doc_ids.max() + 1 if len(doc_ids) else 0, dtype=np.int64)
+        lengths[doc_ids] = np.fromiter(doc_lengths.values(), dtype=np.int64, count=len(doc_lengths))
+        stats["_doc_length_array"] = lengths
+    return stats["_doc_length_array"]
+
+def bm25_top_n(term_postings:list[tuple[np.ndarray, np.ndarray, float]], doc_lengths:np.ndarray, avgdl:float, top_n:int, k1:float=BM25_K1, b:float=BM25_B) -> list[tuple[int, float]]:
+    """
+    Scores documents with BM25 using vectorised NumPy operations, and selects the top N with `argpartition` rather than sorting every score.
+
+    The contributions of each term are accumulated into a dense score buffer indexed by docNo, in the same order and with the same floating point operations as `Searcher.bm25_search`'s Python engine, so the scores (and, with ties broken by ascending docNo, the rankings) are identical.
+
+    Args:
+        term_postings (list[tuple[np.ndarray, np.ndarray, float]]): For each query term (in query order), its docNos, its term frequencies and its idf.
+        doc_lengths (np.ndarray): The document lengths, indexed by docNo (see `doc_length_array`).
+        avgdl (float): The average document length.
+        top_n (int): The number of results to return.
+        k1 (float): The BM25 `k1` parameter. Default is `BM25_K1`.
+        b (float): The BM25 `b` parameter. Default is `BM25_B`.
+
+    Returns:
+        (list[tuple[int, float]]) The top N results in the format `(docNo, score)`.
+    """
+    if top_n <= 0 or not term_postings:
+        return []
+    scores = np.zeros(len(doc_lengths), dtype=np.float64)
+    for doc_ids, tfs, idf in term_postings:
+        tf = tfs.astype(np.float64)
+        dl = doc_lengths[doc_ids].astype(np.float64)
+        scores[doc_ids] += idf * ((tf * (k1 + 1)) / (tf + k1 * (1 - b + b * (dl / avgdl))))
+
+    candidates = np.flatnonzero(scores) # every contribution is positive, so these are the documents containing a query term
+    candidate_scores = scores[candidates]
+    if len(candidates) > top_n:
+        # keep everything scoring at least the N-th best score, so that ties at the cut-off are broken by docNo below
+        threshold = candidate_scores[np.argpartition(-candidate_scores, top_n - 1)[top_n - 1]]
+        keep = candidate_scores >= threshold
+        candidates = candidates[keep]
+        candidate_scores = candidate_scores[keep]
+    order = np.lexsort((candidates, -candidate_scores))[:top_n]
+    return list(zip(candidates[order].tolist(), candidate_scores[order].tolist()))
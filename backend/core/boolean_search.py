@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+from .bm25 import doc_length_array
+from .doc_set import DocSet
+from .phrase_search import match_phrase
+from .proximity_search import match_proximity
+from .pii import PII_CHATS_KEY, get_collection_stats
+from collections import OrderedDict
+import re
+import threading
+
+import numpy as np
+
+# A boolean query is compiled into a plan: a tree of tuples, one per operator
+#
+#   ("term", token)                    documents containing the token
+#   ("phrase", (token, ...))           documents containing the tokens consecutively, in order
+#   ("near", n, (token, ...))          documents containing the tokens within n positions of each other
+#   ("and", (plan, ...))               documents matching every plan (`("not", plan)` operands are excluded)
+#   ("or", (plan, ...))                documents matching any plan
+#   ("not", plan)                      documents not matching the plan
+#
+# Plans only hold tokens, not anything about a PII, so one compiled plan can be run against every chat.
+DEFAULT_MAX_CACHED_PLANS = 256
+BOOLEAN_OPERATORS = ("AND", "OR", "NOT")
+_QUERY_LEXEME = re.compile(r'#(\d+)\s*\(([^)]*)\)?|"([^"]*)"?|\(|\)|[^\s()"]+')
+
+
+def normalise_query(query:str) -> str:
+    """Normalises the whitespace of a query, which is all two spellings of the same query can differ by and still compile to the same plan (terms are normalised by the tokeniser)."""
+    return " ".join(query.split())
+
+def lex_query(query:str) -> list[tuple]:
+    """
+    Splits a boolean query into its lexemes.
+
+    Args:
+        query (str): The query.
+
+    Returns:
+        (list[tuple]) The lexemes, each one of `("op", "AND" | "OR" | "NOT")`, `("(",)`, `(")",)`, `("phrase", text)`, `("near", n, text)` or `("word", text)`.
+    """
+    lexemes = []
+    for match in _QUERY_LEXEME.finditer(query):
+        text = match.group(0)
+        if match.group(1) is not None:
+            lexemes.append(("near", int(match.group(1)), match.group(2)))
+        elif text.startswith('"'):
+            lexemes.append(("phrase", match.group(3)))
+        elif text in ("(", ")"):
+            lexemes.append((text,))
+        elif text in BOOLEAN_OPERATORS:
+            lexemes.append(("op", text))
+        else:
+            lexemes.append(("word", text))
+    return lexemes
+
+def _and(children:list) -> tuple:
+    operands = []
+    for child in children:
+        if child is None:
+            continue # stopwords drop out of a conjunction, as they would from a plain search
+        for operand in (child[1] if child[0] == "and" else (child,)):
+            if operand not in operands:
+                operands.append(operand)
+    if not operands:
+        return None
+    return operands[0] if len(operands) == 1 else ("and", tuple(operands))
+
+def _or(children:list) -> tuple:
+    operands = []
+    for child in children:
+        if child is None:
+            continue
+        for operand in (child[1] if child[0] == "or" else (child,)):
+            if operand not in operands:
+                operands.append(operand)
+    if not operands:
+        return None
+    return operands[0] if len(operands) == 1 else ("or", tuple(operands))
+
+def positive_terms(plan:tuple) -> list[str]:
+    """
+    Returns the tokens of a plan that a matching document contains (i.e. those not under a NOT), in query order. These are the tokens its results are ranked by.
+    """
+    if plan is None or plan[0] == "not":
+        return []
+    if plan[0] == "term":
+        return [plan[1]]
+    if plan[0] == "phrase":
+        return list(plan[1])
+    if plan[0] == "near":
+        return list(plan[2])
+    return list(dict.fromkeys(term for child in plan[1] for term in positive_terms(child)))
+
+
+class QueryPlanner:
+    """
+    Compiles boolean queries into plans (see the top of this file), and caches the compiled plans by normalised query so that a repeated query is only parsed and tokenised once.
+
+    The query language is
+    - terms, with adjacent operands implicitly ANDed: `cat dog` is `cat AND dog`
+    - `AND`, `OR` and `NOT` (in capitals, so the words themselves can still be searched for), binding in the order `NOT`, `AND`, `OR`
+    - parentheses for grouping: `(cat OR dog) AND NOT fish`
+    - phrases in quotes: `"good morning"`
+    - proximity with `#n(term1, term2, ...)`: the terms within `n` positions of each other, in any order
+
+    Terms are tokenised like the messages were, so a stopword drops out of the query, and a word the tokeniser splits into several tokens is searched for as a phrase. A query that is malformed (unbalanced parentheses, dangling operators) is read as leniently as possible rather than rejected.
+
+    Args:
+        tokenise (callable): The tokeniser of the queries, which must be the one the PIIs were built with.
+        max_plans (int): The number of compiled plans to cache. Default is `DEFAULT_MAX_CACHED_PLANS`.
+    """
+    def __init__(self, tokenise, max_plans:int=DEFAULT_MAX_CACHED_PLANS):
+        self.tokenise = tokenise
+        self.max_plans = max_plans
+        self._plans = OrderedDict() # normalised query -> plan
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return f"Query planner ({len(self._plans)} plans cached)"
+
+    def compile(self, query:str) -> tuple:
+        """
+        Returns the plan of a query, from the cache if it has been compiled before.
+
+        Args:
+            query (str): The boolean query.
+
+        Returns:
+            (tuple) The plan, or `None` if the query has no searchable terms.
+        """
+        key = normalise_query(query)
+        with self._lock:
+            if key in self._plans:
+                self._plans.move_to_end(key)
+                self.hits += 1
+                return self._plans[key]
+            self.misses += 1
+        plan = _QueryParser(lex_query(key), self.tokenise).parse()
+        with self._lock:
+            self._plans[key] = plan
+            while len(self._plans) > self.max_plans:
+                self._plans.popitem(last=False)
+        return plan
+
+    def stats(self) -> dict:
+        """
+        Returns the statistics of the plan cache, in the format `{"entries": int, "hits": int, "misses": int}`.
+        """
+        with self._lock:
+            return {"entries": len(self._plans), "hits": self.hits, "misses": self.misses}
+
+
+class _QueryParser:
+    """A recursive descent parser of the lexemes of one query (see `QueryPlanner` for the grammar)."""
+    def __init__(self, lexemes:list[tuple], tokenise):
+        self._lexemes = lexemes
+        self._position = 0
+        self.tokenise = tokenise
+
+    def parse(self) -> tuple:
+        plans = []
+        while self._position < len(self._lexemes):
+            plans.append(self._parse_or())
+            self._position += 1 # skip a stray ")"
+        return _and(plans)
+
+    def _peek(self) -> tuple:
+        return self._lexemes[self._position] if self._position < len(self._lexemes) else None
+
+    def _parse_or(self) -> tuple:
+        operands = [self._parse_and()]
+        while self._peek() == ("op", "OR"):
+            self._position += 1
+            operands.append(self._parse_and())
+        return _or(operands)
+
+    def _parse_and(self) -> tuple:
+        operands = []
+        while True:
+            lexeme = self._peek()
+            if lexeme is None or lexeme == (")",) or lexeme == ("op", "OR"):
+                return _and(operands)
+            if lexeme == ("op", "AND"):
+                self._position += 1
+                continue
+            operands.append(self._parse_not())
+
+    def _parse_not(self) -> tuple:
+        if self._peek() == ("op", "NOT"):
+            self._position += 1
+            operand = self._parse_not()
+            return ("not", operand) if operand is not None else None
+        return self._parse_operand()
+
+    def _parse_operand(self) -> tuple:
+        lexeme = self._peek()
+        if lexeme is None or lexeme[0] == "op":
+            return None
+        self._position += 1
+        if lexeme == ("(",):
+            plan = self._parse_or()
+            if self._peek() == (")",):
+                self._position += 1
+            return plan
+        if lexeme[0] == "near":
+            tokens = tuple(self.tokenise(lexeme[2]))
+            if len(tokens) < 2:
+                return ("term", tokens[0]) if tokens else None
+            return ("near", lexeme[1], tokens)
+        tokens = tuple(self.tokenise(lexeme[1]))
+        if len(tokens) < 2:
+            return ("term", tokens[0]) if tokens else None
+        return ("phrase", tokens)
+
+
+class PlanExecutor:
+    """
+    Runs compiled plans against a PII, evaluating every operator on `DocSet` bitmaps of the PII's documents, so that AND, OR and NOT of even the most common terms are whole-array operations rather than Python set operations on docNo strings. Documents are identified by their docNo in per-chat PIIs, and by their rank among the `(chat_id, docNo)` keys of a unified PII.
+
+    Intersections are ordered by (estimated) document frequency, rarest first, and stop as soon as they are empty, so a conjunction with an operand that matches nothing is empty without the postings of the rest being read. `NOT` is a subtraction: from the rest of its conjunction, or (with nothing to intersect with) from the set of every document.
+
+    Args:
+        positional_index (dict): The PII to run plans against.
+    """
+    def __init__(self, positional_index:dict):
+        self.positional_index = positional_index
+        self.unified = PII_CHATS_KEY in positional_index
+        if self.unified:
+            # the ranks of the (chat_id, docNo) keys are worked out once, and kept in the (in-memory) stats dict for the following queries
+            stats = get_collection_stats(positional_index)
+            if "_doc_keys" not in stats:
+                stats["_doc_keys"] = sorted(stats["doc_lengths"])
+                stats["_doc_ranks"] = {doc_key: rank for rank, doc_key in enumerate(stats["_doc_keys"])}
+            self._doc_keys = stats["_doc_keys"]
+            self._doc_ranks = stats["_doc_ranks"]
+            self.size = len(self._doc_keys)
+        else:
+            self._doc_lengths = doc_length_array(positional_index)
+            self.size = len(self._doc_lengths)
+        self._all_docs = None
+
+    def __repr__(self):
+        return f"Plan executor over {self.size} documents"
+
+    def _doc_set(self, docNos) -> DocSet:
+        # docNos as keyed in the PII
+        if self.unified:
+            doc_ids = np.fromiter((self._doc_ranks[doc_key] for doc_key in docNos), dtype=np.int64, count=len(docNos))
+        else:
+            doc_ids = np.fromiter(map(int, docNos), dtype=np.int64, count=len(docNos))
+        return DocSet.from_doc_ids(doc_ids, self.size)
+
+    def term_doc_set(self, term:str) -> DocSet:
+        """Returns the set of documents containing a term (read from its frequencies alone, where the PII stores them separately)."""
+        if term not in self.positional_index:
+            return DocSet.empty(self.size)
+        term_entry = self.positional_index[term]
+        if hasattr(term_entry, "frequency_arrays"):
+            return DocSet.from_doc_ids(term_entry.frequency_arrays()[0], self.size)
+        return self._doc_set(term_entry["postings"])
+
+    def all_docs(self) -> DocSet:
+        """Returns the set of every document in the PII."""
+        if self._all_docs is None:
+            self._all_docs = DocSet.from_mask(np.ones(self.size, dtype=bool) if self.unified else self._doc_lengths > 0)
+        return self._all_docs
+
+    def estimate(self, plan:tuple) -> int:
+        """Returns an upper bound on the number of documents a plan matches, from the document frequencies alone."""
+        if plan[0] == "term":
+            return self.positional_index[plan[1]]["document_frequency"] if plan[1] in self.positional_index else 0
+        if plan[0] in ("phrase", "near"):
+            terms = plan[1] if plan[0] == "phrase" else plan[2]
+            return min(self.estimate(("term", term)) for term in terms)
+        if plan[0] == "and":
+            return min((self.estimate(child) for child in plan[1] if child[0] != "not"), default=self.size)
+        if plan[0] == "or":
+            return sum(self.estimate(child) for child in plan[1])
+        return self.size
+
+    def doc_set(self, plan:tuple) -> DocSet:
+        """
+        Returns the set of documents matching a plan.
+
+        Args:
+            plan (tuple): The compiled plan (see `QueryPlanner.compile`).
+        """
+        kind = plan[0]
+        if kind == "term":
+            return self.term_doc_set(plan[1])
+        if kind == "phrase":
+            return self._doc_set(match_phrase(list(plan[1]), self.positional_index))
+        if kind == "near":
+            return self._doc_set(match_proximity(list(plan[2]), self.positional_index, plan[1]))
+        if kind == "or":
+            matches = DocSet.empty(self.size)
+            for child in plan[1]:
+                matches = matches | self.doc_set(child)
+            return matches
+        if kind == "not":
+            return self.all_docs() - self.doc_set(plan[1])
+
+        # "and": the rarest operands first, stopping as soon as nothing is left
+        required = sorted((child for child in plan[1] if child[0] != "not"), key=self.estimate)
+        if required and self.estimate(required[0]) == 0:
+            return DocSet.empty(self.size)
+        matches = self.doc_set(required[0]) if required else self.all_docs()
+        for child in required[1:]:
+            if not matches:
+                return matches
+            matches = matches & self.doc_set(child)
+        for child in plan[1]:
+            if child[0] == "not":
+                if not matches:
+                    return matches
+                matches = matches - self.doc_set(child[1])
+        return matches
+
+    def execute(self, plan:tuple) -> list:
+        """
+        Runs a plan against the PII.
+
+        Args:
+            plan (tuple): The compiled plan (see `QueryPlanner.compile`).
+
+        Returns:
+            (list) The docNos (as keyed in the PII: strings, or `(chat_id, docNo)` for unified PIIs) matching the plan, in ascending order.
+        """
+        if plan is None:
+            return []
+        doc_ids = self.doc_set(plan).to_array().tolist()
+        if self.unified:
+            return [self._doc_keys[doc_id] for doc_id in doc_ids]
+        return list(map(str, doc_ids))
@@ -0,0 +1,193 @@
+import csv
+import hashlib
+import os
+import threading
+import time
+
+import chardet
+
+INFO_EXTENSION = ".info.csv"
+DEFAULT_REGISTRY_REFRESH_SECONDS = 2.0
+
+
+class ChatRegistry:
+    """
+    An in-memory registry of the parsed chats, built from their `info.csv` files (`[internal name, display name, participants]`) so that listing chats or looking up their details doesn't touch the filesystem.
+
+    The registry refreshes itself incrementally: at most once every `refresh_seconds`, the info directory is scanned and only the info files that were added, changed (by mtime or size) or removed since the last scan are re-read.
+
+    Each chat is held as a dict in the format
+    ```
+    {
+        "internal_name": str,
+        "display_name": str,
+        "platform": str (the prefix of the internal name, e.g. "instagram"),
+        "participants": list[str]
+    }
+    ```
+
+    Args:
+        info_dir (str): The directory containing the `info.csv` files.
+        language (str): The language of the chats, which decides how the info files are decoded (Turkish ones are detected with `chardet`). Default is `english`.
+        refresh_seconds (float): The least time between two scans of the info directory. Default is `DEFAULT_REGISTRY_REFRESH_SECONDS`.
+    """
+    def __init__(self, info_dir:str, language:str="english", refresh_seconds:float=DEFAULT_REGISTRY_REFRESH_SECONDS):
+        self.info_dir = str(info_dir)
+        self.language = language
+        self.refresh_seconds = refresh_seconds
+        self._chats = {} # internal name -> chat dict
+        self._file_stats = {} # internal name -> (mtime_ns, size) of its info file
+        self._chats_by_participant = {} # participant -> set of internal names
+        self._current_user = None
+        self._last_refresh = None
+        self._lock = threading.Lock()
+        self.refresh(force=True)
+
+    def __repr__(self):
+        return f"Chat registry of {len(self._chats)} chats in {self.info_dir}"
+
+    def __len__(self):
+        self.refresh()
+        return len(self._chats)
+
+    def __contains__(self, chat_name:str) -> bool:
+        self.refresh()
+        return chat_name in self._chats
+
+    def _detect_encoding(self, info_path:str) -> str:
+        if self.language != "turkish":
+            return "utf-8-sig"
+        with open(info_path, "rb") as f:
+            raw_data = f.read(10000)
+            f.close()
+        return chardet.detect(raw_data)["encoding"]
+
+    def _read_info_file(self, chat_name:str, info_path:str) -> dict:
+        with open(info_path, "r", encoding=self._detect_encoding(info_path), errors="replace", newline="") as f:
+            rows = [row for row in csv.reader(f)]
+            f.close()
+        if len(rows) < 2 or len(rows[1]) < 3:
+            print(f"DEBUG ERROR: Malformed info file {info_path}")
+            return None
+        participants = [p.strip() for p in rows[1][2].strip('[]').split(',')]
+        return {
+            "internal_name": chat_name,
+            "display_name": rows[1][1],
+            "platform": chat_name.split("_")[0],
+            "participants": participants,
+        }
+
+    def refresh(self, force:bool=False) -> bool:
+        """
+        Brings the registry up to date with the info directory, re-reading only the info files that changed. Unless `force` is set, this does nothing if the last scan was less than `refresh_seconds` ago.
+
+        Args:
+            force (bool): Whether to scan regardless of when the last scan was. Default is `False`.
+
+        Returns:
+            (bool) Whether any chat was added, changed or removed.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if not force and self._last_refresh is not None and now - self._last_refresh < self.refresh_seconds:
+                return False
+            self._last_refresh = now
+            seen = set()
+            changed = False
+            if os.path.isdir(self.info_dir):
+                with os.scandir(self.info_dir) as entries:
+                    for entry in entries:
+                        if not entry.name.endswith(INFO_EXTENSION) or not entry.is_file():
+                            continue
+                        chat_name = entry.name[:-len(INFO_EXTENSION)]
+                        seen.add(chat_name)
+                        stat = entry.stat()
+                        file_stat = (stat.st_mtime_ns, stat.st_size)
+                        if self._file_stats.get(chat_name) == file_stat:
+                            continue
+                        chat = self._read_info_file(chat_name, entry.path)
+                        self._file_stats[chat_name] = file_stat
+                        if chat is None:
+                            self._chats.pop(chat_name, None)
+                        else:
+                            self._chats[chat_name] = chat
+                        changed = True
+            for chat_name in set(self._file_stats) - seen:
+                del self._file_stats[chat_name]
+                self._chats.pop(chat_name, None)
+                changed = True
+            if changed:
+                self._reindex()
+            return changed
+
+    def fingerprint(self) -> str:
+        """
+        Returns a fingerprint of the info files the registry was last refreshed from (their names, sizes and modification times), which changes whenever a chat is added, changed or removed. Anything derived from the chats' details (e.g. cached search results showing their display names) can be keyed by it.
+        """
+        self.refresh()
+        with self._lock:
+            return hashlib.sha1(repr(sorted(self._file_stats.items())).encode("utf-8")).hexdigest()
+
+    def _reindex(self) -> None:
+        chats_by_participant = {}
+        users_present_in_all_chats = None
+        for chat_name, chat in self._chats.items():
+            for participant in chat["participants"]:
+                chats_by_participant.setdefault(participant, set()).add(chat_name)
+            if users_present_in_all_chats is None:
+                users_present_in_all_chats = set(chat["participants"])
+            else:
+                users_present_in_all_chats = users_present_in_all_chats.intersection(chat["participants"])
+        self._chats_by_participant = chats_by_participant
+        self._current_user = list(users_present_in_all_chats)[0] if users_present_in_all_chats is not None and len(users_present_in_all_chats) == 1 else None
+
+    def get_chat(self, chat_name:str) -> dict:
+        """
+        Returns the details of a chat (in the format described above).
+
+        Args:
+            chat_name (str): The internal name of the chat.
+
+        Raises:
+            FileNotFoundError: If there is no info file for the chat.
+        """
+        self.refresh()
+        chat = self._chats.get(chat_name)
+        if chat is None:
+            raise FileNotFoundError(f"No info file for chat {chat_name} in {self.info_dir}")
+        return chat
+
+    def get_display_name(self, chat_name:str) -> str:
+        """Returns the display name of a chat (see `get_chat`)."""
+        return self.get_chat(chat_name)["display_name"]
+
+    def get_chat_names(self) -> list[str]:
+        """Returns the internal names of every chat, sorted."""
+        self.refresh()
+        with self._lock: # a refresh in another thread may be adding or removing chats
+            return sorted(self._chats)
+
+    def get_chats_by_platform(self) -> dict[str, list[str]]:
+        """Returns the internal names of every chat (sorted), grouped by platform."""
+        self.refresh()
+        with self._lock:
+            chat_platforms = sorted((chat_name, chat["platform"]) for chat_name, chat in self._chats.items())
+        chats_by_platform = {}
+        for chat_name, platform in chat_platforms:
+            chats_by_platform.setdefault(platform, []).append(chat_name)
+        return chats_by_platform
+
+    def get_chats_with_participant(self, participant:str) -> list[str]:
+        """Returns the internal names of the chats (sorted) that the given participant is in."""
+        self.refresh()
+        return sorted(self._chats_by_participant.get(participant, ()))
+
+    def get_current_user(self) -> str:
+        """
+        Returns the current user: the only participant present in every chat (which, as the chats are someone's exported data, must be them).
+
+        Returns:
+            (str) The current user's name, or `None` if there isn't exactly one participant present in every chat.
+        """
+        self.refresh()
+        return self._current_user
@@ -0,0 +1,209 @@
+from array import array
+import csv
+import io
+import mmap
+import os
+import struct
+import sys
+
+try:
+    csv.field_size_limit(sys.maxsize)  # may lead OverflowError
+except OverflowError:
+    csv.field_size_limit(2147483647)  # 2GB
+
+# The offsets sidecar of `<chatname>.chatlog.csv` is `<chatname>.chatlog.offsets`, written next to it:
+#
+#   header | offsets
+#
+# `offsets` is a fixed-width table of little-endian uint64s indexed by docNo: the byte offset at which the row of that docNo
+# starts in the chatlog (0, which is always the header row, for docNos with no row), followed by the offset at which the rows
+# end. The header records the size and mtime of the chatlog the offsets were taken from, so a stale sidecar is noticed, and
+# the number of rows (which, as docNos can have gaps, isn't the number of offsets).
+CHATLOG_OFFSETS_MAGIC = b"GCSOFF02"
+CHATLOG_OFFSETS_HEADER = struct.Struct("<8sQqQQ") # magic, chatlog_size, chatlog_mtime_ns, num_offsets, num_rows
+CHATLOG_OFFSETS_EXTENSION = ".offsets"
+CHATLOG_OFFSET = struct.Struct("<Q")
+
+
+def chatlog_offsets_path(chatlog_path:str) -> str:
+    """
+    Returns the path of the offsets sidecar of a chatlog (`<chatname>.chatlog.csv` -> `<chatname>.chatlog.offsets`).
+    """
+    chatlog_path = str(chatlog_path)
+    if chatlog_path.endswith(".csv"):
+        chatlog_path = chatlog_path[:-len(".csv")]
+    return chatlog_path + CHATLOG_OFFSETS_EXTENSION
+
+def _read_record(f) -> bytes:
+    """
+    Reads one CSV record from a binary file, starting at its current position. A record only ends at a line break outside of quotes, i.e. once it has an even number of `"`s (an escaped quote is written as `""`, so it doesn't change this).
+    """
+    record = f.readline()
+    while record.count(b'"') % 2:
+        line = f.readline()
+        if not line:
+            break
+        record += line
+    return record
+
+def scan_chatlog_offsets(chatlog_path:str) -> array:
+    """
+    Reads a chatlog once, recording the byte offset of the row of each docNo.
+
+    Args:
+        chatlog_path (str): The path to the `chatlog.csv` file.
+
+    Returns:
+        (array) The offsets (typecode `Q`), indexed by docNo (0 for docNos with no row), followed by the offset at which the rows end.
+    """
+    offsets = array("Q", [0])
+    with open(chatlog_path, "rb") as f:
+        _read_record(f) # the header row
+        offset = f.tell()
+        record = _read_record(f)
+        while record:
+            first_field = record.split(b",", 1)[0].strip(b'"\r\n')
+            if first_field.isdigit():
+                docNo = int(first_field)
+                if docNo >= len(offsets):
+                    offsets.extend([0] * (docNo + 1 - len(offsets)))
+                offsets[docNo] = offset
+            offset = f.tell()
+            record = _read_record(f)
+        f.close()
+    offsets.append(offset)
+    return offsets
+
+def write_chatlog_offsets(chatlog_path:str) -> str:
+    """
+    Writes the offsets sidecar of a chatlog (see `scan_chatlog_offsets`). The sidecar is written under a temporary name and moved into place, so readers never see half of it.
+
+    Args:
+        chatlog_path (str): The path to the `chatlog.csv` file.
+
+    Returns:
+        (str) The path of the sidecar.
+    """
+    stat = os.stat(chatlog_path)
+    offsets = scan_chatlog_offsets(chatlog_path)
+    num_rows = len(offsets) - 2 - offsets[1:-1].count(0)
+    if sys.byteorder == "big":
+        offsets.byteswap()
+    output_file = chatlog_offsets_path(chatlog_path)
+    tmp_file = f"{output_file}.tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(CHATLOG_OFFSETS_HEADER.pack(CHATLOG_OFFSETS_MAGIC, stat.st_size, stat.st_mtime_ns, len(offsets), num_rows))
+        f.write(offsets.tobytes())
+        f.close()
+    os.replace(tmp_file, output_file)
+    return output_file
+
+
+class ChatlogIndex:
+    """
+    Random access to the rows of a chatlog by docNo, through its offsets sidecar: each row is read by seeking straight to it and parsing just that row, rather than reading the whole chatlog.
+
+    The sidecar is normally written alongside the PII of the chat (see `PIIConstructor.create_pii_from_csv`). If it is missing, or was taken from an older version of the chatlog, it is (re)written when the index is opened.
+
+    Args:
+        chatlog_path (str): The path to the `chatlog.csv` file.
+        encoding (str): The encoding of the chatlog. Default is `utf-8-sig`.
+
+    Attributes:
+        columns (list[str]): The columns of the chatlog (its header row).
+        num_rows (int): The number of rows (messages) in the chatlog.
+    """
+    def __init__(self, chatlog_path:str, encoding:str="utf-8-sig"):
+        self.chatlog_path = str(chatlog_path)
+        self.encoding = encoding
+        stat = os.stat(self.chatlog_path)
+        self.chatlog_size, self.chatlog_mtime_ns = stat.st_size, stat.st_mtime_ns
+        offsets_path = chatlog_offsets_path(self.chatlog_path)
+        if not self._sidecar_is_current(offsets_path):
+            print(f"DEBUG: Writing offsets sidecar for {self.chatlog_path}")
+            write_chatlog_offsets(self.chatlog_path)
+        with open(offsets_path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            f.close()
+        with open(self.chatlog_path, "rb") as f:
+            header_row = _read_record(f)
+            f.close()
+        self.columns = next(csv.reader(io.StringIO(header_row.decode(self.encoding, errors="replace"), newline="")), [])
+        _, _, _, self._num_offsets, self.num_rows = CHATLOG_OFFSETS_HEADER.unpack_from(self._mm, 0)
+        self._rows_end = CHATLOG_OFFSET.unpack_from(self._mm, CHATLOG_OFFSETS_HEADER.size + (self._num_offsets - 1) * CHATLOG_OFFSET.size)[0]
+
+    def __repr__(self):
+        return f"Chatlog index of {self.chatlog_path} ({self.num_rows} rows, docNos up to {self.max_docNo})"
+
+    def _sidecar_is_current(self, offsets_path:str) -> bool:
+        if not os.path.exists(offsets_path):
+            return False
+        with open(offsets_path, "rb") as f:
+            header = f.read(CHATLOG_OFFSETS_HEADER.size)
+            f.close()
+        if len(header) < CHATLOG_OFFSETS_HEADER.size:
+            return False
+        magic, chatlog_size, chatlog_mtime_ns, _, _ = CHATLOG_OFFSETS_HEADER.unpack(header)
+        return magic == CHATLOG_OFFSETS_MAGIC and chatlog_size == self.chatlog_size and chatlog_mtime_ns == self.chatlog_mtime_ns
+
+    def is_stale(self) -> bool:
+        """Whether the chatlog has changed on disk since the index was opened."""
+        stat = os.stat(self.chatlog_path)
+        return stat.st_size != self.chatlog_size or stat.st_mtime_ns != self.chatlog_mtime_ns
+
+    @property
+    def max_docNo(self) -> int:
+        """The largest docNo in the chatlog. DocNos start at 1 but needn't be contiguous (each `message_<j>.json` of an Instagram export starts at `(j-1)*10000+1`), so this can be more than `num_rows`."""
+        return self._num_offsets - 2
+
+    def offset(self, docNo:int) -> int:
+        """Returns the byte offset of the row of the given docNo, or 0 if there is no such row."""
+        if not 0 < docNo <= self.max_docNo:
+            return 0
+        return CHATLOG_OFFSET.unpack_from(self._mm, CHATLOG_OFFSETS_HEADER.size + docNo * CHATLOG_OFFSET.size)[0]
+
+    def get_row(self, docNo:int) -> list[str]:
+        """
+        Returns the row of the given docNo.
+
+        Args:
+            docNo (int): The docNo of the row.
+
+        Returns:
+            (list[str]) The fields of the row (see the `chatlog.csv` columns), or `None` if there is no row with that docNo.
+        """
+        offset = self.offset(int(docNo))
+        if offset == 0:
+            return None
+        with open(self.chatlog_path, "rb") as f:
+            f.seek(offset)
+            record = _read_record(f)
+            f.close()
+        return next(csv.reader(io.StringIO(record.decode(self.encoding, errors="replace"), newline="")))
+
+    def get_rows(self, first_docNo:int, last_docNo:int) -> list[list[str]]:
+        """
+        Returns the rows of every docNo in the given (inclusive) range, in order, with a single sequential read of the bytes they span.
+
+        Args:
+            first_docNo (int): The first docNo of the range.
+            last_docNo (int): The last docNo of the range.
+
+        Returns:
+            (list[list[str]]) The rows in the range.
+        """
+        first_docNo, last_docNo = max(int(first_docNo), 1), min(int(last_docNo), self.max_docNo)
+        # the range starts at the first row in it, and ends where the row after it starts (or the rows end)
+        start = next((offset for offset in map(self.offset, range(first_docNo, last_docNo + 1)) if offset), 0)
+        if start == 0:
+            return []
+        end = next((offset for offset in map(self.offset, range(last_docNo + 1, self.max_docNo + 1)) if offset), self._rows_end)
+        with open(self.chatlog_path, "rb") as f:
+            f.seek(start)
+            data = f.read(end - start)
+            f.close()
+        rows = csv.reader(io.StringIO(data.decode(self.encoding, errors="replace"), newline=""))
+        return [row for row in rows if row and row[0].isdigit() and first_docNo <= int(row[0]) <= last_docNo]
+
+    def close(self) -> None:
+        self._mm.close()
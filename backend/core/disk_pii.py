@@ -0,0 +1,279 @@
+from .pii import PII_STATS_KEY
+from .postings_codecs import DEFAULT_CODEC, decode_frequency_arrays, decode_postings, encode_posting_arrays, encode_postings, get_codec
+from array import array
+from collections.abc import Mapping
+import mmap
+import numpy as np
+import os
+import shutil
+import struct
+import sys
+
+# The on-disk PII is a single `<chatname>.pii.bin` file laid out as
+#
+#   header | frequencies | positions | term dictionary | term strings | stats
+#
+# The term dictionary is a table of fixed-width entries sorted by term, so a term can be found by binary search straight
+# from the mmap without reading the rest of the file. Each entry points at the term's postings, which are only decoded
+# when that term is looked up. Keeping everything in one file means a rebuild can replace it atomically.
+# The postings of a term are split into a frequency stream (docNos and term frequencies) and a positions stream, kept in
+# separate regions of the file, so ranking only ever touches the (much smaller) frequencies.
+# The postings are compressed with one of the codecs in `core.postings_codecs`, whose id is recorded in the header.
+DISK_PII_MAGIC = b"GCSPII03"
+DISK_PII_HEADER = struct.Struct("<8sBIQQQQ") # magic, codec_id, num_terms, positions_offset, dictionary_offset, terms_offset, stats_offset
+DISK_PII_ENTRY = struct.Struct("<QIIQIQI") # term_offset, term_length, document_frequency, frequencies_offset, frequencies_length, positions_offset (within the positions region), positions_length
+DISK_PII_STATS = struct.Struct("<Id") # N, avgdl
+
+
+def _to_bytes(values:array) -> bytes:
+    # the format is little-endian regardless of the machine that wrote it
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def _from_bytes(typecode:str, data) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+class DiskPIIWriter:
+    """
+    Writes an on-disk PII term by term, so the postings never have to all be held in memory at once. Terms must be written in sorted order. The file is written under a temporary name and moved into place by `close`.
+
+    Args:
+        output_file (str): The path to write the PII to (conventionally `<chatname>.pii.bin`).
+        codec (str): The name of the postings codec to compress the postings with (see `core.postings_codecs`). Default is `DEFAULT_CODEC`.
+    """
+    def __init__(self, output_file:str, codec:str=DEFAULT_CODEC):
+        self.output_file = str(output_file)
+        self.codec = get_codec(codec)
+        self._tmp_file = f"{self.output_file}.tmp"
+        self._f = open(self._tmp_file, "wb")
+        self._f.write(b"\0" * DISK_PII_HEADER.size) # filled in by `close`
+        # positions are written to a side file and appended after all the frequencies by `close`
+        self._positions_file = f"{self.output_file}.positions.tmp"
+        self._positions_f = open(self._positions_file, "wb")
+        self._entries = []
+        self._terms = bytearray()
+        self._last_term = None
+
+    def write_term(self, term:str, document_frequency:int, encoded_postings:tuple[bytes, bytes]) -> None:
+        """
+        Appends a term and its (already encoded) postings.
+
+        Args:
+            term (str): The term. Must sort after every term written so far.
+            document_frequency (int): The number of documents containing the term.
+            encoded_postings (tuple[bytes, bytes]): The frequency and positions streams of the term, encoded with `encode_postings` using the writer's codec.
+        """
+        if self._last_term is not None and term <= self._last_term:
+            raise ValueError(f"Terms must be written in sorted order (\"{term}\" after \"{self._last_term}\")")
+        self._last_term = term
+        term_bytes = term.encode("utf-8")
+        frequencies, positions = encoded_postings
+        self._entries.append((len(self._terms), len(term_bytes), document_frequency, self._f.tell(), len(frequencies), self._positions_f.tell(), len(positions)))
+        self._terms.extend(term_bytes)
+        self._f.write(frequencies)
+        self._positions_f.write(positions)
+
+    def close(self, doc_lengths:dict, N:int, avgdl:float) -> None:
+        """
+        Writes the term dictionary and collection statistics, and moves the finished file into place.
+
+        Args:
+            doc_lengths (dict): The length (in tokens) of each document, keyed by docNo.
+            N (int): The number of documents.
+            avgdl (float): The average document length.
+        """
+        positions_offset = self._f.tell()
+        self._positions_f.close()
+        with open(self._positions_file, "rb") as positions_f:
+            shutil.copyfileobj(positions_f, self._f)
+            positions_f.close()
+        os.remove(self._positions_file)
+        dictionary_offset = self._f.tell()
+        for entry in self._entries:
+            self._f.write(DISK_PII_ENTRY.pack(*entry))
+        terms_offset = self._f.tell()
+        self._f.write(self._terms)
+        stats_offset = self._f.tell()
+        self._f.write(DISK_PII_STATS.pack(N, avgdl))
+        lengths = array("I")
+        for docNo, length in doc_lengths.items():
+            lengths.append(int(docNo))
+            lengths.append(length)
+        self._f.write(_to_bytes(lengths))
+        self._f.seek(0)
+        self._f.write(DISK_PII_HEADER.pack(DISK_PII_MAGIC, self.codec.codec_id, len(self._entries), positions_offset, dictionary_offset, terms_offset, stats_offset))
+        self._f.close()
+        os.replace(self._tmp_file, self.output_file)
+
+def write_disk_pii(pii:dict, output_file:str, codec:str=DEFAULT_CODEC) -> None:
+    """
+    Writes an in-memory PII (as built by `PIIConstructor.build_pii_from_csv`) to an on-disk PII.
+
+    Args:
+        pii (dict): The PII to write.
+        output_file (str): The path to write the PII to (conventionally `<chatname>.pii.bin`).
+        codec (str): The name of the postings codec to use. Default is `DEFAULT_CODEC`.
+    """
+    stats = pii[PII_STATS_KEY]
+    writer = DiskPIIWriter(output_file, codec)
+    for term in sorted(term for term in pii if term != PII_STATS_KEY):
+        writer.write_term(term, pii[term]["document_frequency"], encode_postings(pii[term]["postings"], writer.codec))
+    writer.close(stats["doc_lengths"], stats["N"], stats["avgdl"])
+
+def write_disk_pii_from_arrays(terms, stats:dict, output_file:str, codec:str=DEFAULT_CODEC) -> None:
+    """
+    Writes an on-disk PII straight from postings held as flat arrays (see `core.pii_build`), one term at a time, so neither the whole PII nor the postings of a term as a dict ever have to be built.
+
+    Args:
+        terms (iter): The `(term, docNos, term frequencies, positions)` of every term, in sorted term order (e.g. read lazily from a merge).
+        stats (dict): The collection statistics of the PII (`{"doc_lengths": {docNo: length}, "N": int, "avgdl": float}`).
+        output_file (str): The path to write the PII to (conventionally `<chatname>.pii.bin`).
+        codec (str): The name of the postings codec to use. Default is `DEFAULT_CODEC`.
+    """
+    writer = DiskPIIWriter(output_file, codec)
+    for term, docs, frequencies, positions in terms:
+        writer.write_term(term, len(docs), encode_posting_arrays(docs, frequencies, positions, writer.codec))
+    writer.close(stats["doc_lengths"], stats["N"], stats["avgdl"])
+
+
+class _DiskTermEntry(Mapping):
+    """
+    The `{"document_frequency": int, "frequencies": dict, "postings": dict}` entry of a single term. `frequencies` (`{docNo: tf}`) only decodes the term's frequency stream; the positions stream is only decoded if `postings` is asked for.
+    """
+    def __init__(self, disk_pii, entry:tuple):
+        self._disk_pii = disk_pii
+        _, _, self._document_frequency, self._frequencies_offset, self._frequencies_length, positions_offset, self._positions_length = entry
+        self._positions_offset = disk_pii._positions_offset + positions_offset
+        self._frequencies = None
+        self._postings = None
+
+    def frequency_arrays(self):
+        """
+        Returns the docNos (as ints, sorted) and term frequencies of the term as arrays, decoded from the frequency stream alone.
+        """
+        data = self._disk_pii._mm[self._frequencies_offset:self._frequencies_offset + self._frequencies_length]
+        return decode_frequency_arrays(data, self._disk_pii.codec)
+
+    def __getitem__(self, key:str):
+        if key == "document_frequency":
+            return self._document_frequency
+        if key == "frequencies":
+            if self._frequencies is None:
+                doc_ids, tfs = self.frequency_arrays()
+                self._frequencies = dict(zip(map(str, doc_ids.tolist()), tfs.tolist()))
+            return self._frequencies
+        if key == "postings":
+            if self._postings is None:
+                mm = self._disk_pii._mm
+                frequency_data = mm[self._frequencies_offset:self._frequencies_offset + self._frequencies_length]
+                positions_data = mm[self._positions_offset:self._positions_offset + self._positions_length]
+                self._postings = decode_postings(frequency_data, positions_data, self._disk_pii.codec)
+            return self._postings
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(("document_frequency", "frequencies", "postings"))
+
+    def __len__(self):
+        return 3
+
+
+class DiskPII(Mapping):
+    """
+    A read-only PII backed by a memory-mapped `.pii.bin` file (see `DiskPIIWriter`). The codec the postings were written with is read from the file's header. It behaves like the dictionary of a pickled PII (`term -> {"document_frequency", "postings"}`, with the collection statistics under `PII_STATS_KEY`), but only the postings of the terms that are looked up are ever read and decoded. Each term entry also has `frequencies` (`{docNo: tf}`), which is decoded without touching the term's positions.
+
+    Args:
+        pii_file (str): The path to the `.pii.bin` file.
+    """
+    def __init__(self, pii_file:str):
+        self.pii_file = str(pii_file)
+        with open(self.pii_file, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            f.close()
+        magic, codec_id, self._num_terms, self._positions_offset, self._dictionary_offset, self._terms_offset, self._stats_offset = DISK_PII_HEADER.unpack_from(self._mm, 0)
+        if magic != DISK_PII_MAGIC:
+            raise ValueError(f"{self.pii_file} is not an on-disk PII (or was written by an older version, please rebuild it)")
+        self.codec = get_codec(codec_id)
+        self._stats = None
+        self._doc_length_array = None
+
+    def __repr__(self):
+        return f"On-disk PII {self.pii_file} ({self._num_terms} terms, {self.codec.name} postings)"
+
+    @property
+    def resident_bytes(self) -> int:
+        """The size of the term dictionary and statistics, i.e. the part of the file every query reads. Postings stay on disk (or in the OS page cache) until used."""
+        return len(self._mm) - self._dictionary_offset
+
+    def _entry(self, i:int) -> tuple:
+        return DISK_PII_ENTRY.unpack_from(self._mm, self._dictionary_offset + i * DISK_PII_ENTRY.size)
+
+    def _term(self, entry:tuple) -> bytes:
+        term_offset, term_length = entry[0], entry[1]
+        start = self._terms_offset + term_offset
+        return self._mm[start:start + term_length]
+
+    def _find(self, term:str) -> tuple:
+        """Binary searches the term dictionary, returning the term's entry (or `None` if it isn't in the PII)."""
+        key = term.encode("utf-8")
+        low, high = 0, self._num_terms
+        while low < high:
+            mid = (low + high) // 2
+            entry = self._entry(mid)
+            mid_term = self._term(entry)
+            if mid_term < key:
+                low = mid + 1
+            elif mid_term > key:
+                high = mid
+            else:
+                return entry
+        return None
+
+    def doc_length_array(self) -> np.ndarray:
+        """
+        Returns the document lengths as a NumPy array indexed by docNo (0 for docNos with no tokens), read straight from the stats section.
+        """
+        if self._doc_length_array is None:
+            lengths = np.frombuffer(self._mm, dtype="<u4", offset=self._stats_offset + DISK_PII_STATS.size).reshape(-1, 2)
+            doc_length_array = np.zeros(int(lengths[:, 0].max()) + 1 if len(lengths) else 0, dtype=np.int64)
+            doc_length_array[lengths[:, 0]] = lengths[:, 1]
+            self._doc_length_array = doc_length_array
+        return self._doc_length_array
+
+    def _load_stats(self) -> dict:
+        N, avgdl = DISK_PII_STATS.unpack_from(self._mm, self._stats_offset)
+        lengths = _from_bytes("I", self._mm[self._stats_offset + DISK_PII_STATS.size:])
+        doc_lengths = {str(lengths[i]): lengths[i + 1] for i in range(0, len(lengths), 2)}
+        return {"doc_lengths": doc_lengths, "N": N, "avgdl": avgdl}
+
+    def __contains__(self, term) -> bool:
+        if term == PII_STATS_KEY:
+            return True
+        return isinstance(term, str) and self._find(term) is not None
+
+    def __getitem__(self, term:str):
+        if term == PII_STATS_KEY:
+            if self._stats is None:
+                self._stats = self._load_stats()
+            return self._stats
+        entry = self._find(term) if isinstance(term, str) else None
+        if entry is None:
+            raise KeyError(term)
+        return _DiskTermEntry(self, entry)
+
+    def __iter__(self):
+        for i in range(self._num_terms):
+            yield self._term(self._entry(i)).decode("utf-8")
+
+    def __len__(self):
+        return self._num_terms
+
+    def close(self) -> None:
+        self._mm.close()
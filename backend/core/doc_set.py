@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+# the number of set bits in each byte, for counting the members of a set (`np.bitwise_count` needs NumPy 2)
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+class DocSet:
+    """
+    A set of document ids (the ints `0 <= doc_id < size`) held as a bitset: one bit per document, packed into 64-bit words. Set operations between two `DocSet`s of the same size are whole-array NumPy operations on the words, so intersecting, uniting or subtracting the documents of even the most common terms costs a pass over `size / 64` words rather than a Python loop over their documents, and a set takes `size / 8` bytes however many documents are in it.
+
+    Supports `&` (AND), `|` (OR), `-` (AND NOT), `len` (cardinality), `in`, iteration (in ascending order) and `bool` (whether the set has any documents).
+
+    Args:
+        words (np.ndarray): The bits of the set, as `uint64` words (whose bytes hold the documents in order: bit `i % 8` of byte `i // 8` is document `i`).
+        size (int): The number of document ids the set can hold.
+    """
+    __slots__ = ["words", "size"]
+
+    def __init__(self, words:np.ndarray, size:int):
+        self.words = words
+        self.size = size
+
+    @classmethod
+    def from_mask(cls, mask:np.ndarray) -> "DocSet":
+        """Builds the set of the documents whose entry in a boolean array is `True`."""
+        packed = np.packbits(mask, bitorder="little")
+        padded = np.zeros(-(-len(packed) // 8) * 8, dtype=np.uint8)
+        padded[:len(packed)] = packed
+        return cls(padded.view(np.uint64), len(mask))
+
+    @classmethod
+    def from_doc_ids(cls, doc_ids:np.ndarray, size:int) -> "DocSet":
+        """Builds the set of the given document ids (which must all be less than `size`)."""
+        mask = np.zeros(size, dtype=bool)
+        mask[doc_ids] = True
+        return cls.from_mask(mask)
+
+    @classmethod
+    def empty(cls, size:int) -> "DocSet":
+        """Returns the empty set of the given size."""
+        return cls(np.zeros(-(-size // 64), dtype=np.uint64), size)
+
+    def __repr__(self):
+        return f"DocSet of {len(self)} documents (of {self.size})"
+
+    def _check_size(self, other:"DocSet") -> None:
+        if self.size != other.size:
+            raise ValueError(f"Can't combine DocSets of different sizes ({self.size} and {other.size})")
+
+    def __and__(self, other:"DocSet") -> "DocSet":
+        self._check_size(other)
+        return DocSet(self.words & other.words, self.size)
+
+    def __or__(self, other:"DocSet") -> "DocSet":
+        self._check_size(other)
+        return DocSet(self.words | other.words, self.size)
+
+    def __sub__(self, other:"DocSet") -> "DocSet":
+        self._check_size(other)
+        return DocSet(self.words & ~other.words, self.size)
+
+    def __len__(self):
+        return int(_POPCOUNT[self.words.view(np.uint8)].sum(dtype=np.int64))
+
+    def __bool__(self):
+        return bool(self.words.any())
+
+    def __contains__(self, doc_id:int) -> bool:
+        doc_id = int(doc_id)
+        if not 0 <= doc_id < self.size:
+            return False
+        return bool((int(self.words.view(np.uint8)[doc_id >> 3]) >> (doc_id & 7)) & 1)
+
+    def __iter__(self):
+        return iter(self.to_array().tolist())
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, DocSet) and self.size == other.size and np.array_equal(self.words, other.words)
+
+    def to_array(self) -> np.ndarray:
+        """Returns the document ids in the set, in ascending order."""
+        bits = np.unpackbits(self.words.view(np.uint8), bitorder="little")[:self.size]
+        return np.flatnonzero(bits)
@@ -0,0 +1,227 @@
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from pathlib import Path
+import argparse
+import csv
+import io
+import mmap
+import os
+import struct
+import sys
+import threading
+import zlib
+
+try:
+    csv.field_size_limit(sys.maxsize)  # may lead OverflowError
+except OverflowError:
+    csv.field_size_limit(2147483647)  # 2GB
+
+# The message store of `<chatname>.chatlog.csv` is `<chatname>.chatlog.store`, written next to it:
+#
+#   header | columns | blocks | block index
+#
+# The rows of the chatlog are grouped into blocks of `block_size` rows, and each block is stored as zlib-compressed CSV.
+# The block index holds the first docNo, offset and compressed length of every block, so fetching a row only reads and
+# decompresses the one block holding it. The header records the size and mtime of the chatlog the store was built from.
+MESSAGE_STORE_MAGIC = b"GCSMSG01"
+MESSAGE_STORE_HEADER = struct.Struct("<8sIIQQQqQI") # magic, block_size, num_blocks, num_rows, last_docNo, chatlog_size, chatlog_mtime_ns, index_offset, columns_length
+MESSAGE_STORE_EXTENSION = ".store"
+DEFAULT_MESSAGE_STORE_BLOCK_SIZE = 128
+DEFAULT_MESSAGE_STORE_CACHED_BLOCKS = 64
+
+
+def message_store_path(chatlog_path:str) -> str:
+    """
+    Returns the path of the message store of a chatlog (`<chatname>.chatlog.csv` -> `<chatname>.chatlog.store`).
+    """
+    chatlog_path = str(chatlog_path)
+    if chatlog_path.endswith(".csv"):
+        chatlog_path = chatlog_path[:-len(".csv")]
+    return chatlog_path + MESSAGE_STORE_EXTENSION
+
+def _encode_rows(rows:list[list[str]]) -> bytes:
+    buffer = io.StringIO(newline="")
+    csv.writer(buffer, lineterminator="\n").writerows(rows)
+    return buffer.getvalue().encode("utf-8")
+
+def _decode_rows(data:bytes) -> list[list[str]]:
+    return list(csv.reader(io.StringIO(data.decode("utf-8"), newline="")))
+
+def write_message_store(chatlog_path:str, output_file:str=None, block_size:int=DEFAULT_MESSAGE_STORE_BLOCK_SIZE, encoding:str="utf-8-sig") -> str:
+    """
+    Builds the message store of a chatlog. The chatlog is read once, a block at a time, and the store is written under a temporary name and moved into place.
+
+    Args:
+        chatlog_path (str): The path to the `chatlog.csv` file.
+        output_file (str): The path to write the store to. Defaults to `message_store_path(chatlog_path)`.
+        block_size (int): The number of rows in each block. Larger blocks compress better, but every row fetched decompresses a whole block. Default is `DEFAULT_MESSAGE_STORE_BLOCK_SIZE`.
+        encoding (str): The encoding of the chatlog. Default is `utf-8-sig`.
+
+    Returns:
+        (str) The path of the store.
+    """
+    output_file = str(output_file) if output_file is not None else message_store_path(chatlog_path)
+    tmp_file = f"{output_file}.tmp"
+    stat = os.stat(chatlog_path)
+    first_docNos, offsets, lengths = array("Q"), array("Q"), array("I")
+    num_rows = 0
+    last_docNo = 0
+    with open(chatlog_path, "r", encoding=encoding, errors="replace", newline="") as chatlog, open(tmp_file, "wb") as f:
+        reader = csv.reader(chatlog)
+        columns = _encode_rows([next(reader, [])])
+        f.write(b"\0" * MESSAGE_STORE_HEADER.size) # filled in once the blocks are written
+        f.write(columns)
+
+        def write_block(block:list[list[str]]) -> None:
+            compressed = zlib.compress(_encode_rows(block))
+            first_docNos.append(int(block[0][0]))
+            offsets.append(f.tell())
+            lengths.append(len(compressed))
+            f.write(compressed)
+
+        block = []
+        for row in reader:
+            if not row:
+                continue
+            block.append(row)
+            num_rows += 1
+            last_docNo = max(last_docNo, int(row[0]))
+            if len(block) == block_size:
+                write_block(block)
+                block = []
+        if block:
+            write_block(block)
+
+        index_offset = f.tell()
+        for values in (first_docNos, offsets, lengths):
+            if sys.byteorder == "big":
+                values.byteswap()
+            f.write(values.tobytes())
+        f.seek(0)
+        f.write(MESSAGE_STORE_HEADER.pack(MESSAGE_STORE_MAGIC, block_size, len(first_docNos), num_rows, last_docNo, stat.st_size, stat.st_mtime_ns, index_offset, len(columns)))
+        chatlog.close()
+        f.close()
+    os.replace(tmp_file, output_file)
+    return output_file
+
+def create_message_stores_from_folder(input_dir:str="out/chatlogs", block_size:int=DEFAULT_MESSAGE_STORE_BLOCK_SIZE) -> None:
+    """
+    Builds the message store of every `chatlog.csv` file in a directory. Wrapper for `write_message_store`.
+
+    Args:
+        input_dir (str): The directory containing the `chatlog.csv` files (relative to `core`). Defaults to `out/chatlogs`.
+        block_size (int): The number of rows in each block. Default is `DEFAULT_MESSAGE_STORE_BLOCK_SIZE`.
+    """
+    input_path = Path(os.path.dirname(os.path.abspath(__file__))) / input_dir
+    for file in sorted(os.listdir(input_path)):
+        if file.endswith(".chatlog.csv"):
+            chatlog_path = input_path / file
+            store_path = write_message_store(chatlog_path, block_size=block_size)
+            print(f"{file}: {os.path.getsize(chatlog_path)} -> {os.path.getsize(store_path)} bytes")
+
+
+class MessageStore:
+    """
+    Random access to the rows of a chatlog by docNo, from its message store (see `write_message_store`). Fetching a row decompresses the block holding it, and the most recently used decompressed blocks are kept, so fetching the rows around it (e.g. for a context window) is free.
+
+    Args:
+        store_path (str): The path to the `.chatlog.store` file.
+        cached_blocks (int): The number of decompressed blocks to keep. Default is `DEFAULT_MESSAGE_STORE_CACHED_BLOCKS`.
+
+    Attributes:
+        columns (list[str]): The columns of the chatlog.
+        num_rows (int): The number of rows in the store.
+        max_docNo (int): The largest docNo in the store. DocNos start at 1 but needn't be contiguous (each `message_<j>.json` of an Instagram export starts at `(j-1)*10000+1`), so this can be more than `num_rows`.
+    """
+    def __init__(self, store_path:str, cached_blocks:int=DEFAULT_MESSAGE_STORE_CACHED_BLOCKS):
+        self.store_path = str(store_path)
+        self.cached_blocks = cached_blocks
+        with open(self.store_path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.store_mtime_ns = os.fstat(f.fileno()).st_mtime_ns
+            f.close()
+        magic, self.block_size, num_blocks, self.num_rows, self.max_docNo, self.chatlog_size, self.chatlog_mtime_ns, index_offset, columns_length = MESSAGE_STORE_HEADER.unpack_from(self._mm, 0)
+        if magic != MESSAGE_STORE_MAGIC:
+            raise ValueError(f"{self.store_path} is not a message store (or was written by an older version, please rebuild it)")
+        self.columns = _decode_rows(self._mm[MESSAGE_STORE_HEADER.size:MESSAGE_STORE_HEADER.size + columns_length])[0]
+        index = []
+        for typecode, item_size in (("Q", 8), ("Q", 8), ("I", 4)):
+            values = array(typecode)
+            values.frombytes(self._mm[index_offset:index_offset + num_blocks * item_size])
+            if sys.byteorder == "big":
+                values.byteswap()
+            index.append(values.tolist())
+            index_offset += num_blocks * item_size
+        self._first_docNos, self._offsets, self._lengths = index
+        self._blocks = OrderedDict() # block number -> (rows, {docNo: row})
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"Message store {self.store_path} ({self.num_rows} rows in {len(self._first_docNos)} blocks)"
+
+    def is_current(self, chatlog_path:str) -> bool:
+        """Whether the store was built from the chatlog as it is now on disk (a store whose chatlog has been deleted is always current)."""
+        if not os.path.exists(chatlog_path):
+            return True
+        stat = os.stat(chatlog_path)
+        return stat.st_size == self.chatlog_size and stat.st_mtime_ns == self.chatlog_mtime_ns
+
+    def _block(self, block_number:int) -> tuple[list[list[str]], dict]:
+        with self._lock:
+            if block_number in self._blocks:
+                self._blocks.move_to_end(block_number)
+                return self._blocks[block_number]
+        offset = self._offsets[block_number]
+        rows = _decode_rows(zlib.decompress(self._mm[offset:offset + self._lengths[block_number]]))
+        block = (rows, {int(row[0]): row for row in rows})
+        with self._lock:
+            self._blocks[block_number] = block
+            while len(self._blocks) > self.cached_blocks:
+                self._blocks.popitem(last=False)
+        return block
+
+    def get_row(self, docNo:int) -> list[str]:
+        """
+        Returns the row of the given docNo.
+
+        Args:
+            docNo (int): The docNo of the row.
+
+        Returns:
+            (list[str]) The fields of the row (see the `chatlog.csv` columns), or `None` if there is no row with that docNo.
+        """
+        docNo = int(docNo)
+        block_number = bisect_right(self._first_docNos, docNo) - 1
+        if block_number < 0:
+            return None
+        return self._block(block_number)[1].get(docNo)
+
+    def get_rows(self, first_docNo:int, last_docNo:int) -> list[list[str]]:
+        """
+        Returns the rows of every docNo in the given (inclusive) range, in order, decompressing only the blocks that overlap it.
+
+        Args:
+            first_docNo (int): The first docNo of the range.
+            last_docNo (int): The last docNo of the range.
+
+        Returns:
+            (list[list[str]]) The rows in the range.
+        """
+        rows = []
+        block_number = max(bisect_right(self._first_docNos, first_docNo) - 1, 0)
+        while block_number < len(self._first_docNos) and self._first_docNos[block_number] <= last_docNo:
+            rows.extend(row for row in self._block(block_number)[0] if first_docNo <= int(row[0]) <= last_docNo)
+            block_number += 1
+        return rows
+
+    def close(self) -> None:
+        self._mm.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Builds the block-compressed message store of every chatlog in a directory")
+    parser.add_argument("--input-dir", type=str, default="out/chatlogs", help="Directory containing the chatlog.csv files (relative to core)")
+    parser.add_argument("--block-size", type=int, default=DEFAULT_MESSAGE_STORE_BLOCK_SIZE, help="Number of messages in each compressed block")
+    args = parser.parse_args()
+    create_message_stores_from_folder(args.input_dir, args.block_size)
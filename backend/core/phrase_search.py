@@ -1,92 +1,94 @@
-import re
+# -*- coding: utf-8 -*-
+from .bm25 import doc_sort_key
+from .proximity_search import intersect_documents
+from bisect import bisect_left
+import heapq
 
 
-def parse_query(query: str, pos_inv_index: dict, collection: dict) -> list:
+def gallop(positions:list[int], target:int, lo:int=0) -> int:
     """
-    Parses a boolean query into an intermediate representation. This supports:
-    - Boolean operators: AND, OR, NOT
-    - Proximity searches: #n(term1, term2, ...)
-    - Phrase searches: "phrase search"
+    Finds the first index at or after `lo` whose position is at least `target`, by galloping: the step forward from `lo` is doubled until it passes `target`, and only that last step is binary searched. This takes O(log d), where d is how far the answer is from `lo`, so walking a cursor forward through a long position list only pays for how far it actually moves.
 
     Args:
-        query (str): The input query string.
-        pos_inv_index (dict): The positional inverted index.
-        collection (dict): The collection of documents.
+        positions (list[int]): The sorted positions.
+        target (int): The position to find.
+        lo (int): The index to search from. Default is 0.
 
     Returns:
-        list: A list containing search results and boolean operators.
+        (int) The index of the first position at least `target` (`len(positions)` if there is none).
     """
-    # Split the query using boolean operators while preserving the structure
-    query_terms = re.split(r'\s*\b(AND|OR|NOT)\b\s*', query)
-    query_terms = [term.strip() for term in query_terms if term.strip()]
-
-    parsed_query = []
-    i = 0
-
-    while i < len(query_terms):
-        term = query_terms[i]
-
-        if term.startswith("#"):  # Proximity search
-            match = re.match(r'#(\d+)\(([^)]+)\)', term)
-            if match:
-                n = int(match.group(1))
-                terms = match.group(2).split(", ")
-                parsed_query.append(proximity_search(n, terms, pos_inv_index, collection))
-            else:
-                print(f"Warning: Invalid proximity search format: {term}")
-
-        elif term.startswith('"') and term.endswith('"'):  # Phrase search
-            parsed_query.append(phrase_search(term, pos_inv_index, collection))
+    if lo >= len(positions) or positions[lo] >= target:
+        return lo
+    step = 1
+    while lo + step < len(positions) and positions[lo + step] < target:
+        lo += step
+        step *= 2
+    return bisect_left(positions, target, lo + 1, min(lo + step, len(positions)))
+
+def count_phrase_occurrences(position_lists:list[list[int]]) -> int:
+    """
+    Counts the occurrences of a phrase in a document, i.e. the positions p at which the i-th term of the phrase is at p + i for every i.
 
-        elif term in {"AND", "OR", "NOT"}:  # Boolean operators
-            if term == "OR":
-                if i + 1 < len(query_terms) and query_terms[i + 1] == "NOT":
-                    i += 1  # OR NOT behaves the same as OR
-                parsed_query.append("|")
-            elif term == "NOT":
-                parsed_query.append("!")
-            elif term == "AND":
-                if i + 1 < len(query_terms) and query_terms[i + 1] == "NOT":
-                    parsed_query.append("&!")
-                    i += 1
-                else:
-                    parsed_query.append("&")
+    The candidate start of the phrase leapfrogs through the position lists (shortest first): each list is galloped to where its term should be, and if it is past that, the start jumps forward to match it. The start only ever moves forward, so each list is walked at most once, and the long lists of common terms are mostly skipped over rather than read.
 
-        else:  # Single term search
-            parsed_query.append(search_for_one_term(term, pos_inv_index))
+    Args:
+        position_lists (list[list[int]]): The sorted positions of each term of the phrase in the document, in phrase order (a term repeated in the phrase is repeated here).
 
-        i += 1
+    Returns:
+        (int) The number of occurrences of the phrase.
+    """
+    order = sorted(range(len(position_lists)), key=lambda i: len(position_lists[i]))
+    cursors = [0] * len(position_lists)
+    start = position_lists[order[0]][0] - order[0]
+    matches = 0
+    while True:
+        for i in order:
+            positions = position_lists[i]
+            cursors[i] = gallop(positions, start + i, cursors[i])
+            if cursors[i] == len(positions):
+                return matches
+            if positions[cursors[i]] != start + i:
+                start = positions[cursors[i]] - i
+                break
+        else:
+            matches += 1
+            start += 1
+
+def match_phrase(terms:list[str], positional_index:dict) -> dict:
+    """
+    Finds every document containing the terms as a phrase (consecutive positions, in order).
 
-    return parsed_query
+    The documents containing every term are found first (see `intersect_documents`), so positions are only read for those. Positions are those of the tokenised messages in the PII, so the phrase must be tokenised the same way: stopwords dropped from both are simply skipped over.
 
+    Args:
+        terms (list[str]): The (tokenised) terms of the phrase, in order.
+        positional_index (dict): The PII to search in.
 
-def phrase_search(phrase: str, pos_inv_index: dict, collection: dict) -> set:
+    Returns:
+        (dict) The number of occurrences of the phrase in each document containing it, in the format `{docNo: count}`.
     """
-    Performs a phrase search using a positional inverted index.
+    if not terms or any(term not in positional_index for term in terms):
+        return {}
+    distinct_terms = list(dict.fromkeys(terms))
+    candidates = intersect_documents([positional_index[term] for term in distinct_terms])
+    postings = {term: positional_index[term]["postings"] for term in distinct_terms}
+    doc_counts = {}
+    for docNo in candidates:
+        count = count_phrase_occurrences([postings[term][docNo] for term in terms])
+        if count > 0:
+            doc_counts[docNo] = count
+    return doc_counts
+
+def phrase_search(terms:list[str], positional_index:dict, top_n:int=25) -> list[tuple[str, int]]:
+    """
+    Finds the documents containing the terms as a phrase, scored by how many times they contain it (see `match_phrase`).
 
     Args:
-        phrase (str): The phrase to search for.
-        pos_inv_index (dict): The positional inverted index.
-        collection (dict): The collection of documents.
+        terms (list[str]): The (tokenised) terms of the phrase, in order.
+        positional_index (dict): The PII to search in.
+        top_n (int): The number of results to return. Default is 25.
 
     Returns:
-        set: A set of document IDs containing the phrase.
+        (list[tuple[str, int]]) The top N results in the format `(docNo, score)`, with ties broken by ascending docNo.
     """
-    phrase_terms = pre_process_document(phrase)
-
-    if not phrase_terms:
-        return set()
-
-    # Get documents where all terms appear
-    docs_with_all_terms = set.intersection(*[search_for_one_term(term, pos_inv_index) for term in phrase_terms])
-
-    results = set()
-
-    for doc_id in docs_with_all_terms:
-        doc = collection.get(doc_id, [])
-        for i in range(len(doc) - len(phrase_terms) + 1):
-            if doc[i:i + len(phrase_terms)] == phrase_terms:
-                results.add(doc_id)
-                break  # Stop checking after the first match
-
-    return results
\ No newline at end of file
+    return heapq.nsmallest(top_n, match_phrase(terms, positional_index).items(), key=lambda x: (-x[1], doc_sort_key(x[0])))
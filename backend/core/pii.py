@@ -1,11 +1,16 @@
 from core.tokenisers.ttds_tokeniser import Tokeniser
+from core.chatlog_index import write_chatlog_offsets
+from core.message_store import write_message_store
+from core.pii_build import SPIMIIndexer, index_chunk, index_rows, postings_from_entries, read_chatlog_chunks
+from collections import deque
 import csv
 import os
 from pathlib import Path
 import concurrent.futures
-from functools import reduce
+import hashlib
 import math
 import pickle
+import secrets
 import sys
 
 try:
@@ -13,6 +18,173 @@ try:
 except OverflowError:
     csv.field_size_limit(2147483647)  # 2GB
 
+# reserved key under which the collection statistics of a PII are stored. Tokens never contain underscores, so this can't collide with a term
+PII_STATS_KEY = "__stats__"
+# reserved key under which a unified PII stores its chat table (chat id -> internal chat name)
+PII_CHATS_KEY = "__chats__"
+# name of the sidecar (in the PII directory) holding the statistics of the whole corpus of PIIs
+GLOBAL_STATS_FILENAME = "global_stats.pkl"
+# name of the single corpus-wide PII (in the PII directory) built by `create_unified_pii_from_folder`
+UNIFIED_PII_FILENAME = "corpus.unified.pkl"
+# name of the file (in the PII directory) holding the generation of the index, a random build id rewritten whenever anything in it is rebuilt or removed
+INDEX_GENERATION_FILENAME = "index_generation"
+# number of messages in each chunk handed to a build worker process. Chunks are kept small so the workers stay evenly loaded, and can work on several chats at once
+BUILD_CHUNK_ROWS = 8192
+def get_term_frequencies(term_entry) -> dict:
+    """
+    Returns the term frequency of a term in each document containing it. On-disk PIIs store these separately from the positions (under `frequencies`), so ranking doesn't need to decode positions at all; for pickled PIIs they are the lengths of the position lists.
+
+    Args:
+        term_entry (dict): The entry of the term in a PII (`pii[term]`).
+
+    Returns:
+        dict: `{docNo: tf}`
+    """
+    if "frequencies" in term_entry:
+        return term_entry["frequencies"]
+    return {docNo: len(positions) for docNo, positions in term_entry["postings"].items()}
+
+def read_index_generation(pii_dir:str) -> str:
+    """
+    Returns the generation of the index in a PII directory: a random build id written afresh every time a PII (or the corpus-wide statistics) in it is rebuilt or removed, so anything derived from the index (e.g. cached search results) can tell whether it is still current. Unlike a counter, a build id never comes back once the directory is wiped and rebuilt.
+
+    Args:
+        pii_dir (str): The directory the PIIs are stored in.
+
+    Returns:
+        str: The generation, or `None` if the directory has never been written to by a `PIIConstructor` that records them.
+    """
+    try:
+        with open(os.path.join(pii_dir, INDEX_GENERATION_FILENAME), "r") as f:
+            generation = f.read().strip()
+            f.close()
+    except FileNotFoundError:
+        return None
+    return generation or None
+
+def bump_index_generation(pii_dir:str) -> str:
+    """
+    Starts a new generation of the index in a PII directory (see `read_index_generation`). The build id is written under a temporary name and moved into place, so readers never see half of it.
+
+    Args:
+        pii_dir (str): The directory the PIIs are stored in.
+
+    Returns:
+        str: The new generation.
+    """
+    generation = secrets.token_hex(16)
+    generation_path = os.path.join(pii_dir, INDEX_GENERATION_FILENAME)
+    tmp_path = f"{generation_path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(generation)
+        f.close()
+    os.replace(tmp_path, generation_path)
+    return generation
+
+def index_fingerprint(pii_dir:str) -> str:
+    """
+    Returns a fingerprint of the files in a PII directory (their names, sizes and modification times), which changes whenever a file in it is written, replaced or deleted, including by hand (which doesn't bump the generation of the index).
+
+    Args:
+        pii_dir (str): The directory the PIIs are stored in.
+
+    Returns:
+        str: The fingerprint, or `None` if the directory doesn't exist.
+    """
+    if not os.path.isdir(pii_dir):
+        return None
+    listing = []
+    with os.scandir(pii_dir) as entries:
+        for entry in entries:
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                listing.append((entry.name, stat.st_size, stat.st_mtime_ns))
+    return hashlib.sha1(repr(sorted(listing)).encode("utf-8")).hexdigest()
+
+# extensions of the per-chat PII formats, in order of preference: the on-disk (mmap) format, then the pickled format
+PII_EXTENSIONS = (".pii.bin", ".pii.pkl")
+
+def list_pii_names(pii_dir:str) -> list[str]:
+    """
+    Lists the names of all per-chat PIIs in a directory, in either format.
+
+    Args:
+        pii_dir (str): The directory the PIIs are stored in.
+
+    Returns:
+        list[str]: The PII names (`<chatname>` for `<chatname>.pii.pkl` or `<chatname>.pii.bin`).
+    """
+    names = set()
+    for pii_file in os.listdir(pii_dir):
+        for extension in PII_EXTENSIONS:
+            if pii_file.endswith(extension):
+                names.add(pii_file[:-len(extension)])
+    return sorted(names)
+
+def find_pii_file(pii_dir:str, pii_name:str) -> str:
+    """
+    Finds the file of a per-chat PII, preferring the on-disk format if the chat has both.
+
+    Args:
+        pii_dir (str): The directory the PIIs are stored in.
+        pii_name (str): The name of the PII.
+
+    Returns:
+        str: The path to the PII file, or `None` if there isn't one.
+    """
+    for extension in PII_EXTENSIONS:
+        pii_path = os.path.join(pii_dir, f"{pii_name}{extension}")
+        if os.path.exists(pii_path):
+            return pii_path
+    return None
+
+def load_pii_file(pii_path:str) -> dict:
+    """
+    Loads a per-chat PII file. Pickled PIIs are loaded into a dict; on-disk PIIs are memory-mapped as a `DiskPII`, which behaves like that dict.
+
+    Args:
+        pii_path (str): The path to the PII file.
+    """
+    if str(pii_path).endswith(".pii.bin"):
+        from core.disk_pii import DiskPII
+        return DiskPII(pii_path)
+    with open(pii_path, "rb") as f:
+        pii = pickle.load(f)
+        f.close()
+    return pii
+
+def close_pii(pii:dict) -> None:
+    """
+    Closes a PII loaded by `load_pii_file`. On-disk PIIs are unmapped, so their file can be replaced or deleted (which Windows refuses while it is mapped); pickled PIIs have nothing to close.
+
+    Args:
+        pii (dict): The PII.
+    """
+    if hasattr(pii, "close"):
+        pii.close()
+
+def get_collection_stats(pii:dict) -> dict:
+    """
+    Returns the collection statistics (`doc_lengths`, `N` and `avgdl`) of a PII.
+
+    These are computed once when the PII is built. PIIs built before this was the case don't have them, so for those we fall back to walking the whole index.
+
+    Args:
+        pii (dict): The PII to get the statistics of.
+
+    Returns:
+        dict: `{"doc_lengths": {docNo: length}, "N": int, "avgdl": float}`
+    """
+    if PII_STATS_KEY in pii:
+        return pii[PII_STATS_KEY]
+    doc_lengths = {}
+    for term in pii:
+        if "postings" in pii[term]:
+            for docNo, positions in pii[term]["postings"].items():
+                doc_lengths[docNo] = max(doc_lengths.get(docNo, 0), max(positions)) # positions start at 1, so the last one is the length
+    N = len(doc_lengths)
+    return {"doc_lengths": doc_lengths, "N": N, "avgdl": sum(doc_lengths.values()) / N if N > 0 else 0}
+
 
 class PIIConstructor:
     """
@@ -20,50 +192,168 @@ class PIIConstructor:
 
     Args:
         language (str): The language of the chatlog files used. Defaults to `english`. No checks are made to ensure the language is correct, **undefined behaviour may occur in a language mismatch**.
+        index_format (str): The format PIIs are written in by `create_pii_from_csv`. Either '`pickle`' (`<chatname>.pii.pkl`, loaded whole) or '`disk`' (`<chatname>.pii.bin`, memory-mapped and decoded per term, see `core.disk_pii`). Defaults to '`pickle`'.
+        postings_codec (str): The codec used to compress the postings of on-disk PIIs, one of '`raw`', '`varint`' or '`bitpack`' (see `core.postings_codecs`). Defaults to '`varint`'.
+        message_store (bool): Whether `create_pii_from_csv` also builds the block-compressed message store of each chatlog (see `core.message_store`), which the `Searcher` then reads messages from. Defaults to `False`.
+        build_processes (int): The number of worker processes to tokenise messages in. With more than one, chatlogs are split into chunks of `BUILD_CHUNK_ROWS` messages, each worker indexes its chunks into compact partial indexes (see `core.pii_build.index_chunk`), and these are merged into the PII with a k-way merge. Tokenising is pure Python, so threads can't do it in parallel, but processes can. `create_piis_from_folder` then also builds several chats at once. Defaults to 1 (tokenise in threads of this process).
+        memory_budget (int): If given, chatlogs are indexed as they are streamed in (in chunks of `BUILD_CHUNK_ROWS` messages) rather than read whole, and once the postings built so far take more than this many bytes they are spilled to disk as a sorted run, with the runs merged at the end (see `core.pii_build.SPIMIIndexer`). With the '`disk`' index format, the merge is written straight to the `.pii.bin` file, so the memory used is bounded by the budget however large the chat; a pickled PII has to be built in memory whole regardless. Defaults to `None` (read each chatlog whole and index it in memory).
+        spill_dir (str): The directory the runs spilled past `memory_budget` are written to. Defaults to `None` (the system's temporary directory).
+        segmentation_workers (int): For the Chinese languages, the number of worker processes (with the segmentation model loaded) to segment messages in (see `core.tokenisers.segmentation_pool`). Unused if `build_processes` is more than 1, as each build worker then segments its own chunks. Defaults to 0 (segment in the threads of this process).
     """
-    def __init__(self, language:str='english'):
+    def __init__(self, language:str='english', index_format:str='pickle', postings_codec:str='varint', message_store:bool=False, build_processes:int=1, memory_budget:int=None, spill_dir:str=None, segmentation_workers:int=0):
+        if index_format not in ["pickle", "disk"]:
+            raise ValueError(f"Unsupported index format: {index_format}")
         self.language = language
-        self.tokeniser = Tokeniser(language=language)
+        self.index_format = index_format
+        self.postings_codec = postings_codec
+        self.message_store = message_store
+        self.build_processes = build_processes
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self.tokeniser = Tokeniser(language=language, segmentation_workers=segmentation_workers if build_processes <= 1 else 0)
         
     def __repr__(self):
         return f"PII Constructor tokenising using \"{self.tokeniser.language}\" tokeniser"
     
-    def _process_chunk(self, rows: list) -> dict:
-        """Process a chunk of rows and return a partial index."""
-        index = {}
-        for row in rows:
-            docNo = row["docNo"]
-            message = row["message"]
-            try:
-                tokens = self.tokeniser.tokenise(message)
-            except:
-                continue
-            for position, term in enumerate(tokens, 1):
-                if term not in index:
-                    index[term] = {"document_frequency": 0, "postings": {}}
+    def _process_chunk(self, rows: list) -> tuple[list, tuple]:
+        """Process a chunk of `(docNo, message)` rows and return a compact partial index, along with the lengths (in tokens) of the documents in it (see `core.pii_build.index_rows`)."""
+        return index_rows(self.tokeniser, rows)
+
+    def _collection_stats(self, doc_lengths:dict) -> dict:
+        """
+        Computes the collection statistics stored under `PII_STATS_KEY`, so that searching doesn't have to walk the whole index to find them.
+
+        Args:
+            doc_lengths (dict): The length (in tokens) of each document with at least one token, keyed by docNo.
+
+        Returns:
+            dict: `{"doc_lengths": {docNo: length}, "N": number of documents, "avgdl": average document length}`
+        """
+        N = len(doc_lengths)
+        return {
+            "doc_lengths": doc_lengths,
+            "N": N,
+            "avgdl": sum(doc_lengths.values()) / N if N > 0 else 0,
+        }
+
+    def _read_rows(self, csv_file_path:str) -> list[tuple[int, str]]:
+        """Reads the `(docNo, message)` of every message of a chatlog."""
+        with open(csv_file_path, 'r', encoding='utf-8-sig') as f:
+            rows = [(int(row["docNo"]), row["message"]) for row in csv.DictReader(f)]
+            f.close()
+        return rows
 
-                if docNo not in index[term]["postings"]:
-                    index[term]["document_frequency"] += 1
-                    index[term]["postings"][docNo] = []
+    def _collect_partial_indexes(self, futures:list) -> SPIMIIndexer:
+        """Collects the partial indexes of a chatlog's chunks (in order) into a `SPIMIIndexer`, or returns `None` if the chatlog has no messages."""
+        if len(futures) == 0:
+            return None
+        indexer = SPIMIIndexer(self.memory_budget, self.spill_dir)
+        try:
+            for future in futures:
+                indexer.add_chunk(*future.result())
+        except BaseException:
+            indexer.close()
+            raise
+        return indexer
+
+    def _index_in_threads(self, csv_file_path:str, num_threads:int) -> SPIMIIndexer:
+        """Reads a chatlog whole and indexes it in `num_threads` chunks, one per thread."""
+        rows = self._read_rows(csv_file_path)
+        if len(rows) == 0:
+            return None
+        chunk_size = math.ceil(len(rows) / num_threads)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
+            return self._collect_partial_indexes([executor.submit(self._process_chunk, rows[i:i+chunk_size]) for i in range(0, len(rows), chunk_size)])
+
+    def _submit_chunks(self, executor:concurrent.futures.ProcessPoolExecutor, csv_file_path:str) -> list:
+        """Reads a chatlog and submits its messages to the build workers in chunks of `BUILD_CHUNK_ROWS`, returning the futures of their partial indexes."""
+        rows = self._read_rows(csv_file_path)
+        return [executor.submit(index_chunk, self.language, rows[i:i+BUILD_CHUNK_ROWS]) for i in range(0, len(rows), BUILD_CHUNK_ROWS)]
+
+    def _spimi_index(self, csv_file_path:str, executor:concurrent.futures.ProcessPoolExecutor=None) -> SPIMIIndexer:
+        """Streams a chatlog chunk by chunk into a `SPIMIIndexer`, indexing the chunks in the build workers if an executor is given. Returns `None` if the chatlog has no messages."""
+        indexer = SPIMIIndexer(self.memory_budget, self.spill_dir)
+        pending = deque()
+        has_messages = False
+        try:
+            for rows in read_chatlog_chunks(csv_file_path, BUILD_CHUNK_ROWS):
+                has_messages = True
+                if executor is None:
+                    indexer.add_chunk(*self._process_chunk(rows))
+                    continue
+                pending.append(executor.submit(index_chunk, self.language, rows))
+                # only read a few chunks ahead of the workers, so the chatlog is never held in memory whole
+                if len(pending) > 2 * self.build_processes:
+                    indexer.add_chunk(*pending.popleft().result())
+            while pending:
+                indexer.add_chunk(*pending.popleft().result())
+        except BaseException:
+            indexer.close()
+            raise
+        if not has_messages:
+            indexer.close()
+            return None
+        return indexer
 
-                index[term]["postings"][docNo].append(position)
+    def _pii_from_indexer(self, indexer:SPIMIIndexer) -> dict:
+        """Merges the postings collected by a `SPIMIIndexer` into a PII, deleting its runs once done."""
+        try:
+            doc_lengths = indexer.doc_lengths()
+            doc_keys = {int(docNo): docNo for docNo in doc_lengths} # one docNo string per document, shared by all of its postings
+            pii = {entry[0]: postings_from_entries([entry], doc_keys) for entry in indexer.merged_terms()}
+            pii[PII_STATS_KEY] = self._collection_stats(doc_lengths)
+        finally:
+            indexer.close()
+        return pii
+
+    def _index_csvs(self, csv_file_paths:list[str], num_threads:int=os.cpu_count()) -> iter:
+        """
+        Indexes several `chatlog.csv` files into `SPIMIIndexer`s, holding the compact postings of each chat (see `core.pii_build.PostingsAccumulator`), which `_write_chat_pii` can write straight to an on-disk PII or `_pii_from_indexer` can merge into a PII.
 
-        return index
+        With `build_processes` above 1, all the chatlogs are indexed by one pool of worker processes. Without a `memory_budget`, the chunks of the next chatlogs are queued up while the earlier ones are merged (and written out by the caller), so the workers never wait on a small chat or on writing. With one, the chatlogs are streamed through the pool one after another instead, so only a few chunks are ever in memory.
 
-    def _merge_indexes(self, indexes: list) -> dict:
-        """Merge multiple partial indexes into one."""
-        merged = {}
-        for index in indexes:
-            for term, data in index.items():
-                if term not in merged:
-                    merged[term] = {"document_frequency": 0, "postings": {}}
+        Args:
+            csv_file_paths (list[str]): Paths to the `chatlog.csv` files.
+            num_threads (int): The number of threads to index each chatlog in, if `build_processes` is 1 and there is no `memory_budget`. Defaults to `os.cpu_count()`, or 4 as a fallback.
 
-                merged[term]["document_frequency"] += data["document_frequency"]
+        Returns:
+            (iter) The `(csv_file_path, indexer)` of each chatlog, in the order given (the indexer is `None` for a chatlog with no messages).
+        """
+        if self.build_processes <= 1:
+            for csv_file_path in csv_file_paths:
+                if self.memory_budget is not None:
+                    yield csv_file_path, self._spimi_index(csv_file_path)
+                else:
+                    yield csv_file_path, self._index_in_threads(csv_file_path, num_threads or 4)
+            return
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.build_processes) as executor:
+            if self.memory_budget is not None:
+                for csv_file_path in csv_file_paths:
+                    yield csv_file_path, self._spimi_index(csv_file_path, executor)
+                return
+            pending = deque()
+            for csv_file_path in csv_file_paths:
+                pending.append((csv_file_path, self._submit_chunks(executor, csv_file_path)))
+                # the messages of every queued chatlog are held in memory, so only read a few chatlogs ahead
+                if len(pending) > self.build_processes:
+                    csv_file_path, futures = pending.popleft()
+                    yield csv_file_path, self._collect_partial_indexes(futures)
+            while pending:
+                csv_file_path, futures = pending.popleft()
+                yield csv_file_path, self._collect_partial_indexes(futures)
+
+    def build_piis_from_csvs(self, csv_file_paths:list[str]) -> iter:
+        """
+        Builds the PIIs of several `chatlog.csv` files, yielding each one as soon as it is built. With `build_processes` above 1, all the chatlogs are built by one pool of worker processes (see `_index_csvs`).
 
-                for docNo, positions in data["postings"].items():
-                    merged[term]["postings"][docNo] = positions
+        Args:
+            csv_file_paths (list[str]): Paths to the `chatlog.csv` files.
 
-        return merged
+        Returns:
+            (iter) The `(csv_file_path, pii)` of each chatlog, in the order given (the PII is `None` for a chatlog with no messages).
+        """
+        for csv_file_path, indexer in self._index_csvs(csv_file_paths):
+            yield csv_file_path, self._pii_from_indexer(indexer) if indexer is not None else None
 
     def build_pii_from_csv(self, csv_file_path:str, num_threads:int=os.cpu_count()) -> dict:
         """
@@ -71,33 +361,14 @@ class PIIConstructor:
         
         Args:
             csv_file_path (str): Path to the `chatlog.csv` file
-            num_threads (int): Number of threads to use for processing. Defaults to `os.cpu_count()`, or 4 as a fallback.
+            num_threads (int): Number of threads to use for processing. Defaults to `os.cpu_count()`, or 4 as a fallback. Ignored if `build_processes` is more than 1 or there is a `memory_budget`.
 
         Returns:
-            dict: A dictionary representing the PII. The keys are the tokens, and the values are dictionaries. The inner dictionaries have the document IDs as keys, and the positions of the tokens in the document as values.
+            dict: A dictionary representing the PII. The keys are the tokens, and the values are dictionaries. The inner dictionaries have the document IDs as keys, and the positions of the tokens in the document as values. The collection statistics (document lengths, N and avgdl) are stored under `PII_STATS_KEY`.
         """
-        if num_threads is None:
-            num_threads = 4
-
-        # Read all rows first
-        with open(csv_file_path, 'r', encoding='utf-8-sig') as f:
-            reader = csv.DictReader(f)
-            rows = list(reader)
-
-        if len(rows) == 0:
-            return None
-
-        # Calculate chunk size
-        chunk_size = math.ceil(len(rows) / num_threads)
-        chunks = [rows[i:i+chunk_size] for i in range(0, len(rows), chunk_size)]
-
-        # Process chunks in parallel
-        with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
-            futures = [executor.submit(self._process_chunk, chunk) for chunk in chunks]
-            results = [future.result() for future in concurrent.futures.as_completed(futures)]
-
-        # Merge results
-        return self._merge_indexes(results)
+        for _, indexer in self._index_csvs([csv_file_path], num_threads):
+            pii = self._pii_from_indexer(indexer) if indexer is not None else None
+        return pii
     
     def pickle_pii(self, pii:dict, output_file:str) -> None:
         """
@@ -129,6 +400,8 @@ class PIIConstructor:
         if pii is not None:
             with open(output_file, "w") as f:
                 for term, docs in pii.items():
+                    if term in (PII_STATS_KEY, PII_CHATS_KEY):
+                        continue
                     f.write(f"{term}: {docs['document_frequency']}\n")
                     for doc, positions in docs["postings"].items():
                         f.write(f"\t{doc}: {', '.join(map(str, positions))}\n")
@@ -138,7 +411,9 @@ class PIIConstructor:
         """
         Creates a PII from the given `chatlog.csv` file, and pickles it.
 
-        If the chatlog.csv file is named `<chatname>.chatlog.csv`, the PII will be written to `<chatname>.pii.txt`.
+        If the chatlog.csv file is named `<chatname>.chatlog.csv`, the PII will be written to `<chatname>.pii.pkl` (or `<chatname>.pii.bin` if `index_format` is '`disk`'). A PII of the chat in the other format is removed.
+
+        The corpus-wide statistics sidecar (`GLOBAL_STATS_FILENAME`) in the output directory is updated to account for the new PII (replacing the contribution of the chat's previous PII, if there was one), and the generation of the index is bumped (see `read_index_generation`). The offsets sidecar of the chatlog (`<chatname>.chatlog.offsets`, see `core.chatlog_index`) is written next to it, so search results can be read straight from the chatlog. If `message_store` is set, the chatlog's message store is (re)built too.
 
         Args:
             csv_file_path (str): Path to the `chatlog.csv` file
@@ -154,21 +429,252 @@ class PIIConstructor:
         if not os.path.exists(output_path):
             os.makedirs(output_path)
 
+        for csv_file_path, pii in self._index_csvs([csv_file_path]):
+            self._write_chat_pii(csv_file_path, pii, script_dir / output_dir)
+
+    def _write_chat_pii(self, csv_file_path:str, indexer:SPIMIIndexer, pii_dir:Path) -> None:
+        """Writes the PII of a chatlog from the postings indexed from it (see `_index_csvs`) to the PII directory, along with everything else `create_pii_from_csv` updates."""
+        if indexer is None:
+            return
         csv_basename = os.path.basename(csv_file_path)
         chatname = csv_basename.replace(".chatlog.csv", "")
-        
-        output_path = script_dir / output_dir / f"{chatname}.pii.pkl"
 
-        pii = self.build_pii_from_csv(csv_file_path)
-        self.pickle_pii(pii, output_path)
+        old_pii_path = find_pii_file(pii_dir, chatname)
+        global_stats = self.take_chat_out_of_global_stats(chatname, pii_dir)
+
+        if self.index_format == "disk":
+            # straight from the compact postings to the file, without building the PII as a dict first
+            from core.disk_pii import write_disk_pii_from_arrays
+            output_path = pii_dir / f"{chatname}.pii.bin"
+            try:
+                write_disk_pii_from_arrays(indexer.merged_terms(), self._collection_stats(indexer.doc_lengths()), output_path, self.postings_codec)
+            finally:
+                indexer.close()
+            pii = load_pii_file(str(output_path))
+        else:
+            pii = self._pii_from_indexer(indexer)
+            output_path = pii_dir / f"{chatname}.pii.pkl"
+            self.pickle_pii(pii, output_path)
+        if old_pii_path is not None and old_pii_path != str(output_path):
+            os.remove(old_pii_path)
+        try:
+            self.update_global_stats(chatname, pii, pii_dir, global_stats)
+        finally:
+            close_pii(pii)
+        write_chatlog_offsets(csv_file_path)
+        if self.message_store:
+            write_message_store(csv_file_path)
+        bump_index_generation(pii_dir) # once everything a search result is read from is in place
+
+    def load_global_stats(self, pii_dir:str) -> dict:
+        """
+        Loads the corpus-wide statistics sidecar from the given PII directory.
+
+        Args:
+            pii_dir (str): The directory the PIIs (and the sidecar) are stored in.
+
+        Returns:
+            dict: The global statistics (see `rebuild_global_stats` for the format), or `None` if there is no sidecar yet.
+        """
+        stats_path = os.path.join(pii_dir, GLOBAL_STATS_FILENAME)
+        if not os.path.exists(stats_path):
+            return None
+        with open(stats_path, "rb") as f:
+            global_stats = pickle.load(f)
+            f.close()
+        return global_stats
+
+    def _write_global_stats(self, global_stats:dict, pii_dir:str) -> None:
+        N = global_stats["N"]
+        global_stats["avgdl"] = global_stats["total_length"] / N if N > 0 else 0
+        # write then rename, so searchers never read a half-written sidecar
+        stats_path = os.path.join(pii_dir, GLOBAL_STATS_FILENAME)
+        tmp_path = f"{stats_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(global_stats, f)
+            f.close()
+        os.replace(tmp_path, stats_path)
+
+    def _add_to_global_stats(self, global_stats:dict, chatname:str, pii:dict, sign:int=1) -> None:
+        """Adds (`sign=1`) or removes (`sign=-1`) the contribution of a single chat's PII to the global statistics."""
+        stats = get_collection_stats(pii)
+        total_length = sum(stats["doc_lengths"].values())
+        global_stats["N"] += sign * stats["N"]
+        global_stats["total_length"] += sign * total_length
+        document_frequency = global_stats["document_frequency"]
+        for term, data in pii.items():
+            if term == PII_STATS_KEY:
+                continue
+            df = document_frequency.get(term, 0) + sign * data["document_frequency"]
+            if df > 0:
+                document_frequency[term] = df
+            else:
+                document_frequency.pop(term, None)
+        if sign > 0:
+            global_stats["chats"][chatname] = {"N": stats["N"], "total_length": total_length}
+        else:
+            global_stats["chats"].pop(chatname, None)
+
+    def take_chat_out_of_global_stats(self, chatname:str, pii_dir:str) -> dict:
+        """
+        Loads the corpus-wide statistics sidecar and takes the contribution of a chat's current PII out of it, without writing it back. This is done before the PII is rebuilt or removed, and the PII is closed again straight away: an on-disk PII is memory-mapped, and on Windows a mapped file can't be replaced or deleted.
+
+        Args:
+            chatname (str): The internal name of the chat.
+            pii_dir (str): The directory the PIIs (and the sidecar) are stored in.
+
+        Returns:
+            dict: The global statistics without the chat, or `None` if there is no sidecar yet.
+        """
+        global_stats = self.load_global_stats(pii_dir)
+        old_pii_path = find_pii_file(pii_dir, chatname)
+        if global_stats is not None and old_pii_path is not None and chatname in global_stats["chats"]:
+            old_pii = load_pii_file(old_pii_path)
+            try:
+                self._add_to_global_stats(global_stats, chatname, old_pii, sign=-1)
+            finally:
+                close_pii(old_pii)
+        return global_stats
+
+    def update_global_stats(self, chatname:str, new_pii:dict, pii_dir:str, global_stats:dict) -> None:
+        """
+        Updates the corpus-wide statistics sidecar after the PII of a single chat has been (re)built. If there is no sidecar yet, it is rebuilt from every PII in the directory instead.
+
+        Args:
+            chatname (str): The internal name of the chat whose PII was built.
+            new_pii (dict): The chat's new PII.
+            pii_dir (str): The directory the PIIs (and the sidecar) are stored in.
+            global_stats (dict): The global statistics without the chat's previous PII, as returned by `take_chat_out_of_global_stats` before it was rebuilt (`None` if there was no sidecar).
+        """
+        if global_stats is None:
+            self.rebuild_global_stats(pii_dir)
+            return
+        self._add_to_global_stats(global_stats, chatname, new_pii)
+        self._write_global_stats(global_stats, pii_dir)
+
+    def remove_pii(self, chatname:str, output_dir:str="piis") -> bool:
+        """
+        Removes the PII of a chat (in either format), taking its contribution out of the corpus-wide statistics sidecar and bumping the generation of the index (see `read_index_generation`), so nothing cached from it is served again.
+
+        Args:
+            chatname (str): The internal name of the chat.
+            output_dir (str): The directory the PIIs are stored in. Defaults to `piis`.
+
+        Returns:
+            bool: Whether the chat had a PII to remove.
+        """
+        try:
+            script_dir = Path(os.path.dirname(os.path.abspath(__file__)))
+        except NameError:
+            script_dir = Path(os.path.abspath('backend/core'))
+        pii_dir = script_dir / output_dir
+
+        pii_paths = [pii_dir / f"{chatname}{extension}" for extension in PII_EXTENSIONS if os.path.exists(pii_dir / f"{chatname}{extension}")]
+        if not pii_paths:
+            return False
+        global_stats = self.take_chat_out_of_global_stats(chatname, pii_dir)
+        if global_stats is not None:
+            self._write_global_stats(global_stats, pii_dir)
+        for pii_path in pii_paths:
+            os.remove(pii_path)
+        bump_index_generation(pii_dir)
+        return True
+
+    def rebuild_global_stats(self, pii_dir:str) -> dict:
+        """
+        Rebuilds the corpus-wide statistics sidecar from every PII in the given directory. These statistics let BM25 scores from different chats be compared with each other. The sidecar has the format
+        ```
+        {
+            "N": total number of documents across all chats,
+            "total_length": total length (in tokens) of all documents,
+            "avgdl": average document length across all chats,
+            "document_frequency": {term: number of documents across all chats containing the term},
+            "chats": {chatname: {"N": int, "total_length": int}}
+        }
+        ```
+
+        Args:
+            pii_dir (str): The directory the PIIs (and the sidecar) are stored in.
+
+        Returns:
+            dict: The rebuilt global statistics.
+        """
+        global_stats = {"N": 0, "total_length": 0, "avgdl": 0, "document_frequency": {}, "chats": {}}
+        for pii_name in list_pii_names(pii_dir):
+            pii = load_pii_file(find_pii_file(pii_dir, pii_name))
+            try:
+                self._add_to_global_stats(global_stats, pii_name, pii)
+            finally:
+                close_pii(pii)
+        self._write_global_stats(global_stats, pii_dir)
+        bump_index_generation(pii_dir)
+        return global_stats
+
+    def build_unified_pii_from_folder(self, input_dir:str) -> dict:
+        """
+        Builds a single PII covering every `chatlog.csv` file in the given directory.
+
+        The unified PII has the same shape as a normal PII, except that its postings (and document lengths) are keyed by a `(chat_id, docNo)` pair of ints rather than a docNo string. The chat table, mapping each `chat_id` to its internal chat name, is stored as a list under `PII_CHATS_KEY`. As it is one collection, its statistics under `PII_STATS_KEY` are corpus-wide.
+
+        Args:
+            input_dir (str): The directory containing the `chatlog.csv` files.
+
+        Returns:
+            dict: The unified PII.
+        """
+        unified = {}
+        chats = []
+        doc_lengths = {}
+        files = [file for file in sorted(os.listdir(input_dir)) if file.endswith(".chatlog.csv")]
+        for csv_file_path, pii in self.build_piis_from_csvs([os.path.join(input_dir, file) for file in files]):
+            print(f"Processing {os.path.basename(csv_file_path)}")
+            if pii is None:
+                continue
+            chat_id = len(chats)
+            chats.append(os.path.basename(csv_file_path).replace(".chatlog.csv", ""))
+            stats = pii.pop(PII_STATS_KEY)
+            for docNo, length in stats["doc_lengths"].items():
+                doc_lengths[(chat_id, int(docNo))] = length
+            for term, data in pii.items():
+                if term not in unified:
+                    unified[term] = {"document_frequency": 0, "postings": {}}
+                unified[term]["document_frequency"] += data["document_frequency"]
+                postings = unified[term]["postings"]
+                for docNo, positions in data["postings"].items():
+                    postings[(chat_id, int(docNo))] = positions
+        unified[PII_STATS_KEY] = self._collection_stats(doc_lengths)
+        unified[PII_CHATS_KEY] = chats
+        return unified
+
+    def create_unified_pii_from_folder(self, input_dir:str="out/chatlogs", output_dir:str="piis") -> None:
+        """
+        Creates a single corpus-wide PII from all `chatlog.csv` files in a given directory, and pickles it to `UNIFIED_PII_FILENAME` in the output directory. When present (and up to date), the `Searcher` answers queries from this one PII instead of opening every chat's PII.
+
+        Args:
+            input_dir (str): The directory containing the `chatlog.csv` files. Defaults to `out/chatlogs`.
+            output_dir (str): The directory to write the PII to. Defaults to `piis`.
+        """
+        try:
+            script_dir = Path(os.path.dirname(os.path.abspath(__file__)))
+        except NameError:
+            script_dir = Path(os.path.abspath('backend/core'))
+
+        output_path = script_dir / output_dir
+        if not os.path.exists(output_path):
+            os.makedirs(output_path)
+
+        unified = self.build_unified_pii_from_folder(str(script_dir / input_dir))
+        self.pickle_pii(unified, output_path / UNIFIED_PII_FILENAME)
+        bump_index_generation(output_path)
 
-    def create_piis_from_folder(self, input_dir:str="out/chatlogs", output_dir:str="piis") -> None:
+    def create_piis_from_folder(self, input_dir:str="out/chatlogs", output_dir:str="piis", unified:bool=False) -> None:
         """
-        Creates PIIs from all `chatlog.csv` files in a given directory, and writes them to TXT files. Wrapper for `create_pii_from_csv`.
+        Creates PIIs from all `chatlog.csv` files in a given directory, and writes them to TXT files. Each chat is written as by `create_pii_from_csv`; with `build_processes` above 1, several chats are built at once (see `build_piis_from_csvs`).
 
         Args:
             input_dir (str): The directory containing the `chatlog.csv` files. Defaults to `out/chatlogs`.
             output_dir (str): The directory to write the PIIs to. Defaults to `piis`.
+            unified (bool): If `True`, build one corpus-wide PII instead of one PII per chat (see `create_unified_pii_from_folder`). Defaults to `False`.
         """
         try:
             script_dir = Path(os.path.dirname(os.path.abspath(__file__)))
@@ -180,12 +686,18 @@ class PIIConstructor:
 
         input(f"Reading chatlogs from {input_path}, and writing PIIs to {output_path}. Please terminate program execution (Ctrl+C) if this is incorrect. Press Enter to continue otherwise.")
 
-        chatlogs = os.listdir(input_path)
+        if unified:
+            self.create_unified_pii_from_folder(str(input_path), str(output_path))
+            return
+
+        if not os.path.exists(output_path):
+            os.makedirs(output_path)
+
+        chatlogs = [file for file in os.listdir(input_path) if file.endswith(".chatlog.csv")]
         num_logs = len(chatlogs)
 
-        for i in range(num_logs):
-            file = chatlogs[i]
-            if file.endswith(".chatlog.csv"):
-                print(f"Processing {file} ({i+1}/{num_logs})")
-                self.create_pii_from_csv(str(input_path / file), str(output_path))
-                print()
+        piis = self._index_csvs([str(input_path / file) for file in chatlogs])
+        for i, (csv_file_path, pii) in enumerate(piis):
+            print(f"Processing {os.path.basename(csv_file_path)} ({i+1}/{num_logs})")
+            self._write_chat_pii(csv_file_path, pii, output_path)
+            print()
@@ -0,0 +1,260 @@
+from array import array
+import csv
+from itertools import groupby
+from operator import itemgetter
+import heapq
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+
+# the tokeniser of each language used in this (worker) process, created on first use and kept for the life of the process
+_worker_tokenisers = {}
+
+
+def _get_tokeniser(language:str):
+    if language not in _worker_tokenisers:
+        from .tokenisers.ttds_tokeniser import Tokeniser
+        _worker_tokenisers[language] = Tokeniser(language=language)
+    return _worker_tokenisers[language]
+
+def read_chatlog_chunks(csv_file_path:str, chunk_rows:int) -> iter:
+    """
+    Reads a chatlog a chunk at a time, so it never has to be held in memory whole.
+
+    Args:
+        csv_file_path (str): Path to the `chatlog.csv` file.
+        chunk_rows (int): The number of messages in each chunk.
+
+    Returns:
+        (iter) The `(docNo, message)` pairs of each chunk of the chatlog, in order.
+    """
+    with open(csv_file_path, 'r', encoding='utf-8-sig') as f:
+        rows = []
+        for row in csv.DictReader(f):
+            rows.append((int(row["docNo"]), row["message"]))
+            if len(rows) == chunk_rows:
+                yield rows
+                rows = []
+        if rows:
+            yield rows
+        f.close()
+
+class PostingsAccumulator:
+    """
+    The postings of a term while a chunk is being indexed, held in growable `array('I')` buffers: the docNos (as ints) containing the term, its frequency in each, and its positions in each in turn. Every docNo, frequency and position costs 4 bytes, rather than a docNo string, a list and an int object per position in a dict PII, and the buffers are already in the form the on-disk PII encodes (see `core.postings_codecs.encode_posting_arrays`).
+
+    Documents must be added in ascending docNo order, each one's positions in order, which is how a chunk is tokenised.
+    """
+    __slots__ = ["docs", "frequencies", "positions"]
+
+    def __init__(self):
+        self.docs = array("I")
+        self.frequencies = array("I")
+        self.positions = array("I")
+
+    def add(self, docNo:int, position:int) -> None:
+        """Adds an occurrence of the term at `position` in document `docNo`."""
+        if self.docs and self.docs[-1] == docNo:
+            self.frequencies[-1] += 1
+        else:
+            self.docs.append(docNo)
+            self.frequencies.append(1)
+        self.positions.append(position)
+
+def index_rows(tokeniser, rows:list[tuple[int, str]]) -> tuple[list[tuple], tuple[array, array]]:
+    """
+    Tokenises a chunk of messages and indexes them into a compact partial index (see `index_chunk`), using the given tokeniser.
+
+    Args:
+        tokeniser (Tokeniser): The tokeniser to tokenise the messages with.
+        rows (list[tuple[int, str]]): The `(docNo, message)` pairs of the chunk.
+
+    Returns:
+        (tuple[list[tuple], tuple[array, array]]) The partial index and the lengths of its documents, as returned by `index_chunk`.
+    """
+    rows = sorted(rows)
+    postings = {}
+    length_docs = array("I")
+    lengths = array("I")
+    for (docNo, _), tokens in zip(rows, tokeniser.tokenise_batch([message for _, message in rows])):
+        if not tokens:
+            continue
+        length_docs.append(docNo)
+        lengths.append(len(tokens))
+        for position, term in enumerate(tokens, 1):
+            accumulator = postings.get(term)
+            if accumulator is None:
+                # interned, so every chunk (and the merged PII) shares one copy of each term
+                accumulator = postings[sys.intern(term)] = PostingsAccumulator()
+            accumulator.add(docNo, position)
+    return [(term, postings[term].docs, postings[term].frequencies, postings[term].positions) for term in sorted(postings)], (length_docs, lengths)
+
+def index_chunk(language:str, rows:list[tuple[int, str]]) -> tuple[list[tuple], tuple[array, array]]:
+    """
+    Tokenises a chunk of messages and indexes them into a compact partial index. This is the work a build worker process does (see `PIIConstructor.build_processes`), so both its arguments and its result are kept cheap to send between processes: the postings of each term are three flat `array('I')`s (see `PostingsAccumulator`) rather than a dict of lists.
+
+    Args:
+        language (str): The language to tokenise the messages in.
+        rows (list[tuple[int, str]]): The `(docNo, message)` pairs of the chunk.
+
+    Returns:
+        (tuple[list[tuple], tuple[array, array]]) The partial index, and the lengths of its documents. The partial index is a list of `(term, docNos, term frequencies, positions)` entries sorted by term, where the docNos are ascending and the positions are those of every docNo in turn (the term frequencies say how many belong to each). The lengths are given as a `(docNos, lengths)` pair of arrays, leaving out documents with no tokens.
+    """
+    return index_rows(_get_tokeniser(language), rows)
+
+def merge_term_streams(streams:list) -> iter:
+    """
+    Merges sorted streams of `(term, docNos, term frequencies, positions)` entries (such as the partial indexes returned by `index_chunk`) with a k-way merge, grouping the entries of each term together.
+
+    The streams must cover disjoint ranges of docNos (as the chunks of a chatlog do), so that ordering the entries of a term by their first docNo orders all of its postings. Only the current entry of each stream is held by the merge, so the streams can just as well be read lazily (e.g. from files).
+
+    Args:
+        streams (list): The streams, each sorted by term.
+
+    Returns:
+        (iter) The `(term, entries)` of every term in ascending order, with the entries of the term ordered by docNo.
+    """
+    merged = heapq.merge(*streams, key=lambda entry: (entry[0], entry[1][0]))
+    for term, entries in groupby(merged, key=itemgetter(0)):
+        yield term, list(entries)
+
+def postings_from_entries(entries:list[tuple], doc_keys:dict=None) -> dict:
+    """
+    Converts the merged entries of a term (see `merge_term_streams`) to its entry in a PII.
+
+    Args:
+        entries (list[tuple]): The `(term, docNos, term frequencies, positions)` entries of the term, ordered by docNo.
+        doc_keys (dict): The docNo string to key the postings of each (int) docNo by, so every term can share one string per document rather than each making its own. Default is `None` (make a new string for every posting).
+
+    Returns:
+        (dict) The `{"document_frequency": int, "postings": {docNo: [positions]}}` entry of the term, with its postings in ascending docNo order.
+    """
+    postings = {}
+    for _, docs, frequencies, positions in entries:
+        positions = positions.tolist()
+        start = 0
+        for docNo, frequency in zip(docs, frequencies):
+            postings[doc_keys[docNo] if doc_keys is not None else str(docNo)] = positions[start:start + frequency]
+            start += frequency
+    return {"document_frequency": len(postings), "postings": postings}
+
+def concatenate_entries(entries:list[tuple]) -> tuple:
+    """Joins the merged entries of a term (see `merge_term_streams`) into a single `(term, docNos, term frequencies, positions)` entry."""
+    if len(entries) == 1:
+        return entries[0]
+    docs, frequencies, positions = array("I"), array("I"), array("I")
+    for _, entry_docs, entry_frequencies, entry_positions in entries:
+        docs.extend(entry_docs)
+        frequencies.extend(entry_frequencies)
+        positions.extend(entry_positions)
+    return entries[0][0], docs, frequencies, positions
+
+def partial_index_size(partial_index:list[tuple]) -> int:
+    """Estimates the memory (in bytes) held by a partial index returned by `index_chunk`."""
+    size = sys.getsizeof(partial_index)
+    for entry in partial_index:
+        size += sys.getsizeof(entry) + sum(sys.getsizeof(item) for item in entry)
+    return size
+
+def _drain(partial_index:list[tuple]) -> iter:
+    # yields the entries of a partial index while removing them from it, so each is freed as soon as the merge is done with it
+    partial_index.reverse()
+    while partial_index:
+        yield partial_index.pop()
+
+def _read_run(run_file:str) -> iter:
+    with open(run_file, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                break
+        f.close()
+
+
+class SPIMIIndexer:
+    """
+    Collects the partial indexes of the chunks of a chatlog (see `index_chunk`) in the manner of single-pass in-memory indexing (SPIMI). Partial indexes are kept in memory until they take up more than `memory_budget` bytes, at which point they are merged into a single run sorted by term and spilled to a temporary file. `merged_terms` then merges the runs (read back one term at a time) and whatever is still in memory with a k-way merge.
+
+    However large the chatlog, at most about `memory_budget` bytes of postings are held in memory while building (plus the lengths of the documents), so long as what is built from `merged_terms` is written out as it goes (as `core.disk_pii.write_disk_pii_from_arrays` does) rather than collected into a dict PII.
+
+    Chunks must be added in ascending docNo order (the order of the chatlog), as the merge relies on the runs covering disjoint ranges of docNos. Call `close` once done to delete the run files.
+
+    Args:
+        memory_budget (int): The number of bytes of partial indexes to hold in memory before spilling them to disk. If `None`, they are all held in memory (and merged by `merged_terms` just the same).
+        spill_dir (str): The directory to write the run files in (in a temporary directory of their own). Default is `None` (the system's temporary directory).
+    """
+    def __init__(self, memory_budget:int, spill_dir:str=None):
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self.runs = [] # paths of the spilled run files, in docNo order
+        self._partial_indexes = []
+        self._partial_indexes_size = 0
+        self._run_dir = None
+        self._length_docs = array("I")
+        self._lengths = array("I")
+
+    def __repr__(self):
+        return f"SPIMI indexer holding {len(self._partial_indexes)} partial indexes ({self._partial_indexes_size} bytes) in memory and {len(self.runs)} runs on disk"
+
+    def add_chunk(self, partial_index:list[tuple], doc_lengths:tuple[array, array]) -> None:
+        """
+        Adds the partial index of the next chunk of the chatlog, spilling the partial indexes held in memory to a run if they now exceed the memory budget.
+
+        Args:
+            partial_index (list[tuple]): The partial index of the chunk.
+            doc_lengths (tuple[array, array]): The `(docNos, lengths)` of the documents of the chunk.
+        """
+        docs, lengths = doc_lengths
+        if len(docs) and len(self._length_docs) and docs[0] <= self._length_docs[-1]:
+            raise ValueError(f"Chunks must be added in ascending docNo order (docNo {docs[0]} after {self._length_docs[-1]})")
+        self._length_docs.extend(docs)
+        self._lengths.extend(lengths)
+        self._partial_indexes.append(partial_index)
+        if self.memory_budget is not None:
+            self._partial_indexes_size += partial_index_size(partial_index)
+            if self._partial_indexes_size > self.memory_budget:
+                self.spill()
+
+    def spill(self) -> None:
+        """Merges the partial indexes held in memory into a run, and writes it to a temporary file."""
+        if not self._partial_indexes:
+            return
+        if self._run_dir is None:
+            self._run_dir = tempfile.mkdtemp(prefix="gcsearch-spimi-", dir=self.spill_dir)
+        run_file = os.path.join(self._run_dir, f"run{len(self.runs)}.bin")
+        with open(run_file, "wb") as f:
+            for _, entries in merge_term_streams(self._partial_indexes):
+                pickle.dump(concatenate_entries(entries), f, pickle.HIGHEST_PROTOCOL)
+            f.close()
+        self.runs.append(run_file)
+        self._partial_indexes = []
+        self._partial_indexes_size = 0
+
+    def merged_terms(self) -> iter:
+        """
+        Merges the spilled runs and the partial indexes still in memory. The partial indexes are consumed by the merge (so their memory is freed as the merged postings are built), so this can only be iterated once.
+
+        Returns:
+            (iter) The `(term, docNos, term frequencies, positions)` of every term in ascending order, with the docNos ascending.
+        """
+        streams = [_read_run(run_file) for run_file in self.runs] + [_drain(partial_index) for partial_index in self._partial_indexes]
+        self._partial_indexes = []
+        self._partial_indexes_size = 0
+        for _, entries in merge_term_streams(streams):
+            yield concatenate_entries(entries)
+
+    def doc_lengths(self) -> dict:
+        """Returns the length of each document with at least one token, in the format `{docNo: length}`."""
+        return dict(zip(map(str, self._length_docs), self._lengths))
+
+    def close(self) -> None:
+        """Deletes the run files."""
+        if self._run_dir is not None:
+            shutil.rmtree(self._run_dir, ignore_errors=True)
+            self._run_dir = None
+        self.runs = []
+        self._partial_indexes = []
+        self._partial_indexes_size = 0
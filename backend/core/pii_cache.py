@@ -0,0 +1,139 @@
+from collections import OrderedDict
+import os
+import threading
+
+DEFAULT_PII_CACHE_BYTES = 512 * 1024 * 1024 # 512MB
+
+
+class PIICache:
+    """
+    A least-recently-used cache of loaded PIIs, shared by everything in the process that searches (see `pii_cache` below).
+
+    Entries are keyed by the absolute path of the PII file, and are invalidated whenever that file's mtime or size changes on disk (e.g. after the PII has been rebuilt). The size of an entry is taken to be the size of its file on disk, so `max_bytes` bounds the total size of the *serialised* PIIs held in memory rather than their exact resident size. Loaded objects that only keep part of their file in memory (e.g. `DiskPII`) can instead report their size through a `resident_bytes` attribute.
+
+    Args:
+        max_bytes (int): The byte budget of the cache. When exceeded, the least recently used PIIs are evicted. Defaults to 512MB.
+    """
+    def __init__(self, max_bytes:int=DEFAULT_PII_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict() # path -> (mtime_ns, file size, charged size, pii)
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"PII Cache holding {len(self._entries)} PIIs ({self.current_bytes}/{self.max_bytes} bytes)"
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, path:str, loader) -> object:
+        """
+        Returns the PII stored at `path`, loading it with `loader(path)` if it is not cached (or the cached copy is stale).
+
+        Args:
+            path (str): The path to the PII file.
+            loader (callable): A function taking the path and returning the loaded PII.
+
+        Returns:
+            (object) The loaded PII.
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None:
+                mtime_ns, file_size, _, pii = entry
+                if mtime_ns == stat.st_mtime_ns and file_size == stat.st_size:
+                    self._entries.move_to_end(path)
+                    self.hits += 1
+                    return pii
+                # the file has changed on disk since we loaded it
+                self._remove(path)
+            self.misses += 1
+
+        # load outside of the lock so other PIIs can still be served in the meantime
+        pii = loader(path)
+        size = getattr(pii, "resident_bytes", stat.st_size)
+
+        with self._lock:
+            if size <= self.max_bytes:
+                if path in self._entries:
+                    self._remove(path)
+                self._entries[path] = (stat.st_mtime_ns, stat.st_size, size, pii)
+                self.current_bytes += size
+                self._evict()
+        return pii
+
+    def invalidate(self, path:str=None) -> None:
+        """
+        Drops the given PII from the cache, or every PII if no path is given.
+
+        Args:
+            path (str): The path to the PII file to drop. Defaults to `None` (drop everything).
+        """
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+                self.current_bytes = 0
+            else:
+                path = os.path.abspath(path)
+                if path in self._entries:
+                    self._remove(path)
+
+    def set_max_bytes(self, max_bytes:int) -> None:
+        """
+        Changes the byte budget of the cache, evicting PIIs if the cache is now over budget.
+
+        Args:
+            max_bytes (int): The new byte budget.
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def stats(self) -> dict:
+        """
+        Returns the current statistics of the cache.
+
+        Returns:
+            (dict) In the format
+            ```
+            {
+                "entries": number of PIIs cached,
+                "bytes": total size of the cached PIIs,
+                "max_bytes": the byte budget,
+                "hits": number of lookups served from the cache,
+                "misses": number of lookups that had to load from disk,
+                "evictions": number of PIIs evicted to stay within budget,
+                "hit_ratio": hits / (hits + misses)
+            }
+            ```
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+    def _remove(self, path:str) -> None:
+        _, _, size, _ = self._entries.pop(path)
+        self.current_bytes -= size
+
+    def _evict(self) -> None:
+        while self.current_bytes > self.max_bytes and self._entries:
+            path = next(iter(self._entries))
+            self._remove(path)
+            self.evictions += 1
+
+
+# the process-wide cache, shared between all `Searcher`s
+pii_cache = PIICache()
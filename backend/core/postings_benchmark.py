@@ -0,0 +1,85 @@
+from core.pii import PIIConstructor, PII_STATS_KEY
+from core.postings_codecs import CODECS, decode_frequency_arrays, decode_postings_arrays, encode_postings
+import argparse
+import pickle
+import time
+
+def benchmark_codecs(csv_file_path:str, language:str="english", repeat:int=5) -> list[dict]:
+    """
+    Builds the PII of a chatlog, then encodes and decodes its postings with every postings codec.
+
+    Args:
+        csv_file_path (str): Path to the `chatlog.csv` file to benchmark on.
+        language (str): The language to tokenise the chatlog with. Defaults to `english`.
+        repeat (int): How many times to decode every term's postings when timing decoding. Defaults to 5.
+
+    Returns:
+        list[dict]: One result per codec (plus `pickle` as a baseline), in the format `{"codec", "bytes", "frequency_bytes", "bytes_per_posting", "bytes_per_position", "encode_seconds", "decode_postings_per_second", "decode_mb_per_second", "decode_frequencies_postings_per_second"}`. The `frequencies` figures cover the frequency stream alone, which is all ranking decodes.
+    """
+    pii = PIIConstructor(language=language).build_pii_from_csv(csv_file_path)
+    if pii is None:
+        raise ValueError(f"{csv_file_path} has no messages")
+    terms = [term for term in pii if term != PII_STATS_KEY]
+    num_postings = sum(len(pii[term]["postings"]) for term in terms)
+    num_positions = sum(len(positions) for term in terms for positions in pii[term]["postings"].values())
+
+    pickled_size = len(pickle.dumps({term: pii[term] for term in terms}))
+    results = [{
+        "codec": "pickle",
+        "bytes": pickled_size,
+        "frequency_bytes": None,
+        "bytes_per_posting": pickled_size / num_postings,
+        "bytes_per_position": pickled_size / num_positions,
+        "encode_seconds": None,
+        "decode_postings_per_second": None,
+        "decode_mb_per_second": None,
+        "decode_frequencies_postings_per_second": None,
+    }]
+    for codec in CODECS.values():
+        start = time.perf_counter()
+        encoded = [encode_postings(pii[term]["postings"], codec) for term in terms]
+        encode_seconds = time.perf_counter() - start
+        frequency_size = sum(len(frequencies) for frequencies, _ in encoded)
+        size = frequency_size + sum(len(positions) for _, positions in encoded)
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for frequencies, positions in encoded:
+                decode_postings_arrays(frequencies, positions, codec)
+        decode_seconds = (time.perf_counter() - start) / repeat
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for frequencies, _ in encoded:
+                decode_frequency_arrays(frequencies, codec)
+        decode_frequencies_seconds = (time.perf_counter() - start) / repeat
+
+        results.append({
+            "codec": codec.name,
+            "bytes": size,
+            "frequency_bytes": frequency_size,
+            "bytes_per_posting": size / num_postings,
+            "bytes_per_position": size / num_positions,
+            "encode_seconds": encode_seconds,
+            "decode_postings_per_second": num_postings / decode_seconds,
+            "decode_mb_per_second": size / decode_seconds / 1e6,
+            "decode_frequencies_postings_per_second": num_postings / decode_frequencies_seconds,
+        })
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the size and decode speed of the postings codecs on a chatlog. Run from the backend directory as `python -m core.postings_benchmark <chatlog.csv>`.")
+    parser.add_argument("chatlog", type=str, help="Path to the chatlog.csv file to benchmark on")
+    parser.add_argument("--language", type=str, default="english", help="Language to tokenise the chatlog with")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of times to decode every term when timing decoding")
+    args = parser.parse_args()
+
+    results = benchmark_codecs(args.chatlog, args.language, args.repeat)
+    print(f"{'codec':<10}{'bytes':>12}{'tf bytes':>12}{'B/posting':>12}{'B/position':>12}{'encode (s)':>12}{'decode (postings/s)':>22}{'decode (MB/s)':>15}{'tf decode (postings/s)':>25}")
+    for result in results:
+        frequency_bytes = f"{result['frequency_bytes']:,}" if result["frequency_bytes"] is not None else "-"
+        encode = f"{result['encode_seconds']:.3f}" if result["encode_seconds"] is not None else "-"
+        postings_per_second = f"{result['decode_postings_per_second']:,.0f}" if result["decode_postings_per_second"] is not None else "-"
+        mb_per_second = f"{result['decode_mb_per_second']:.1f}" if result["decode_mb_per_second"] is not None else "-"
+        frequencies_per_second = f"{result['decode_frequencies_postings_per_second']:,.0f}" if result["decode_frequencies_postings_per_second"] is not None else "-"
+        print(f"{result['codec']:<10}{result['bytes']:>12,}{frequency_bytes:>12}{result['bytes_per_posting']:>12.2f}{result['bytes_per_position']:>12.2f}{encode:>12}{postings_per_second:>22}{mb_per_second:>15}{frequencies_per_second:>25}")
@@ -0,0 +1,279 @@
+import struct
+import numpy as np
+
+# Each encoded sequence of ints is framed as `count, byte_length, payload`, so sequences can be concatenated
+SEQUENCE_HEADER = struct.Struct("<II")
+BITPACK_BLOCK_SIZE = 128
+
+
+class PostingsCodec:
+    """
+    Base class of the postings codecs. A codec turns a sequence of non-negative ints (already delta-encoded by `encode_postings` where that makes sense) into bytes and back. Subclasses implement `_encode` and `_decode`.
+    """
+    name = None
+    codec_id = None
+
+    def __repr__(self):
+        return f"Postings codec \"{self.name}\""
+
+    def encode_ints(self, values) -> bytes:
+        """
+        Encodes a sequence of non-negative ints.
+
+        Args:
+            values (array-like): The ints to encode.
+
+        Returns:
+            bytes: The framed, encoded sequence.
+        """
+        values = np.asarray(values, dtype=np.uint64)
+        payload = self._encode(values)
+        return SEQUENCE_HEADER.pack(len(values), len(payload)) + payload
+
+    def decode_ints(self, data, offset:int=0) -> tuple[np.ndarray, int]:
+        """
+        Decodes a sequence encoded by `encode_ints`.
+
+        Args:
+            data (bytes): The buffer holding the sequence.
+            offset (int): Where in `data` the sequence starts. Default is 0.
+
+        Returns:
+            (tuple[np.ndarray, int]) The decoded ints (as `int64`), and the offset just after the sequence.
+        """
+        count, length = SEQUENCE_HEADER.unpack_from(data, offset)
+        start = offset + SEQUENCE_HEADER.size
+        values = self._decode(memoryview(data)[start:start + length], count)
+        return values.astype(np.int64, copy=False), start + length
+
+    def _encode(self, values:np.ndarray) -> bytes:
+        raise NotImplementedError
+
+    def _decode(self, payload, count:int) -> np.ndarray:
+        raise NotImplementedError
+
+
+class RawCodec(PostingsCodec):
+    """Stores every int as a little-endian `uint32`. Fastest to decode, largest on disk."""
+    name = "raw"
+    codec_id = 0
+
+    def _encode(self, values:np.ndarray) -> bytes:
+        return values.astype("<u4").tobytes()
+
+    def _decode(self, payload, count:int) -> np.ndarray:
+        return np.frombuffer(payload, dtype="<u4", count=count)
+
+
+class VarintCodec(PostingsCodec):
+    """
+    Stores every int as a variable-length (LEB128) int: 7 bits per byte, with the high bit set on every byte but the last. Small deltas, which are the bulk of a chat's postings, take a single byte.
+    """
+    name = "varint"
+    codec_id = 1
+
+    def _encode(self, values:np.ndarray) -> bytes:
+        if len(values) == 0:
+            return b""
+        num_bytes = np.ones(len(values), dtype=np.int64)
+        for k in range(1, 10):
+            num_bytes += values >= (1 << (7 * k))
+        ends = np.cumsum(num_bytes)
+        starts = ends - num_bytes
+        out = np.zeros(ends[-1], dtype=np.uint8)
+        for k in range(int(num_bytes.max())):
+            has_byte = num_bytes > k
+            group = (values[has_byte] >> np.uint64(7 * k)) & np.uint64(0x7f)
+            continues = (num_bytes[has_byte] > k + 1).astype(np.uint64) << np.uint64(7)
+            out[starts[has_byte] + k] = group | continues
+        return out.tobytes()
+
+    def _decode(self, payload, count:int) -> np.ndarray:
+        data = np.frombuffer(payload, dtype=np.uint8)
+        if count == 0:
+            return np.zeros(0, dtype=np.uint64)
+        ends = np.flatnonzero(data < 0x80)
+        starts = np.empty(count, dtype=np.int64)
+        starts[0] = 0
+        starts[1:] = ends[:-1] + 1
+        shifts = np.arange(len(data), dtype=np.int64) - np.repeat(starts, ends - starts + 1)
+        groups = (data & 0x7f).astype(np.uint64) << (7 * shifts).astype(np.uint64)
+        return np.add.reduceat(groups, starts)
+
+
+class BitPackCodec(PostingsCodec):
+    """
+    Splits the ints into blocks of `BITPACK_BLOCK_SIZE`, and packs every int of a block into the number of bits needed by the largest int in that block. Each block is stored as its bit width (one byte) followed by the packed bits.
+    """
+    name = "bitpack"
+    codec_id = 2
+
+    def _encode(self, values:np.ndarray) -> bytes:
+        out = bytearray()
+        for start in range(0, len(values), BITPACK_BLOCK_SIZE):
+            block = values[start:start + BITPACK_BLOCK_SIZE]
+            width = int(block.max()).bit_length()
+            out.append(width)
+            if width:
+                bits = (block[:, None] >> np.arange(width, dtype=np.uint64)) & np.uint64(1)
+                out.extend(np.packbits(bits.astype(np.uint8), bitorder="little").tobytes())
+        return bytes(out)
+
+    def _decode(self, payload, count:int) -> np.ndarray:
+        data = np.frombuffer(payload, dtype=np.uint8)
+        values = np.zeros(count, dtype=np.uint64)
+        offset = 0
+        for start in range(0, count, BITPACK_BLOCK_SIZE):
+            block_size = min(BITPACK_BLOCK_SIZE, count - start)
+            width = int(data[offset])
+            offset += 1
+            if width:
+                num_bytes = (block_size * width + 7) // 8
+                bits = np.unpackbits(data[offset:offset + num_bytes], bitorder="little")[:block_size * width]
+                weights = np.uint64(1) << np.arange(width, dtype=np.uint64)
+                values[start:start + block_size] = bits.reshape(block_size, width).astype(np.uint64) @ weights
+                offset += num_bytes
+        return values
+
+
+CODECS = {codec.name: codec for codec in [RawCodec(), VarintCodec(), BitPackCodec()]}
+CODECS_BY_ID = {codec.codec_id: codec for codec in CODECS.values()}
+DEFAULT_CODEC = "varint"
+
+def get_codec(codec) -> PostingsCodec:
+    """
+    Returns the codec with the given name or id.
+
+    Args:
+        codec (str | int): The name (e.g. '`varint`') or id of the codec.
+    """
+    codecs = CODECS_BY_ID if isinstance(codec, int) else CODECS
+    if codec not in codecs:
+        raise ValueError(f"Unknown postings codec: {codec}. Available codecs are: {', '.join(CODECS)}")
+    return codecs[codec]
+
+
+def encode_postings(postings:dict, codec:PostingsCodec) -> tuple[bytes, bytes]:
+    """
+    Encodes the postings of a single term as two separate streams, so ranking (which only needs term frequencies) never has to decode positions:
+    - the frequency stream: the docNos (delta-encoded) and the term frequency (number of positions) in each document
+    - the positions stream: the positions (delta-encoded within each document)
+
+    Args:
+        postings (dict): The postings of the term, in the format `{docNo: [pos, ...]}`.
+        codec (PostingsCodec): The codec to encode the streams with.
+
+    Returns:
+        (tuple[bytes, bytes]) The encoded frequency stream and positions stream.
+    """
+    docNos = sorted(postings, key=int)
+    doc_ids = np.fromiter((int(docNo) for docNo in docNos), dtype=np.int64, count=len(docNos))
+    counts = np.fromiter((len(postings[docNo]) for docNo in docNos), dtype=np.int64, count=len(docNos))
+    positions = np.fromiter((position for docNo in docNos for position in postings[docNo]), dtype=np.int64, count=int(counts.sum()))
+    return encode_posting_arrays(doc_ids, counts, positions, codec)
+
+def encode_posting_arrays(doc_ids, counts, positions, codec:PostingsCodec) -> tuple[bytes, bytes]:
+    """
+    Encodes the postings of a single term held as flat arrays (as built by `core.pii_build`) into the same streams as `encode_postings`, without going through a dict of lists.
+
+    Args:
+        doc_ids (array-like): The docNos (as ints) of the documents containing the term, ascending.
+        counts (array-like): The term frequency in each of those documents.
+        positions (array-like): The positions of the term in each document in turn.
+        codec (PostingsCodec): The codec to encode the streams with.
+
+    Returns:
+        (tuple[bytes, bytes]) The encoded frequency stream and positions stream.
+    """
+    doc_ids = np.asarray(doc_ids, dtype=np.int64)
+    counts = np.asarray(counts, dtype=np.int64)
+    positions = np.asarray(positions, dtype=np.int64)
+    frequencies = codec.encode_ints(_delta(doc_ids)) + codec.encode_ints(counts)
+    return frequencies, codec.encode_ints(_delta_within(positions, counts))
+
+def decode_frequency_arrays(frequency_data, codec:PostingsCodec) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Decodes the frequency stream of a term encoded by `encode_postings`.
+
+    Args:
+        frequency_data (bytes): The encoded frequency stream.
+        codec (PostingsCodec): The codec the stream was encoded with.
+
+    Returns:
+        (tuple[np.ndarray, np.ndarray]) The docNos (sorted) and the term frequency in each document.
+    """
+    doc_deltas, offset = codec.decode_ints(frequency_data)
+    counts, _ = codec.decode_ints(frequency_data, offset)
+    return np.cumsum(doc_deltas), counts
+
+def decode_positions_array(positions_data, codec:PostingsCodec, counts:np.ndarray) -> np.ndarray:
+    """
+    Decodes the positions stream of a term encoded by `encode_postings`.
+
+    Args:
+        positions_data (bytes): The encoded positions stream.
+        codec (PostingsCodec): The codec the stream was encoded with.
+        counts (np.ndarray): The term frequency in each document, from the frequency stream.
+
+    Returns:
+        (np.ndarray) All the positions, grouped by document.
+    """
+    position_deltas, _ = codec.decode_ints(positions_data)
+    return _undelta_within(position_deltas, counts)
+
+def decode_postings_arrays(frequency_data, positions_data, codec:PostingsCodec) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Decodes both streams of a term encoded by `encode_postings` into arrays.
+
+    Args:
+        frequency_data (bytes): The encoded frequency stream.
+        positions_data (bytes): The encoded positions stream.
+        codec (PostingsCodec): The codec the streams were encoded with.
+
+    Returns:
+        (tuple[np.ndarray, np.ndarray, np.ndarray]) The docNos (sorted), the number of positions in each document, and all the positions (grouped by document).
+    """
+    doc_ids, counts = decode_frequency_arrays(frequency_data, codec)
+    return doc_ids, counts, decode_positions_array(positions_data, codec, counts)
+
+def decode_postings(frequency_data, positions_data, codec:PostingsCodec) -> dict:
+    """
+    Decodes both streams of a term encoded by `encode_postings` into postings.
+
+    Args:
+        frequency_data (bytes): The encoded frequency stream.
+        positions_data (bytes): The encoded positions stream.
+        codec (PostingsCodec): The codec the streams were encoded with.
+
+    Returns:
+        dict: The postings of the term, in the format `{docNo: [pos, ...]}` (with docNo as a string, like a pickled PII).
+    """
+    doc_ids, counts, positions = decode_postings_arrays(frequency_data, positions_data, codec)
+    positions = positions.tolist()
+    postings = {}
+    start = 0
+    for doc_id, count in zip(doc_ids.tolist(), counts.tolist()):
+        postings[str(doc_id)] = positions[start:start + count]
+        start += count
+    return postings
+
+def _delta(values:np.ndarray) -> np.ndarray:
+    deltas = values.copy()
+    deltas[1:] -= values[:-1]
+    return deltas
+
+def _delta_within(values:np.ndarray, counts:np.ndarray) -> np.ndarray:
+    """Delta-encodes `values`, restarting from 0 at the start of each group of `counts` values (every group is non-empty)."""
+    deltas = _delta(values)
+    if len(values):
+        starts = np.cumsum(counts) - counts
+        deltas[starts] = values[starts]
+    return deltas
+
+def _undelta_within(deltas:np.ndarray, counts:np.ndarray) -> np.ndarray:
+    """Inverse of `_delta_within`."""
+    if len(deltas) == 0:
+        return deltas
+    sums = np.cumsum(deltas)
+    starts = np.cumsum(counts) - counts
+    return sums - np.repeat(sums[starts] - deltas[starts], counts)
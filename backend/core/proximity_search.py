@@ -1,38 +1,152 @@
-# -*- coding: utf-8 -*-
-
-
-def proximity_search(n: int, terms: list[str], pos_inv_index: dict, collection: dict) -> set:
-
-    if not terms or n < 1 or not isinstance(n, int):
-        return set()
-
-    results = set()
-    terms = [pre_process_token(term) for term in terms]  
-
-    if any(term not in pos_inv_index for term in terms):
-        return set()  
-
-    terms.sort(key=lambda term: len(pos_inv_index[term]["postings"]))  
-    first_term = terms[0]
-    first_term_postings = pos_inv_index[first_term]["postings"]
-
-    for docNo, first_term_positions in first_term_postings.items():
-        if docNo not in collection:
-            continue  
-
-        doc_tokens = collection[docNo]  
-        word_positions = {term: pos_inv_index[term]["postings"].get(docNo, []) for term in terms[1:]}
-
-        for first_pos in first_term_positions:
-            start, end = max(0, first_pos - (n - 1)), min(len(doc_tokens), first_pos + (n - 1) + 1)
-            words_in_range = doc_tokens[start:end]
-
-            if not all(term in words_in_range for term in terms[1:]):
-                continue  
-
-            positions = sorted([first_pos] + [min(word_positions[term], default=float('inf')) for term in terms[1:]])
-            if max(positions) - min(positions) <= (n - 1):
-                results.add(docNo)
-                break  
-
-    return results
+# -*- coding: utf-8 -*-
+from .bm25 import doc_sort_key
+from .pii import get_term_frequencies
+import heapq
+
+
+def intersect_documents(term_entries:list) -> list:
+    """
+    Returns the documents containing every one of the given terms. The terms are intersected smallest document frequency first, so the candidate set only ever shrinks from the smallest posting list, and it stops as soon as the candidates run out. Only the term frequencies are used, so positions are never decoded for on-disk PIIs.
+
+    Args:
+        term_entries (list): The PII entries (`pii[term]`) of the terms.
+
+    Returns:
+        (list) The docNos (as keyed in the PII) containing every term.
+    """
+    if not term_entries:
+        return []
+    frequencies = sorted((get_term_frequencies(entry) for entry in term_entries), key=len)
+    candidates = list(frequencies[0])
+    for term_frequencies in frequencies[1:]:
+        candidates = [docNo for docNo in candidates if docNo in term_frequencies]
+        if not candidates:
+            break
+    return candidates
+
+def count_unordered_windows(position_lists:list[list[int]], required:list[int], max_span:int) -> int:
+    """
+    Counts the minimal windows of a document that contain every term (in any order), and span at most `max_span` positions.
+
+    The position lists are merged and swept once with a sliding window: each position is added on the right, and whenever the window holds every term, it is shrunk from the left as far as it can be, which gives the minimal window ending at that position. This takes O(total positions) (times log of the number of terms for the merge).
+
+    Args:
+        position_lists (list[list[int]]): The sorted positions of each distinct term in the document.
+        required (list[int]): How many times each term must appear in a window (i.e. how many times it is in the query).
+        max_span (int): The largest allowed distance between the first and last position of a window.
+
+    Returns:
+        (int) The number of minimal windows spanning at most `max_span`.
+    """
+    counts = [0] * len(position_lists)
+    missing = len(position_lists)
+    window = []
+    left = 0
+    matches = 0
+    tagged_lists = [[(position, i) for position in positions] for i, positions in enumerate(position_lists)]
+    for position, i in heapq.merge(*tagged_lists):
+        window.append((position, i))
+        counts[i] += 1
+        if counts[i] == required[i]:
+            missing -= 1
+        if missing == 0:
+            # drop occurrences off the left while the window still holds every term
+            while counts[window[left][1]] > required[window[left][1]]:
+                counts[window[left][1]] -= 1
+                left += 1
+            if position - window[left][0] <= max_span:
+                matches += 1
+            # and then the one it can't do without, to look for the next window
+            counts[window[left][1]] -= 1
+            missing = 1
+            left += 1
+    return matches
+
+def count_ordered_windows(position_lists:list[list[int]], max_span:int) -> int:
+    """
+    Counts the minimal windows of a document that contain every term in query order, and span at most `max_span` positions.
+
+    For each occurrence of the first term (in order), the chain of the next occurrence of each following term is found, which gives the earliest end of an ordered window starting there. The chains only ever move forward, so every position list is walked once, in O(total positions). A window is only minimal if the next occurrence of the first term can't end at the same place (otherwise that occurrence starts a tighter window with the same end).
+
+    Args:
+        position_lists (list[list[int]]): The sorted positions of each query term in the document, in query order (a term repeated in the query is repeated here).
+        max_span (int): The largest allowed distance between the first and last position of a window.
+
+    Returns:
+        (int) The number of minimal ordered windows spanning at most `max_span`.
+    """
+    starts = position_lists[0]
+    if len(position_lists) == 1:
+        return len(starts)
+    pointers = [0] * len(position_lists)
+    windows = [] # (start, earliest end) of the window starting at each occurrence of the first term
+    for start in starts:
+        previous = start
+        for t in range(1, len(position_lists)):
+            positions = position_lists[t]
+            pointer = pointers[t]
+            while pointer < len(positions) and positions[pointer] <= previous:
+                pointer += 1
+            pointers[t] = pointer
+            if pointer == len(positions):
+                break
+            previous = positions[pointer]
+        else:
+            windows.append((start, previous))
+            continue
+        break # no later occurrence of this term, so no more windows
+    matches = 0
+    for i, (start, end) in enumerate(windows):
+        if i + 1 < len(windows) and windows[i + 1][1] == end:
+            continue
+        if end - start <= max_span:
+            matches += 1
+    return matches
+
+def match_proximity(terms:list[str], positional_index:dict, n:int, ordered:bool=False) -> dict:
+    """
+    Finds every document in which all of the terms appear within `n` positions of each other.
+
+    The documents containing every term are found first (see `intersect_documents`), so positions are only read for those. Each of them is then swept once, with `count_ordered_windows` or `count_unordered_windows`.
+
+    Args:
+        terms (list[str]): The (tokenised) terms to search for.
+        positional_index (dict): The PII to search in.
+        n (int): The proximity parameter: the largest allowed distance between the first and last term of a window.
+        ordered (bool): Whether the terms must appear in the order given. Default is `False`.
+
+    Returns:
+        (dict) The number of (minimal) windows in each matching document, in the format `{docNo: count}`.
+    """
+    if not terms or any(term not in positional_index for term in terms):
+        return {}
+    distinct_terms = list(dict.fromkeys(terms))
+    candidates = intersect_documents([positional_index[term] for term in distinct_terms])
+    postings = {term: positional_index[term]["postings"] for term in distinct_terms}
+    required = [terms.count(term) for term in distinct_terms]
+
+    doc_counts = {}
+    for docNo in candidates:
+        if ordered:
+            count = count_ordered_windows([postings[term][docNo] for term in terms], n)
+        else:
+            count = count_unordered_windows([postings[term][docNo] for term in distinct_terms], required, n)
+        if count > 0:
+            doc_counts[docNo] = count
+    return doc_counts
+
+def proximity_search(terms:list[str], positional_index:dict, n:int, top_n:int=25, ordered:bool=False) -> list[tuple[str, int]]:
+    """
+    Finds the documents in which all of the terms appear within `n` positions of each other, scored by how many (minimal) such windows they have (see `match_proximity`).
+
+    Args:
+        terms (list[str]): The (tokenised) terms to search for.
+        positional_index (dict): The PII to search in.
+        n (int): The proximity parameter: the largest allowed distance between the first and last term of a window.
+        top_n (int): The number of results to return. Default is 25.
+        ordered (bool): Whether the terms must appear in the order given. Default is `False`.
+
+    Returns:
+        (list[tuple[str, int]]) The top N results in the format `(docNo, score)`, with ties broken by ascending docNo.
+    """
+    return heapq.nsmallest(top_n, match_proximity(terms, positional_index, n, ordered).items(), key=lambda x: (-x[1], doc_sort_key(x[0])))
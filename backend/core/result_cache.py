@@ -0,0 +1,153 @@
+from collections import OrderedDict
+import os
+import pickle
+import threading
+
+DEFAULT_RESULT_CACHE_ENTRIES = 1024
+
+
+class ResultCache:
+    """
+    A least-recently-used cache of search results, shared by everything in the process that searches (see `result_cache` below).
+
+    The cache doesn't know anything about the searches themselves: the `Searcher` keys each result by everything it depends on (the kind of search, the tokenised query and its parameters, the language, the generation of the index and the state of the chats' info files, see `Searcher.get_index_generation`), so a result is never served once the index it came from has been rebuilt or removed. Stale entries are simply never looked up again, and age out of the cache.
+
+    If a `persist_path` is given, the cache is loaded from it when created, and `save` writes it back (e.g. when the server exits), so a restarted server starts warm.
+
+    Args:
+        max_entries (int): The number of results to keep. When exceeded, the least recently used results are evicted. Default is `DEFAULT_RESULT_CACHE_ENTRIES`.
+        persist_path (str): The file to load the cache from and save it to. Default is `None` (don't persist the cache).
+    """
+    def __init__(self, max_entries:int=DEFAULT_RESULT_CACHE_ENTRIES, persist_path:str=None):
+        self.max_entries = max_entries
+        self.persist_path = persist_path
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict() # key -> results
+        self._lock = threading.Lock()
+        if persist_path is not None:
+            self.load(persist_path)
+
+    def __repr__(self):
+        return f"Result Cache holding {len(self._entries)}/{self.max_entries} results"
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key:tuple) -> object:
+        """
+        Returns the results cached under `key`, or `None` if there are none.
+
+        Args:
+            key (tuple): The key of the results.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key:tuple, results:object) -> None:
+        """
+        Caches `results` under `key`, evicting the least recently used results if the cache is full.
+
+        Args:
+            key (tuple): The key of the results.
+            results (object): The results (which must be picklable, if the cache is persisted).
+        """
+        with self._lock:
+            self._entries[key] = results
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def invalidate(self) -> None:
+        """Drops every cached result."""
+        with self._lock:
+            self._entries.clear()
+
+    def set_max_entries(self, max_entries:int) -> None:
+        """
+        Changes the number of results the cache keeps, evicting results if the cache is now over it.
+
+        Args:
+            max_entries (int): The new number of results to keep.
+        """
+        with self._lock:
+            self.max_entries = max_entries
+            self._evict()
+
+    def load(self, persist_path:str) -> None:
+        """
+        Loads the results saved in `persist_path` (if it exists) into the cache, and saves to it from now on. A file that can't be read is ignored, leaving the cache as it was.
+
+        Args:
+            persist_path (str): The file the cache was saved to.
+        """
+        self.persist_path = persist_path
+        if not os.path.exists(persist_path):
+            return
+        try:
+            with open(persist_path, "rb") as f:
+                entries = pickle.load(f)
+                f.close()
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            print(f"DEBUG ERROR: Could not load the result cache from {persist_path}: {e}")
+            return
+        with self._lock:
+            for key, results in entries:
+                self._entries[key] = results
+            self._evict()
+
+    def save(self) -> None:
+        """
+        Saves the cache to its `persist_path` (if it has one). The file is written under a temporary name and moved into place, so a crash never leaves half of it.
+        """
+        if self.persist_path is None:
+            return
+        with self._lock:
+            entries = list(self._entries.items())
+        tmp_path = f"{self.persist_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(entries, f)
+            f.close()
+        os.replace(tmp_path, self.persist_path)
+
+    def stats(self) -> dict:
+        """
+        Returns the current statistics of the cache.
+
+        Returns:
+            (dict) In the format
+            ```
+            {
+                "entries": number of results cached,
+                "max_entries": the number of results the cache keeps,
+                "hits": number of searches served from the cache,
+                "misses": number of searches that had to be run,
+                "evictions": number of results evicted to stay within `max_entries`,
+                "hit_ratio": hits / (hits + misses)
+            }
+            ```
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+    def _evict(self) -> None:
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+
+# the process-wide cache, shared between all `Searcher`s
+result_cache = ResultCache()
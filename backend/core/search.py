@@ -1,8 +1,20 @@
 from .tokenisers.ttds_tokeniser import Tokeniser
+from .pii_cache import PIICache, pii_cache
+from .result_cache import ResultCache, result_cache as shared_result_cache
+from .search_pool import SearchPool
+from .chatlog_index import ChatlogIndex
+from .message_store import MessageStore, message_store_path
+from .chat_registry import ChatRegistry
+from .proximity_search import proximity_search as find_proximity_matches
+from .phrase_search import phrase_search as find_phrase_matches
+from .boolean_search import PlanExecutor, QueryPlanner, positive_terms
+from .bm25 import BM25_B, BM25_K1, bm25_top_n, doc_length_array, doc_sort_key, term_arrays
+from .pii import GLOBAL_STATS_FILENAME, PII_CHATS_KEY, UNIFIED_PII_FILENAME, find_pii_file, get_collection_stats, get_term_frequencies, index_fingerprint, list_pii_names, load_pii_file, read_index_generation
 import pickle
 import os
 import math
 import re
+import time
 from datetime import datetime
 
 import chardet
@@ -22,67 +34,203 @@ class Searcher():
 
     Args:
         language (str): The language to be used for tokenising the queries. Ideally, this should be the language of the PII, but no such restriction is in place (although I can't imagine you'll get useful results for most different language pairings)
+        cache (PIICache): The cache to hold loaded PIIs in. Defaults to the process-wide `pii_cache`, so PIIs are only unpickled again once they change on disk.
+        scoring (str): The BM25 scoring engine, either '`numpy`' (vectorised, see `core.bm25.bm25_top_n`) or '`python`'. Both return identical rankings. Defaults to '`numpy`'.
+        workers (int): The number of worker processes to search the chats of a folder with in parallel (see `core.search_pool.SearchPool`). Defaults to 1 (search every chat in this process).
+        result_cache (ResultCache): The cache to hold the results of the `flask_*` searches in. Defaults to the process-wide `result_cache`.
+        segmentation_workers (int): For the Chinese languages, the number of worker processes to segment queries in (see `core.tokenisers.segmentation_pool`), so concurrent queries aren't segmented one at a time in this process. Defaults to 0 (segment in the calling thread).
     """
-    def __init__(self, language:str="english"):
-        self.tokeniser = Tokeniser(language)
+    def __init__(self, language:str="english", cache:PIICache=None, scoring:str="numpy", workers:int=1, result_cache:ResultCache=None, segmentation_workers:int=0):
+        if scoring not in ["numpy", "python"]:
+            raise ValueError(f"Unsupported scoring engine: {scoring}")
+        self.tokeniser = Tokeniser(language, segmentation_workers)
         self.language = language
+        self.cache = cache if cache is not None else pii_cache
+        self.result_cache = result_cache if result_cache is not None else shared_result_cache
+        self.scoring = scoring
+        self.pool = SearchPool(workers, language, scoring, self.cache.max_bytes) if workers > 1 else None
+        self._chatlog_indexes = {} # chatlog path -> ChatlogIndex
+        self._message_stores = {} # store path -> MessageStore
+        self._chat_registries = {} # info directory -> ChatRegistry
+        self.query_planner = QueryPlanner(self.tokeniser.tokenise)
+
+    def _unpickle_pii(self, pii_path:str) -> dict:
+        with open(pii_path, "rb") as f:
+            pii = pickle.load(f)
+            f.close()
+        return pii
 
     def load_pii(self, pii_name:str, pii_dir:str="piis") -> dict:
         """
-        Unpickles the PII with the given name and returns it.
+        Returns the PII with the given name. PIIs are served from `self.cache`, and are only loaded if they are not cached or have changed on disk since they were cached.
+
+        On-disk PIIs (`<chatname>.pii.bin`) are preferred over pickled ones. These are memory-mapped rather than unpickled, and only the postings of the terms a query looks up are decoded (see `core.disk_pii.DiskPII`).
         
         Args:
-            pii_name (str): The name of the PII to load. If you wish to open `<chatname>.pii.pkl`, pass in `<chatname>`.
+            pii_name (str): The name of the PII to load. If you wish to open `<chatname>.pii.pkl` or `<chatname>.pii.bin`, pass in `<chatname>`.
             pii_dir (str): The directory in which the PII is stored. Default is `piis`.
         """
         relative_pii_dir = os.path.join(os.path.dirname(__file__), pii_dir)
-        pii_path = f"{relative_pii_dir}/{pii_name}.pii.pkl"
-        encoding = detect_encoding(pii_path, self.language)
-        with open(pii_path, "rb") as f:
-            pii = pickle.load(f)
-            f.close()
-        return pii
+        pii_path = find_pii_file(relative_pii_dir, pii_name)
+        if pii_path is None:
+            raise FileNotFoundError(f"No PII named {pii_name} in {relative_pii_dir}")
+        return self.cache.get(pii_path, load_pii_file)
+
+    def load_unified_pii(self, pii_dir:str="piis") -> dict:
+        """
+        Returns the corpus-wide unified PII of the given directory (see `PIIConstructor.create_unified_pii_from_folder`), or `None` if there isn't one or it is older than one of the per-chat PIIs (in which case it is out of date).
+
+        Args:
+            pii_dir (str): The directory in which the PIIs are stored. Default is `piis`.
+        """
+        relative_pii_dir = os.path.join(os.path.dirname(__file__), pii_dir)
+        unified_path = os.path.join(relative_pii_dir, UNIFIED_PII_FILENAME)
+        if not os.path.exists(unified_path):
+            return None
+        unified_mtime = os.path.getmtime(unified_path)
+        for pii_name in list_pii_names(relative_pii_dir):
+            if os.path.getmtime(find_pii_file(relative_pii_dir, pii_name)) > unified_mtime:
+                return None
+        return self.cache.get(unified_path, self._unpickle_pii)
+
+    def warm_up(self, pii_dir:str="piis") -> dict:
+        """
+        Loads everything the first search would otherwise have to wait on: the stemmers, stopwords and segmentation models of the tokeniser (which are otherwise only loaded when first used, see `Tokeniser.warm_up`), and the corpus-wide statistics and unified PII of the given directory (if it has them), into the PII cache. Meant to be run in a background thread when the server starts, so it can answer requests while warming up.
+
+        Args:
+            pii_dir (str): The directory in which the PIIs are stored. Default is `piis`.
+
+        Returns:
+            (dict) How long each step took, in the format `{component: seconds}`.
+        """
+        timings = {}
+        start = time.perf_counter()
+        self.tokeniser.warm_up()
+        timings["tokeniser"] = time.perf_counter() - start
+        start = time.perf_counter()
+        self.load_global_stats(pii_dir)
+        timings["global stats"] = time.perf_counter() - start
+        start = time.perf_counter()
+        self.load_unified_pii(pii_dir)
+        timings["unified PII"] = time.perf_counter() - start
+        return timings
+
+    def get_cache_stats(self) -> dict:
+        """
+        Returns the hit/miss statistics of the PII cache (see `PIICache.stats`).
+        """
+        return self.cache.stats()
     
-    def bm25_search(self, tokens:list[str], positional_index:dict, top_n:int=10):
+    def get_result_cache_stats(self) -> dict:
         """
-        Computes BM25 scores for documents that contain query tokens.
-        Uses the PII to extract term frequency and positional data.
+        Returns the hit/miss statistics of the result cache (see `ResultCache.stats`).
         """
-        # build a document lengths dictionary from the index.
-        doc_lengths = {}
-        
-        for term in positional_index:
-            if term in positional_index and "postings" in positional_index[term]:
-                for docNo, positions in positional_index[term]["postings"].items():
-                    doc_lengths[docNo] = max(doc_lengths.get(docNo, 0), max(positions) + 1)
+        return self.result_cache.stats()
 
-        N = len(doc_lengths)
-        if N == 0:
-            return []
-        
-        avgdl = sum(doc_lengths.values()) / N if N > 0 else 0
+    def get_index_generation(self, pii_dir:str="piis") -> tuple[str, str]:
+        """
+        Returns the generation of the index in the given PII directory: its build id (see `core.pii.read_index_generation`), which changes whenever anything in it is rebuilt or removed, along with a fingerprint of its files (see `core.pii.index_fingerprint`), which also changes when they are changed by hand.
 
-        k1 = 0.75 # default - 1.2
-        b = 0.75 # default - 0.75
-        scores = {}
+        Args:
+            pii_dir (str): The directory in which the PIIs are stored. Default is `piis`.
+        """
+        relative_pii_dir = os.path.join(os.path.dirname(__file__), pii_dir)
+        return read_index_generation(relative_pii_dir), index_fingerprint(relative_pii_dir)
 
+    def _cached_results(self, key:tuple, search) -> list:
+        # the results of `search()`, served from the result cache if this search has been run on this generation of the index,
+        # with the chats' info files (which the results' display names come from) as they are now
+        key = (*key, self.language, self.get_index_generation(), self.get_chat_registry().fingerprint())
+        results = self.result_cache.get(key)
+        if results is None:
+            results = search()
+            self.result_cache.put(key, results)
+        return results
+
+    def get_collection_stats(self, positional_index:dict) -> dict:
+        """
+        Returns the collection statistics (`doc_lengths`, `N` and `avgdl`) of a PII (see `core.pii.get_collection_stats`).
+        """
+        return get_collection_stats(positional_index)
+
+    def load_global_stats(self, pii_dir:str="piis") -> dict:
+        """
+        Returns the corpus-wide statistics sidecar of the given PII directory (see `PIIConstructor.rebuild_global_stats`), or `None` if there isn't one. Served from `self.cache` like the PIIs themselves.
+
+        Args:
+            pii_dir (str): The directory in which the PIIs are stored. Default is `piis`.
+        """
+        stats_path = os.path.join(os.path.dirname(__file__), pii_dir, GLOBAL_STATS_FILENAME)
+        if not os.path.exists(stats_path):
+            return None
+        return self.cache.get(stats_path, self._unpickle_pii)
+
+    def bm25_idfs(self, tokens:list[str], positional_index:dict, global_stats:dict=None) -> tuple[list[tuple[str, float]], float]:
+        """
+        Returns the idf of each of the tokens in the PII, and the avgdl to score with. If `global_stats` (the corpus-wide statistics sidecar) is given, N, avgdl and the document frequencies are taken from it instead of the PII.
+
+        Args:
+            tokens (list[str]): The query tokens.
+            positional_index (dict): The PII.
+            global_stats (dict): The corpus-wide statistics. Default is `None`.
+
+        Returns:
+            (tuple[list[tuple[str, float]], float]) The `(token, idf)` of each token in the PII (in query order), and the avgdl.
+        """
+        stats = self.get_collection_stats(positional_index)
+        if global_stats is not None and global_stats["N"] > 0:
+            N = global_stats["N"]
+            avgdl = global_stats["avgdl"]
+            global_df = global_stats["document_frequency"]
+        else:
+            N = stats["N"]
+            avgdl = stats["avgdl"]
+            global_df = None
+
+        idfs = []
         for token in tokens:
             if token not in positional_index:
                 continue
             doc_freq = positional_index[token]["document_frequency"]
-            idf = math.log((N - doc_freq + 0.5) / (doc_freq + 0.5) + 1)
-            for doc_id, positions in positional_index[token]["postings"].items():
-                tf = len(positions)
+            if global_df is not None:
+                doc_freq = global_df.get(token, doc_freq)
+            idfs.append((token, math.log((N - doc_freq + 0.5) / (doc_freq + 0.5) + 1)))
+        return idfs, avgdl
+
+    def bm25_search(self, tokens:list[str], positional_index:dict, top_n:int=10, global_stats:dict=None):
+        """
+        Computes BM25 scores for documents that contain query tokens.
+        Uses the PII to extract term frequencies (without decoding positions where the PII stores them separately), and the collection statistics stored alongside it, so only the postings of the query tokens are touched.
+
+        If `global_stats` (the corpus-wide statistics sidecar) is given, N, avgdl and the document frequencies are taken from it instead of the PII, so scores are comparable between chats.
+
+        Scoring is done by `self.scoring`'s engine. Unified PIIs (keyed by `(chat_id, docNo)`) are always scored by the Python engine. Ties in score are broken by ascending docNo.
+        """
+        stats = self.get_collection_stats(positional_index)
+        if stats["N"] == 0:
+            return []
+        idfs, avgdl = self.bm25_idfs(tokens, positional_index, global_stats)
+
+        if self.scoring == "numpy" and PII_CHATS_KEY not in positional_index:
+            term_postings = [(*term_arrays(positional_index, token), idf) for token, idf in idfs]
+            ranked_results = bm25_top_n(term_postings, doc_length_array(positional_index), avgdl, top_n)
+            return [(str(doc_id), score) for doc_id, score in ranked_results]
+
+        doc_lengths = stats["doc_lengths"]
+        k1 = BM25_K1
+        b = BM25_B
+        scores = {}
+
+        for token, idf in idfs:
+            for doc_id, tf in get_term_frequencies(positional_index[token]).items():
                 dl = doc_lengths[doc_id]
                 score = idf * ((tf * (k1 + 1)) / (tf + k1 * (1 - b + b * (dl / avgdl))))
                 scores[doc_id] = scores.get(doc_id, 0) + score
 
-        ranked_results = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:top_n]
+        ranked_results = sorted(scores.items(), key=lambda x: (-x[1], doc_sort_key(x[0])))[:top_n]
         return ranked_results
 
-
-
-    def search_pii(self, query:str, pii:str, top_n:int=10) -> list[tuple[str, float]]:
+    def search_pii(self, query:str, pii:str, top_n:int=10, global_stats:dict=None) -> list[tuple[str, float]]:
         """
         Searches for the query in the given PII, returning the top N results.
 
@@ -92,17 +240,36 @@ class Searcher():
             query (str): The query to search for.
             pii (str): The PII to search in.
             top_n (int): The number of results to return. Default is 10.
+            global_stats (dict): The corpus-wide statistics to score with. Default is `None` (score with the PII's own statistics).
 
         Returns:
             (list[tuple[str, float]]) A list of the top N results for that PII in the format `(docNo, score)`.
         """
         tokens = self.tokeniser.tokenise(query)
-        return self.bm25_search(tokens, pii, top_n)
+        return self.bm25_search(tokens, pii, top_n, global_stats)
     
+    def search_unified_pii(self, query:str, unified_pii:dict, top_n:int=10) -> list[tuple[str, str, float]]:
+        """
+        Searches for the query in a unified PII, walking each query term's posting list once for the whole corpus.
+
+        Args:
+            query (str): The query to search for.
+            unified_pii (dict): The unified PII to search in.
+            top_n (int): The number of results to return. Default is 10.
+
+        Returns:
+            (list[tuple[str, str, float]]) A list of the top N results in the format `(pii_name, docNo, score)`.
+        """
+        chats = unified_pii[PII_CHATS_KEY]
+        top_n_results = self.search_pii(query, unified_pii, top_n)
+        return [(chats[chat_id], str(docNo), score) for (chat_id, docNo), score in top_n_results]
+
     def search_all_piis_in_folder(self, query:str, input_dir:str="piis", top_n:int=10) -> list[tuple[str, str, float]]:
         """
         Searches for the query in all PIIs in the given directory. Each PII returns the top N results for that PII, which is then truncated to the top N results for all PIIs.
 
+        Every PII is scored with the corpus-wide statistics (if the directory has them), so the scores of different chats are comparable and a single merge gives the correct top N. If the directory has an up to date unified PII, that is searched instead. If the `Searcher` has a pool of workers, the chats are searched in parallel by them.
+
         Args:
             query (str): The query to search for.
             input_dir (str): The directory in which the PIIs are stored. Default is `piis`.
@@ -114,13 +281,18 @@ class Searcher():
         # make sure we're preserving the path to piis to be relative to where search.py is
         pii_dir = os.path.join(os.path.dirname(__file__), input_dir)
         print(f"DEBUG: Searching in {pii_dir}")
+        unified_pii = self.load_unified_pii(input_dir)
+        if unified_pii is not None:
+            return self.search_unified_pii(query, unified_pii, top_n)
+        pii_names = list_pii_names(pii_dir)
+        if self.pool is not None and len(pii_names) > 1:
+            return self.pool.search(self.tokeniser.tokenise(query), pii_names, input_dir, top_n)
+        global_stats = self.load_global_stats(input_dir)
         results = []
-        for pii_file in os.listdir(pii_dir):
-            if pii_file.endswith(".pii.pkl"):
-                pii_name = pii_file.split(".")[0]
-                pii = self.load_pii(pii_name)
-                top_n_results = self.search_pii(query, pii, top_n)
-                results.extend([(pii_name, docNo, score) for docNo, score in top_n_results if top_n_results])
+        for pii_name in pii_names:
+            pii = self.load_pii(pii_name, input_dir)
+            top_n_results = self.search_pii(query, pii, top_n, global_stats)
+            results.extend([(pii_name, docNo, score) for docNo, score in top_n_results if top_n_results])
         return sorted(results, key=lambda x: x[2], reverse=True)[:top_n]
     
     def convert_unix_timestamp_to_datetime(self, timestamp:int) -> str:
@@ -135,6 +307,18 @@ class Searcher():
         """
         return datetime.fromtimestamp(timestamp / 1000.0).strftime('%Y-%m-%d %H:%M:%S')
     
+    def get_chat_registry(self, out_dir="out") -> ChatRegistry:
+        """
+        Returns the `ChatRegistry` of the chats in the given directory, which is created on first use and kept up to date from then on.
+
+        Args:
+            out_dir (str): The directory in which the info files are stored (under `info/`). Default is `out`.
+        """
+        info_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), out_dir, "info"))
+        if info_dir not in self._chat_registries:
+            self._chat_registries[info_dir] = ChatRegistry(info_dir, self.language)
+        return self._chat_registries[info_dir]
+
     def get_display_name_from_chatname(self, chatname:str, out_dir="out") -> str:
         """
         Given an internal chatname, returns the display name of the chat.
@@ -143,31 +327,179 @@ class Searcher():
             chatname (str): The internal chatname to get the display name for.
             out_dir (str): The directory in which the info files are stored. Default is `out`.
         """
-        relative_out_dir = os.path.join(os.path.dirname(__file__), out_dir)
-        info_path = f"{relative_out_dir}/info/{chatname}.info.csv"
-        encoding = detect_encoding(info_path, self.language)
-        with open(info_path, "r", encoding=encoding, errors="replace") as f:
-            display_name = f.readlines()[1].split(",")[1]
-            f.close()
-        return display_name
+        return self.get_chat_registry(out_dir).get_display_name(chatname)
     
-    def get_row_from_docno(self, docno:int, chatlog_path:str) -> str:
+    def get_chatlog_index(self, chatlog_path:str) -> ChatlogIndex:
         """
-        Given a docno, returns the row in the chatlog that corresponds to that docno.
+        Returns the `ChatlogIndex` of the given chatlog, which is kept open between calls (and reopened if the chatlog changes on disk).
+
+        Args:
+            chatlog_path (str): The path to the chatlog.
+        """
+        chatlog_path = os.path.abspath(chatlog_path)
+        index = self._chatlog_indexes.get(chatlog_path)
+        if index is None or index.is_stale():
+            if index is not None:
+                index.close() # so the offsets sidecar can be rewritten (Windows won't replace a file while it is mapped)
+            index = ChatlogIndex(chatlog_path, detect_encoding(chatlog_path, self.language))
+            self._chatlog_indexes[chatlog_path] = index
+        return index
+
+    def get_message_store(self, chatlog_path:str) -> MessageStore:
+        """
+        Returns the `MessageStore` of the given chatlog (`<chatname>.chatlog.store`, next to the chatlog), which is kept open between calls so its decompressed blocks stay cached. A store built from an older version of the chatlog is ignored.
+
+        Args:
+            chatlog_path (str): The path to the chatlog (which need not exist any more, if the store does).
+
+        Returns:
+            (MessageStore) The message store, or `None` if the chatlog doesn't have an up to date one.
+        """
+        store_path = os.path.abspath(message_store_path(chatlog_path))
+        store = self._message_stores.get(store_path)
+        if store is not None and os.path.exists(store_path) and os.stat(store_path).st_mtime_ns == store.store_mtime_ns and store.is_current(chatlog_path):
+            return store
+        if store is not None:
+            # the store or its chatlog has changed since it was opened. Close it, so the store can be rebuilt (Windows won't replace a file while it is mapped)
+            store.close()
+            del self._message_stores[store_path]
+        if not os.path.exists(store_path):
+            return None
+        store = MessageStore(store_path)
+        if not store.is_current(chatlog_path):
+            print(f"DEBUG: Ignoring out of date message store {store_path}")
+            store.close()
+            return None
+        self._message_stores[store_path] = store
+        return store
+
+    def get_row_from_docno(self, docno:int, chatlog_path:str) -> list[str]:
+        """
+        Given a docno, returns the row in the chatlog that corresponds to that docno. If the chatlog has a message store (see `get_message_store`), the row is read from the compressed block holding it. Otherwise it is read straight from its offset in the chatlog (see `get_chatlog_index`) and parsed as CSV, so messages containing commas, quotes or line breaks come back whole.
 
         Args:
             docno (int): The docno to search for.
             chatlog_path (str): The path to the chatlog to search in.
+
+        Returns:
+            (list[str]) The fields of the row, or `None` if the chatlog has no such docno.
         """
-        encoding = detect_encoding(chatlog_path, self.language)
-        with open(chatlog_path, "r", encoding=encoding, errors="replace") as f:
-            chatlog = f.readlines()
-            f.close()
-        for row in chatlog:
-            if row.split(",")[0] == str(docno):
-                return row
-        return None
+        store = self.get_message_store(chatlog_path)
+        if store is not None:
+            return store.get_row(docno)
+        return self.get_chatlog_index(chatlog_path).get_row(docno)
     
+    def get_rows_between(self, first_docno:int, last_docno:int, chatlog_path:str) -> list[list[str]]:
+        """
+        Returns the rows in the chatlog of every docno in the given (inclusive) range, in order. The range is read in one go: from the blocks of the chat's message store that overlap it if it has one (see `get_message_store`), otherwise with a single sequential read of the chatlog (see `get_chatlog_index`).
+
+        Args:
+            first_docno (int): The first docno of the range.
+            last_docno (int): The last docno of the range.
+            chatlog_path (str): The path to the chatlog to read from.
+
+        Returns:
+            (list[list[str]]) The fields of each row in the range.
+        """
+        store = self.get_message_store(chatlog_path)
+        if store is not None:
+            return store.get_rows(first_docno, last_docno)
+        return self.get_chatlog_index(chatlog_path).get_rows(first_docno, last_docno)
+
+    def get_num_messages(self, chatname:str, out_dir="out") -> int:
+        """
+        Returns the number of messages in a chat, without reading its chatlog.
+
+        Args:
+            chatname (str): The internal chatname.
+            out_dir (str): The directory in which the chatlogs are stored. Default is `out`.
+        """
+        chatlog_path = os.path.join(os.path.dirname(__file__), out_dir, "chatlogs", f"{chatname}.chatlog.csv")
+        store = self.get_message_store(chatlog_path)
+        if store is not None:
+            return store.num_rows
+        return self.get_chatlog_index(chatlog_path).num_rows
+
+    def get_max_docNo(self, chatname:str, out_dir="out") -> int:
+        """
+        Returns the largest docNo in a chat, without reading its chatlog. This can be more than the number of messages, as docNos can have gaps (see `ChatlogIndex.max_docNo`).
+
+        Args:
+            chatname (str): The internal chatname.
+            out_dir (str): The directory in which the chatlogs are stored. Default is `out`.
+        """
+        chatlog_path = os.path.join(os.path.dirname(__file__), out_dir, "chatlogs", f"{chatname}.chatlog.csv")
+        store = self.get_message_store(chatlog_path)
+        if store is not None:
+            return store.max_docNo
+        return self.get_chatlog_index(chatlog_path).max_docNo
+
+    def get_chatlog_columns(self, chatlog_path:str) -> list[str]:
+        """
+        Returns the columns of a chatlog (its header row), from the chat's message store if it has one, otherwise from its chatlog index. The column order differs between the export parsers (e.g. `is_media` is not always the 10th column), so fields other than the first four should be looked up by name.
+
+        Args:
+            chatlog_path (str): The path to the chatlog.
+        """
+        store = self.get_message_store(chatlog_path)
+        if store is not None:
+            return store.columns
+        return self.get_chatlog_index(chatlog_path).columns
+
+    def _message_details_from_row(self, doc_id:int, row:list[str]) -> dict:
+        # the same fields as `flask_get_message_details_from_search_result`
+        text = row[3]
+        if not text:
+            text = "[Media]"
+        return {
+            "doc_id": doc_id,
+            "message": text,
+            "sender": row[2],
+            "timestamp": self.convert_unix_timestamp_to_datetime(int(row[1])),
+        }
+
+    def get_context_window(self, chatname:str, docNo:int, n:int, include_media:bool=True, out_dir="out") -> list[dict]:
+        """
+        Returns the messages around a given message in a chat: the message itself, with up to `n` messages either side of it (fewer if the chat starts or ends first).
+
+        Each side is read as a contiguous range of docNos (see `get_rows_between`) rather than a message at a time. If media messages are skipped, a side may come up short, in which case the range before (or after) it is read as well, doubling in size each time.
+
+        Args:
+            chatname (str): The internal chatname.
+            docNo (int): The docNo of the message at the centre of the window.
+            n (int): The number of messages to return on either side.
+            include_media (bool): Whether media messages count towards the window. If not, they are skipped over, so that there are (up to) `n` non-media messages either side (chatlogs without an `is_media` column have nothing skipped). The centre message is always included. Default is `True`.
+            out_dir (str): The directory in which the chatlogs are stored. Default is `out`.
+
+        Returns:
+            (list[dict]) The messages in docNo order, each in the format of `flask_get_message_details_from_search_result`.
+        """
+        docNo = int(docNo)
+        chatlog_path = os.path.join(os.path.dirname(__file__), out_dir, "chatlogs", f"{chatname}.chatlog.csv")
+        max_docNo = self.get_max_docNo(chatname, out_dir)
+
+        columns = self.get_chatlog_columns(chatlog_path)
+        is_media = columns.index("is_media") if "is_media" in columns else None
+
+        def keep(row:list[str]) -> bool:
+            return include_media or is_media is None or is_media >= len(row) or row[is_media] != "True"
+
+        before = []
+        first, chunk = docNo, n if include_media else 2 * n
+        while len(before) < n and first > 1:
+            last, first = first - 1, max(first - chunk, 1)
+            before = [row for row in self.get_rows_between(first, last, chatlog_path) if keep(row)] + before
+            chunk *= 2
+        after = []
+        last, chunk = docNo, n if include_media else 2 * n
+        while len(after) < n and last < max_docNo:
+            first, last = last + 1, min(last + chunk, max_docNo)
+            after += [row for row in self.get_rows_between(first, last, chatlog_path) if keep(row)]
+            chunk *= 2
+
+        window = (before[-n:] if n > 0 else []) + self.get_rows_between(docNo, docNo, chatlog_path) + after[:n]
+        return [self._message_details_from_row(int(row[0]), row) for row in window]
+
     def get_message_from_search_result(self, search_result:tuple[str, str, float], out_dir="out") -> str:
         """
         Given a search result, returns the message.
@@ -184,20 +516,11 @@ class Searcher():
         """
         internal_chatname, docNo, _ = search_result
         relative_out_dir = os.path.join(os.path.dirname(__file__), out_dir)
-        # First we need the proper chatname. This can be found at out_dir/info/<internal_chatname>.info.csv, under the "Display name" column
-        info_path = f"{relative_out_dir}/info/{internal_chatname}.info.csv"
-        print(f"DEBUG: Looking for file at {info_path}")
-        encoding = detect_encoding(info_path, self.language)
-        with open(info_path, "r", encoding=encoding, errors="replace") as f:
-            chatname = f.readlines()[1].split(",")[1]
-            f.close()
-        # Now we can get the remaining information by reading the chatlog, at out_dir/chatlogs/<internal_chatname>.chatlog.csv
+        # First we need the proper chatname, the "Display name" of out_dir/info/<internal_chatname>.info.csv
+        chatname = self.get_display_name_from_chatname(internal_chatname, out_dir)
+        # Now we can get the remaining information from the row in the chatlog, at out_dir/chatlogs/<internal_chatname>.chatlog.csv
         chatlog_path = f"{relative_out_dir}/chatlogs/{internal_chatname}.chatlog.csv"
-        encoding = detect_encoding(chatlog_path, self.language)
-        with open(chatlog_path, "r", encoding=encoding, errors="replace") as f:
-            chatlog = f.readlines()
-            f.close()
-        message = self.get_row_from_docno(docNo, chatlog_path).split(",") # we should only really get one message here, so as a hack we just get the first
+        message = self.get_row_from_docno(docNo, chatlog_path)
         date = self.convert_unix_timestamp_to_datetime(int(message[1]))
         sender = message[2]
         text = message[3]
@@ -213,17 +536,11 @@ class Searcher():
     def flask_get_message_details_new(self, search_result:tuple[str, str, float], out_dir="out") -> tuple[str, str, str, str, str]:
         internal_chatname, docNo, _ = search_result
         relative_out_dir = os.path.join(os.path.dirname(__file__), out_dir)
-        # First we need the proper chatname. This can be found at out_dir/info/<internal_chatname>.info.csv, under the "Display name" column
-        info_path = f"{relative_out_dir}/info/{internal_chatname}.info.csv"
-        with open(info_path, "r", encoding='utf-8-sig', errors='replace') as f:
-            chatname = f.readlines()[1].split(",")[1]
-            f.close()
-        # Now we can get the remaining information by reading the chatlog, at out_dir/chatlogs/<internal_chatname>.chatlog.csv
+        # First we need the proper chatname, the "Display name" of out_dir/info/<internal_chatname>.info.csv
+        chatname = self.get_display_name_from_chatname(internal_chatname, out_dir)
+        # Now we can get the remaining information from the row in the chatlog, at out_dir/chatlogs/<internal_chatname>.chatlog.csv
         chatlog_path = f"{relative_out_dir}/chatlogs/{internal_chatname}.chatlog.csv"
-        with open(chatlog_path, "r", encoding='utf-8-sig', errors='replace') as f:
-            chatlog = f.readlines()
-            f.close()
-        message = self.get_row_from_docno(docNo, chatlog_path).split(",") # we should only really get one message here, so as a hack we just get the first
+        message = self.get_row_from_docno(docNo, chatlog_path)
         date = self.convert_unix_timestamp_to_datetime(int(message[1]))
         sender = message[2]
         text = message[3]
@@ -295,8 +612,9 @@ class Searcher():
             ```
         """
         internal_chat_name = search_result[0]
-        chatName = self.get_display_name_from_chatname(internal_chat_name)
-        platform = internal_chat_name.split("__")[0]
+        chat = self.get_chat_registry(out_dir).get_chat(internal_chat_name)
+        chatName = chat["display_name"]
+        platform = chat["platform"]
         if platform not in ["instagram", "whatsapp", "line", "wechat"]:
             print(f"DEBUG ERROR: Unknown platform {platform}")
             platform = "instagram" # fallback
@@ -312,7 +630,7 @@ class Searcher():
     # now for the functions that will be used in the api
     def flask_search(self, query:str, n:int=50) -> list[str]:
         """
-        Searches for the query in all PIIs in the `piis` directory.
+        Searches for the query in all PIIs in the `piis` directory. Results are cached by the tokenised query (so e.g. "Running" and "run" share them) until the index is rebuilt.
 
         Args:
             query (str): The query to search for.
@@ -321,65 +639,29 @@ class Searcher():
         Returns:
             (list[str]) A list of the top `n` messages that match the query.
         """
-        results = self.search_all_piis_in_folder(query, top_n=n)
-        messages = [self.flask_get_message_data(result) for result in results]
-        return messages[:n]
+        def search():
+            results = self.search_all_piis_in_folder(query, top_n=n)
+            messages = [self.flask_get_message_data(result) for result in results]
+            return messages[:n]
+        return self._cached_results(("search", tuple(self.tokeniser.tokenise(query)), n), search)
     
-    def proximity_search(self, terms:list[str], positional_inverted_index:dict, n:int, top_n:int=25) -> list[tuple[int, float]]:
+    def proximity_search(self, terms:list[str], positional_inverted_index:dict, n:int, top_n:int=25, ordered:bool=False) -> list[tuple[int, float]]:
         """
-        Performs a proximity search for the terms in the given positional inverted index.
+        Performs a proximity search for the terms in the given positional inverted index: finds the documents in which all the terms appear within a window spanning at most `n` positions, scored by how many such (minimal) windows each has. See `core.proximity_search` for the matching, which is linear in the number of positions.
 
         Args:
             terms (list[str]): The terms to search for.
             positional_inverted_index (dict): The positional inverted index to search in.
             n (int): The proximity parameter.
-            top_n (int): The number of results to return. Default is 10.
+            top_n (int): The number of results to return. Default is 25.
+            ordered (bool): Whether the terms must appear in the order given. Default is `False`.
 
         Returns:
             (list[tuple[int, float]]) A list of the top N results for the given queries in the format `(docNo, score)`.
         """
-
-        doc_scores = {}
-
-        postings_by_terms = {term: positional_inverted_index[term]["postings"] for term in terms if term in positional_inverted_index and "postings" in positional_inverted_index[term]} # love a good dict comprehension
-        if not postings_by_terms:
-            return []
-        
-        docs_containing_some_term = set()
-        for posting in postings_by_terms.values():
-            docs_containing_some_term.update(posting.keys())
-
-        print(f"DEBUG: Searching for {terms} in {len(docs_containing_some_term)} documents")
-        print(f"DEBUG: {docs_containing_some_term}")
-
-        for docNo in docs_containing_some_term:
-            positions_by_term = []
-            for term in terms:
-                print(f"DEBUG: Checking {term} in {docNo}")
-                if term in positional_inverted_index and str(docNo) in positional_inverted_index[term]["postings"]:
-                    positions_by_term.append(positional_inverted_index[term]["postings"][str(docNo)])
-                else:
-                    positions_by_term = []
-                    break
-            if not positions_by_term:
-                continue # avoid checking docs that don't contain all terms
-            
-            score_for_doc = 0
-            print(f"DEBUG: {positions_by_term}")
-
-            for i in range(len(positions_by_term) - 1):
-                for j in positions_by_term[i]:
-                    for k in positions_by_term[i + 1]:
-                        if abs(j - k) <= n:
-                            score_for_doc += 1
-                            
-
-            if score_for_doc > 0:
-                doc_scores[docNo] = doc_scores.get(docNo, 0) + score_for_doc
-
-        return sorted(doc_scores.items(), key=lambda x: x[1], reverse=True)[:top_n]
+        return find_proximity_matches(terms, positional_inverted_index, n, top_n, ordered)
     
-    def prox_search_pii(self, query:str, n:int, pii:dict, top_n:int=10) -> list[tuple[int, float]]:
+    def prox_search_pii(self, query:str, n:int, pii:dict, top_n:int=10, ordered:bool=False) -> list[tuple[int, float]]:
         """
         Proximity searches a query in a given PII, returning the top N results.
 
@@ -388,54 +670,220 @@ class Searcher():
             n (int): The proximity parameter.
             pii (dict): The PII to search in.
             top_n (int): The number of results to return. Default is 10.
+            ordered (bool): Whether the terms must appear in the order given. Default is `False`.
 
         Returns:
             (list[tuple[int, float]]) A list of the top N results for that PII in the format `(docNo, score)`.
         """
         terms = self.tokeniser.tokenise(query)
-        return self.proximity_search(terms, pii, n, top_n)
+        return self.proximity_search(terms, pii, n, top_n, ordered)
     
-    def prox_search_all_piis(self, query:str, n:int, input_dir:str="piis", top_n:int=10) -> list[tuple[str, str, float]]:
+    def prox_search_all_piis(self, query:str, n:int, input_dir:str="piis", top_n:int=10, ordered:bool=False) -> list[tuple[str, str, float]]:
         """
-        Performs a proximity search for all of the terms in the query in all PIIs in the given directory. Each PII returns the top N results for that PII, which is then truncated to the top N results for all PIIs.
+        Performs a proximity search for all of the terms in the query in all PIIs in the given directory. Each PII returns the top N results for that PII, which is then truncated to the top N results for all PIIs. If the directory has an up to date unified PII, that is searched instead. If the `Searcher` has a pool of workers, the chats are searched in parallel by them.
 
         Args:
             query (str): The query to search for.
             n (int): The proximity parameter for the search.
             input_dir (str): The directory in which the PIIs are stored. Default is `piis`.
             top_n (int): The number of results to return for each PII. Default is 10.
+            ordered (bool): Whether the terms must appear in the order given. Default is `False`.
 
         Returns:
             (list[tuple[str, str, float]]) A list of the top N results for all PIIs in the format `(pii_name, docNo, score)`.
         """
         pii_dir = os.path.join(os.path.dirname(__file__), input_dir)
         
-        terms = query.split() # split on whitespace by default
+        terms = self.tokeniser.tokenise(query)
         if len(terms) < 2:
             # silently fallback to normal search
             return self.search_all_piis_in_folder(query, input_dir, top_n)
         print(f"DEBUG: Proximity searching \"{query}\" ({terms}) with parameter {n} in {pii_dir}")
+        unified_pii = self.load_unified_pii(input_dir)
+        if unified_pii is not None:
+            chats = unified_pii[PII_CHATS_KEY]
+            top_n_results = self.prox_search_pii(query, n, unified_pii, top_n, ordered)
+            return [(chats[chat_id], str(docNo), score) for (chat_id, docNo), score in top_n_results]
+        pii_names = list_pii_names(pii_dir)
+        if self.pool is not None and len(pii_names) > 1:
+            return self.pool.prox_search(terms, n, pii_names, input_dir, top_n, ordered)
         results = []
-        for pii_file in os.listdir(pii_dir):
-            if pii_file.endswith(".pii.pkl"):
-                pii_name = pii_file.split(".")[0]
-                pii = self.load_pii(pii_name)
-                top_n_results = self.prox_search_pii(query, n, pii, top_n)
-                results.extend([(pii_name, docNo, score) for docNo, score in top_n_results if top_n_results])
+        for pii_name in pii_names:
+            pii = self.load_pii(pii_name, input_dir)
+            top_n_results = self.prox_search_pii(query, n, pii, top_n, ordered)
+            results.extend([(pii_name, docNo, score) for docNo, score in top_n_results if top_n_results])
         return sorted(results, key=lambda x: x[2], reverse=True)[:top_n]
     
-    def flask_prox_search(self, query:str, n:int, top_n:int=25) -> list[str]:
+    def flask_prox_search(self, query:str, n:int, top_n:int=25, ordered:bool=False) -> list[str]:
         """
-        Proximity searches for the query in all PIIs in the `piis` directory.
+        Proximity searches for the query in all PIIs in the `piis` directory. Results are cached by the tokenised query until the index is rebuilt.
 
         Args:
             query (str): The query to search for.
             n (int): The proximity parameter for the search.
             top_n (int): The number of results to return. Default is 25.
+            ordered (bool): Whether the terms must appear in the order given. Default is `False`.
+
+        Returns:
+            (list[str]) A list of the top `n` messages that match the query.
+        """
+        def search():
+            results = self.prox_search_all_piis(query, n, top_n=top_n, ordered=ordered)
+            messages = [self.flask_get_message_data(result) for result in results]
+            return messages[:top_n]
+        return self._cached_results(("proximity", tuple(self.tokeniser.tokenise(query)), n, top_n, ordered), search)
+    
+    def phrase_search(self, terms:list[str], positional_inverted_index:dict, top_n:int=25) -> list[tuple[str, int]]:
+        """
+        Performs a phrase search for the terms in the given positional inverted index: finds the documents in which the terms appear at consecutive positions, in order, scored by how many times each contains the phrase. See `core.phrase_search` for the matching, which works on the postings alone (the messages are never re-read).
+
+        Args:
+            terms (list[str]): The terms of the phrase, in order.
+            positional_inverted_index (dict): The positional inverted index to search in.
+            top_n (int): The number of results to return. Default is 25.
+
+        Returns:
+            (list[tuple[str, int]]) A list of the top N results for the phrase in the format `(docNo, score)`.
+        """
+        return find_phrase_matches(terms, positional_inverted_index, top_n)
+    
+    def phrase_search_pii(self, query:str, pii:dict, top_n:int=10) -> list[tuple[str, int]]:
+        """
+        Phrase searches a query in a given PII, returning the top N results.
+
+        Args:
+            query (str): The phrase to search for (any quotes around it are dropped by the tokeniser).
+            pii (dict): The PII to search in.
+            top_n (int): The number of results to return. Default is 10.
+
+        Returns:
+            (list[tuple[str, int]]) A list of the top N results for that PII in the format `(docNo, score)`.
+        """
+        terms = self.tokeniser.tokenise(query)
+        return self.phrase_search(terms, pii, top_n)
+    
+    def phrase_search_all_piis(self, query:str, input_dir:str="piis", top_n:int=10) -> list[tuple[str, str, int]]:
+        """
+        Performs a phrase search for the query in all PIIs in the given directory. Each PII returns the top N results for that PII, which is then truncated to the top N results for all PIIs. If the directory has an up to date unified PII, that is searched instead. If the `Searcher` has a pool of workers, the chats are searched in parallel by them.
+
+        Args:
+            query (str): The phrase to search for.
+            input_dir (str): The directory in which the PIIs are stored. Default is `piis`.
+            top_n (int): The number of results to return for each PII. Default is 10.
+
+        Returns:
+            (list[tuple[str, str, int]]) A list of the top N results for all PIIs in the format `(pii_name, docNo, score)`.
+        """
+        pii_dir = os.path.join(os.path.dirname(__file__), input_dir)
+        print(f"DEBUG: Phrase searching \"{query}\" in {pii_dir}")
+        unified_pii = self.load_unified_pii(input_dir)
+        if unified_pii is not None:
+            chats = unified_pii[PII_CHATS_KEY]
+            top_n_results = self.phrase_search_pii(query, unified_pii, top_n)
+            return [(chats[chat_id], str(docNo), score) for (chat_id, docNo), score in top_n_results]
+        pii_names = list_pii_names(pii_dir)
+        if self.pool is not None and len(pii_names) > 1:
+            return self.pool.phrase_search(self.tokeniser.tokenise(query), pii_names, input_dir, top_n)
+        results = []
+        for pii_name in pii_names:
+            pii = self.load_pii(pii_name, input_dir)
+            top_n_results = self.phrase_search_pii(query, pii, top_n)
+            results.extend([(pii_name, docNo, score) for docNo, score in top_n_results])
+        return sorted(results, key=lambda x: x[2], reverse=True)[:top_n]
+    
+    def flask_phrase_search(self, query:str, top_n:int=25) -> list[str]:
+        """
+        Phrase searches for the query in all PIIs in the `piis` directory. Results are cached by the tokenised phrase until the index is rebuilt.
+
+        Args:
+            query (str): The phrase to search for.
+            top_n (int): The number of results to return. Default is 25.
+
+        Returns:
+            (list[str]) A list of the top `n` messages that contain the phrase.
+        """
+        def search():
+            results = self.phrase_search_all_piis(query, top_n=top_n)
+            messages = [self.flask_get_message_data(result) for result in results]
+            return messages[:top_n]
+        return self._cached_results(("phrase", tuple(self.tokeniser.tokenise(query)), top_n), search)
+    
+    def boolean_search(self, query:str, positional_index:dict, top_n:int=10, global_stats:dict=None) -> list[tuple[str, float]]:
+        """
+        Performs a boolean search for the query in the given PII (see `core.boolean_search.QueryPlanner` for the query language). The query is compiled into a plan (or its plan is taken from `self.query_planner`'s cache), and the plan is run against the PII to find the matching documents. These are then ranked by the BM25 score of the terms they match (those not under a NOT), with ties broken by ascending docNo.
+
+        Args:
+            query (str): The boolean query.
+            positional_index (dict): The PII to search in.
+            top_n (int): The number of results to return. Default is 10.
+            global_stats (dict): The corpus-wide statistics to score with. Default is `None` (score with the PII's own statistics).
+
+        Returns:
+            (list[tuple[str, float]]) A list of the top N results for that PII in the format `(docNo, score)`.
+        """
+        plan = self.query_planner.compile(query)
+        matches = PlanExecutor(positional_index).execute(plan)
+        if not matches:
+            return []
+        idfs, avgdl = self.bm25_idfs(positive_terms(plan), positional_index, global_stats)
+        doc_lengths = self.get_collection_stats(positional_index)["doc_lengths"]
+        k1 = BM25_K1
+        b = BM25_B
+        scores = dict.fromkeys(matches, 0.0)
+
+        for token, idf in idfs:
+            term_frequencies = get_term_frequencies(positional_index[token])
+            for doc_id in matches:
+                tf = term_frequencies.get(doc_id)
+                if tf:
+                    dl = doc_lengths[doc_id]
+                    scores[doc_id] += idf * ((tf * (k1 + 1)) / (tf + k1 * (1 - b + b * (dl / avgdl))))
+
+        return sorted(scores.items(), key=lambda x: (-x[1], doc_sort_key(x[0])))[:top_n]
+    
+    def boolean_search_all_piis(self, query:str, input_dir:str="piis", top_n:int=10) -> list[tuple[str, str, float]]:
+        """
+        Performs a boolean search for the query in all PIIs in the given directory. Each PII returns the top N results for that PII, which is then truncated to the top N results for all PIIs. Like `search_all_piis_in_folder`, every PII is scored with the corpus-wide statistics (if the directory has them), an up to date unified PII is searched instead if there is one, and the chats are searched in parallel if the `Searcher` has a pool of workers.
+
+        Args:
+            query (str): The boolean query.
+            input_dir (str): The directory in which the PIIs are stored. Default is `piis`.
+            top_n (int): The number of results to return for each PII. Default is 10.
+
+        Returns:
+            (list[tuple[str, str, float]]) A list of the top N results for all PIIs in the format `(pii_name, docNo, score)`.
+        """
+        pii_dir = os.path.join(os.path.dirname(__file__), input_dir)
+        print(f"DEBUG: Boolean searching \"{query}\" ({self.query_planner.compile(query)}) in {pii_dir}")
+        unified_pii = self.load_unified_pii(input_dir)
+        if unified_pii is not None:
+            chats = unified_pii[PII_CHATS_KEY]
+            top_n_results = self.boolean_search(query, unified_pii, top_n)
+            return [(chats[chat_id], str(docNo), score) for (chat_id, docNo), score in top_n_results]
+        pii_names = list_pii_names(pii_dir)
+        if self.pool is not None and len(pii_names) > 1:
+            return self.pool.boolean_search(query, pii_names, input_dir, top_n)
+        global_stats = self.load_global_stats(input_dir)
+        results = []
+        for pii_name in pii_names:
+            pii = self.load_pii(pii_name, input_dir)
+            top_n_results = self.boolean_search(query, pii, top_n, global_stats)
+            results.extend([(pii_name, docNo, score) for docNo, score in top_n_results])
+        return sorted(results, key=lambda x: x[2], reverse=True)[:top_n]
+    
+    def flask_boolean_search(self, query:str, top_n:int=25) -> list[str]:
+        """
+        Boolean searches for the query in all PIIs in the `piis` directory. Results are cached by the compiled plan of the query (which holds its tokens) until the index is rebuilt.
+
+        Args:
+            query (str): The boolean query.
+            top_n (int): The number of results to return. Default is 25.
 
         Returns:
             (list[str]) A list of the top `n` messages that match the query.
         """
-        results = self.prox_search_all_piis(query, n, top_n=top_n)
-        messages = [self.flask_get_message_data(result) for result in results]
-        return messages[:top_n]
+        def search():
+            results = self.boolean_search_all_piis(query, top_n=top_n)
+            messages = [self.flask_get_message_data(result) for result in results]
+            return messages[:top_n]
+        return self._cached_results(("boolean", self.query_planner.compile(query), top_n), search)
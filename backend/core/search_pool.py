@@ -0,0 +1,151 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import heapq
+import multiprocessing
+
+# the `Searcher` of each worker process, created once by `_init_worker` and kept (with its cache of loaded PIIs) for the life of the pool
+_worker_searcher = None
+
+
+def _init_worker(language:str, scoring:str, cache_max_bytes:int) -> None:
+    global _worker_searcher
+    from .search import Searcher
+    _worker_searcher = Searcher(language=language, scoring=scoring)
+    _worker_searcher.cache.set_max_bytes(cache_max_bytes)
+
+def _search_chats(tokens:list[str], pii_names:list[str], input_dir:str, top_n:int) -> list[list[tuple[str, str, float]]]:
+    global_stats = _worker_searcher.load_global_stats(input_dir)
+    results = []
+    for pii_name in pii_names:
+        pii = _worker_searcher.load_pii(pii_name, input_dir)
+        results.append([(pii_name, docNo, score) for docNo, score in _worker_searcher.bm25_search(tokens, pii, top_n, global_stats)])
+    return results
+
+def _prox_search_chats(terms:list[str], n:int, pii_names:list[str], input_dir:str, top_n:int, ordered:bool) -> list[list[tuple[str, str, float]]]:
+    results = []
+    for pii_name in pii_names:
+        pii = _worker_searcher.load_pii(pii_name, input_dir)
+        results.append([(pii_name, docNo, score) for docNo, score in _worker_searcher.proximity_search(terms, pii, n, top_n, ordered)])
+    return results
+
+def _phrase_search_chats(terms:list[str], pii_names:list[str], input_dir:str, top_n:int) -> list[list[tuple[str, str, int]]]:
+    results = []
+    for pii_name in pii_names:
+        pii = _worker_searcher.load_pii(pii_name, input_dir)
+        results.append([(pii_name, docNo, score) for docNo, score in _worker_searcher.phrase_search(terms, pii, top_n)])
+    return results
+
+def _boolean_search_chats(query:str, pii_names:list[str], input_dir:str, top_n:int) -> list[list[tuple[str, str, float]]]:
+    global_stats = _worker_searcher.load_global_stats(input_dir)
+    results = []
+    for pii_name in pii_names:
+        pii = _worker_searcher.load_pii(pii_name, input_dir)
+        results.append([(pii_name, docNo, score) for docNo, score in _worker_searcher.boolean_search(query, pii, top_n, global_stats)])
+    return results
+
+
+class SearchPool:
+    """
+    A persistent pool of worker processes that searches many chats in parallel. The chats are split into batches, each worker searches its batches and returns the top N results of every chat in them, and these partial top N lists are merged into the overall top N in the parent.
+
+    Each worker has its own `Searcher`, and so its own cache of loaded PIIs, which stays warm between queries. Note that a chat may be searched by a different worker each time, so every worker can end up caching every PII: `cache_max_bytes` is the budget of *each* worker.
+
+    The workers are spawned (rather than forked) processes. They are only started once there is something to search, by which time the server is running request threads (and possibly warming up in another); a forked worker would inherit whatever locks those threads held at that moment (e.g. of a `LazyResource` or the `PIICache`) and could hang on them.
+
+    Args:
+        workers (int): The number of worker processes.
+        language (str): The language the workers tokenise with (queries are tokenised by the parent, but the workers' `Searcher`s still need one).
+        scoring (str): The BM25 scoring engine of the workers (see `Searcher`). Default is '`numpy`'.
+        cache_max_bytes (int): The byte budget of each worker's PII cache. Default is 512MB.
+    """
+    def __init__(self, workers:int, language:str="english", scoring:str="numpy", cache_max_bytes:int=512 * 1024 * 1024):
+        self.workers = workers
+        self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker, initargs=(language, scoring, cache_max_bytes))
+
+    def __repr__(self):
+        return f"Search pool of {self.workers} workers"
+
+    def _batches(self, pii_names:list[str]) -> list[list[str]]:
+        # a few batches per worker, so one slow chat doesn't hold up the rest of a worker's share
+        num_batches = min(len(pii_names), self.workers * 4)
+        return [pii_names[i::num_batches] for i in range(num_batches)]
+
+    def _merge(self, pii_names:list[str], futures:list, top_n:int) -> list[tuple[str, str, float]]:
+        results_by_chat = {}
+        for future in futures:
+            for chat_results in future.result():
+                if chat_results:
+                    results_by_chat[chat_results[0][0]] = chat_results
+        # merging the (sorted) lists in chat order keeps ties in the same order as searching the chats one by one
+        ranked_lists = [results_by_chat[pii_name] for pii_name in pii_names if pii_name in results_by_chat]
+        return list(islice(heapq.merge(*ranked_lists, key=lambda x: -x[2]), top_n))
+
+    def search(self, tokens:list[str], pii_names:list[str], input_dir:str="piis", top_n:int=10) -> list[tuple[str, str, float]]:
+        """
+        BM25 searches the given chats in parallel, with the corpus-wide statistics of `input_dir` (if it has them).
+
+        Args:
+            tokens (list[str]): The tokenised query.
+            pii_names (list[str]): The names of the PIIs to search.
+            input_dir (str): The directory in which the PIIs are stored (relative to `core`). Default is `piis`.
+            top_n (int): The number of results to return. Default is 10.
+
+        Returns:
+            (list[tuple[str, str, float]]) The top N results over all the chats in the format `(pii_name, docNo, score)`.
+        """
+        futures = [self._executor.submit(_search_chats, tokens, batch, input_dir, top_n) for batch in self._batches(pii_names)]
+        return self._merge(pii_names, futures, top_n)
+
+    def prox_search(self, terms:list[str], n:int, pii_names:list[str], input_dir:str="piis", top_n:int=10, ordered:bool=False) -> list[tuple[str, str, float]]:
+        """
+        Proximity searches the given chats in parallel.
+
+        Args:
+            terms (list[str]): The tokenised query.
+            n (int): The proximity parameter.
+            pii_names (list[str]): The names of the PIIs to search.
+            input_dir (str): The directory in which the PIIs are stored (relative to `core`). Default is `piis`.
+            top_n (int): The number of results to return. Default is 10.
+            ordered (bool): Whether the terms must appear in the order given. Default is `False`.
+
+        Returns:
+            (list[tuple[str, str, float]]) The top N results over all the chats in the format `(pii_name, docNo, score)`.
+        """
+        futures = [self._executor.submit(_prox_search_chats, terms, n, batch, input_dir, top_n, ordered) for batch in self._batches(pii_names)]
+        return self._merge(pii_names, futures, top_n)
+
+    def phrase_search(self, terms:list[str], pii_names:list[str], input_dir:str="piis", top_n:int=10) -> list[tuple[str, str, int]]:
+        """
+        Phrase searches the given chats in parallel.
+
+        Args:
+            terms (list[str]): The tokenised phrase.
+            pii_names (list[str]): The names of the PIIs to search.
+            input_dir (str): The directory in which the PIIs are stored (relative to `core`). Default is `piis`.
+            top_n (int): The number of results to return. Default is 10.
+
+        Returns:
+            (list[tuple[str, str, int]]) The top N results over all the chats in the format `(pii_name, docNo, score)`.
+        """
+        futures = [self._executor.submit(_phrase_search_chats, terms, batch, input_dir, top_n) for batch in self._batches(pii_names)]
+        return self._merge(pii_names, futures, top_n)
+
+    def boolean_search(self, query:str, pii_names:list[str], input_dir:str="piis", top_n:int=10) -> list[tuple[str, str, float]]:
+        """
+        Boolean searches the given chats in parallel, with the corpus-wide statistics of `input_dir` (if it has them). The query is sent as it is, and compiled by each worker's own (cached) query planner.
+
+        Args:
+            query (str): The boolean query.
+            pii_names (list[str]): The names of the PIIs to search.
+            input_dir (str): The directory in which the PIIs are stored (relative to `core`). Default is `piis`.
+            top_n (int): The number of results to return. Default is 10.
+
+        Returns:
+            (list[tuple[str, str, float]]) The top N results over all the chats in the format `(pii_name, docNo, score)`.
+        """
+        futures = [self._executor.submit(_boolean_search_chats, query, batch, input_dir, top_n) for batch in self._batches(pii_names)]
+        return self._merge(pii_names, futures, top_n)
+
+    def shutdown(self) -> None:
+        """Stops the worker processes."""
+        self._executor.shutdown()
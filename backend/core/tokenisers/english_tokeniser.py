@@ -1,14 +1,33 @@
 import re
 import os
-from nltk import PorterStemmer
-porter = PorterStemmer()
+from functools import lru_cache
+from .lazy_resource import LazyResource
+
+# the number of surface forms whose pre-processed token is remembered. Chat vocabulary is very repetitive, so nearly every token is stemmed only once
+TOKEN_CACHE_SIZE = 65536
+_NON_LETTERS = re.compile(r'[^a-zA-Z]')
 
 script_dir = os.path.dirname(os.path.abspath(__file__))
 stopwords_file_name = os.path.join(script_dir, "stopwords", "ttds_2023_english_stop_words.txt")
 
-with open(stopwords_file_name, "r") as f:
-    stopwords = f.read().splitlines()
-    f.close()
+def _load_porter():
+    from nltk import PorterStemmer # importing NLTK alone takes a noticeable part of a second
+    return PorterStemmer()
+
+def _load_stopwords() -> set:
+    with open(stopwords_file_name, "r") as f:
+        stopwords = set(f.read().splitlines())
+        f.close()
+    return stopwords
+
+# loaded on first use rather than on import (see `LazyResource`)
+porter = LazyResource("english stemmer", _load_porter)
+stopwords = LazyResource("english stopwords", _load_stopwords)
+
+def warm_up() -> None:
+    """Loads the stemmer and stopwords now, rather than when the first token is pre-processed."""
+    porter.get()
+    stopwords.get()
 
 def pre_process_token(token: str) -> str:
     """
@@ -25,12 +44,15 @@ def pre_process_token(token: str) -> str:
     #if not re.match(r'^[a-zA-Z]+$', token):
     #   return None
     
-    if (token in stopwords): 
+    if (token in stopwords.get()): 
         return None
     else:
-        stemmed_token = porter.stem(token, to_lowercase=True) # stemmer will do the Case Folding for us
+        stemmed_token = porter.get().stem(token, to_lowercase=True) # stemmer will do the Case Folding for us
         return stemmed_token
     
+# `pre_process_token`, remembering the result for each surface form
+_pre_process_token = lru_cache(maxsize=TOKEN_CACHE_SIZE)(pre_process_token)
+
 def create_tokens_from_document(doc: str) -> list[str]:
     """
     Given a document, returns a list of tokens in that document (in order of appearance)
@@ -40,7 +62,7 @@ def create_tokens_from_document(doc: str) -> list[str]:
         A list of tokens in the document.
     """
     # Split the document at non-letter characters
-    tokens = re.split(r'[^a-zA-Z]', doc) # could possible be edited to include numbers?
+    tokens = _NON_LETTERS.split(doc) # could possible be edited to include numbers?
     # remove empty tokens from the list, and also remove any tokens containing numbers
     return [token for token in tokens if token and not any(char.isdigit() for char in token)]
 
@@ -58,4 +80,14 @@ def en_tokenise_document(doc : str) -> list[str]:
     """
     tokens = create_tokens_from_document(doc)
     # pre-process each token, and add it to the list of pre-processed tokens if it is not None
-    return [pre_process_token(token) for token in tokens if pre_process_token(token)]
\ No newline at end of file
+    return [token for token in map(_pre_process_token, tokens) if token]
+
+def en_tokenise_batch(docs) -> list[list[str]]:
+    """
+    FULLY Pre-processes many documents (see `en_tokenise_document`). Documents that aren't strings (e.g. a missing message) have no tokens.
+    Args:
+        docs: An iterable of documents, each all in one string.
+    Returns:
+        The pre-processed documents, each as a list of tokens.
+    """
+    return [en_tokenise_document(doc) if isinstance(doc, str) else [] for doc in docs]
\ No newline at end of file
@@ -0,0 +1,54 @@
+import threading
+import time
+
+# every `LazyResource` created in the process, in the order they were created, for `loading_report`
+_resources = []
+
+
+class LazyResource:
+    """
+    A resource that is slow to load (a model, a stemmer, a stopword list...), loaded by `loader` the first time `get` is called rather than when its module is imported. Importing a tokeniser is then almost free, and only the resources a process actually uses are ever loaded. Loading is thread-safe: if several threads ask for the resource at once, it is loaded once and the others wait for it.
+
+    The time each resource took to load is recorded, see `loading_report`.
+
+    Args:
+        name (str): The name of the resource, as shown in `loading_report`.
+        loader (callable): A function taking no arguments that loads and returns the resource.
+    """
+    def __init__(self, name:str, loader):
+        self.name = name
+        self.load_seconds = None
+        self._loader = loader
+        self._value = None
+        self._loaded = False
+        self._lock = threading.Lock()
+        _resources.append(self)
+
+    def __repr__(self):
+        return f"Lazy resource \"{self.name}\" ({'loaded' if self._loaded else 'not loaded'})"
+
+    @property
+    def loaded(self) -> bool:
+        """Whether the resource has been loaded."""
+        return self._loaded
+
+    def get(self):
+        """Returns the resource, loading it first if it hasn't been yet."""
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    start = time.perf_counter()
+                    self._value = self._loader()
+                    self.load_seconds = time.perf_counter() - start
+                    self._loaded = True
+        return self._value
+
+
+def loading_report() -> dict:
+    """
+    Returns how long each lazy resource of the process took to load.
+
+    Returns:
+        (dict) The seconds each resource took to load, in the format `{name: seconds}` (`None` for resources that haven't been loaded yet).
+    """
+    return {resource.name: resource.load_seconds for resource in _resources}
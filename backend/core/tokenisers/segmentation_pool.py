@@ -0,0 +1,114 @@
+from concurrent.futures import ProcessPoolExecutor
+import math
+import multiprocessing
+import threading
+
+# the languages whose tokenisers segment text with a model (THULAC for simplified Chinese, jieba for Traditional Chinese)
+SEGMENTATION_LANGUAGES = ["chinese", "traditional_chinese"]
+
+# the `tokenise_batch` of each worker process, set up (with its model loaded) by `_init_worker` and kept for the life of the pool
+_worker_tokenise_batch = None
+# the barrier every worker of the pool waits at in `_ready`, so that `SegmentationPool.warm_up` reaches each of them
+_worker_barrier = None
+
+
+def _init_worker(language:str, barrier) -> None:
+    global _worker_tokenise_batch, _worker_barrier
+    _worker_barrier = barrier
+    if language == "chinese":
+        from .simplified_chinese_tokeniser import warm_up, zh_tokenise_batch
+        _worker_tokenise_batch = zh_tokenise_batch
+    else:
+        from .traditional_chinese_tokeniser import cn_tokenise_batch, warm_up
+        _worker_tokenise_batch = cn_tokenise_batch
+    warm_up() # load the model now, rather than on the first batch
+
+def _tokenise_batch(docs:list[str]) -> list[list[str]]:
+    return _worker_tokenise_batch(docs)
+
+def _ready() -> bool:
+    # holds this worker until every other worker has got here too, so no worker can take two of `warm_up`'s tasks
+    _worker_barrier.wait()
+    return _worker_tokenise_batch is not None
+
+
+class SegmentationPool:
+    """
+    A persistent pool of worker processes that segment (tokenise) Chinese text, each with its THULAC or jieba model loaded once when the pool starts and kept warm for as long as it runs. Segmenting is slow and pure Python, so in one process it is both slow per message and limited to one core; the pool spreads batches of messages over its workers instead.
+
+    The workers are spawned (rather than forked) processes, as the pool may first be used from a request thread of the server while other threads hold locks (e.g. of a `LazyResource` being loaded) that a forked worker would inherit held.
+
+    Each distinct message of a batch is only segmented once, and the batch is split into a few sub-batches per worker, so one slow sub-batch doesn't hold up the rest. The tokens are exactly those of the language's tokeniser (see `Tokeniser`). Use `get_segmentation_pool` to share one pool per language between everything in the process that tokenises (e.g. `PIIConstructor` and the `Searcher`).
+
+    Args:
+        language (str): The language to segment, one of `SEGMENTATION_LANGUAGES`.
+        workers (int): The number of worker processes.
+    """
+    def __init__(self, language:str, workers:int):
+        if language not in SEGMENTATION_LANGUAGES:
+            raise ValueError(f"No segmentation model for language: {language}. Segmented languages are: {', '.join(SEGMENTATION_LANGUAGES)}")
+        self.language = language
+        self.workers = workers
+        context = multiprocessing.get_context("spawn")
+        self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker, initargs=(language, context.Barrier(workers)))
+
+    def __repr__(self):
+        return f"Segmentation pool of {self.workers} workers for \"{self.language}\""
+
+    def warm_up(self) -> None:
+        """Starts every worker and waits for their models to load, so the first batch doesn't wait on them. Each worker is sent one task, which blocks until all of them have one (and so have loaded their model)."""
+        for future in [self._executor.submit(_ready) for _ in range(self.workers)]:
+            future.result()
+
+    def tokenise_batch(self, docs) -> list[list[str]]:
+        """
+        Tokenises many documents in the worker processes. Documents that aren't strings (e.g. a missing message) have no tokens.
+
+        Args:
+            docs: An iterable of documents, each all in one string.
+
+        Returns:
+            (list[list[str]]) The tokenised documents, each as a list of tokens.
+        """
+        docs = list(docs)
+        distinct_docs = list(dict.fromkeys(doc for doc in docs if isinstance(doc, str)))
+        batch_size = max(1, math.ceil(len(distinct_docs) / (self.workers * 4)))
+        batches = [distinct_docs[i:i+batch_size] for i in range(0, len(distinct_docs), batch_size)]
+        tokens = {}
+        for batch, batch_tokens in zip(batches, self._executor.map(_tokenise_batch, batches)):
+            tokens.update(zip(batch, batch_tokens))
+        return [list(tokens[doc]) if isinstance(doc, str) else [] for doc in docs]
+
+    def tokenise(self, doc:str) -> list[str]:
+        """
+        Tokenises a single document (e.g. a query) in a worker process.
+
+        Args:
+            doc (str): The document to be tokenised, all in one string.
+
+        Returns:
+            (list[str]) The tokenised document, as a list of tokens.
+        """
+        return self.tokenise_batch([doc])[0]
+
+    def shutdown(self) -> None:
+        """Stops the worker processes."""
+        self._executor.shutdown()
+
+
+# the process-wide pool of each language, created by the first `get_segmentation_pool` asking for it
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_segmentation_pool(language:str, workers:int) -> SegmentationPool:
+    """
+    Returns the process-wide `SegmentationPool` of a language, starting it (with `workers` workers) if it isn't running yet.
+
+    Args:
+        language (str): The language to segment, one of `SEGMENTATION_LANGUAGES`.
+        workers (int): The number of worker processes to start the pool with. Ignored if the pool is already running.
+    """
+    with _pools_lock:
+        if language not in _pools:
+            _pools[language] = SegmentationPool(language, workers)
+        return _pools[language]
@@ -1,15 +1,33 @@
 import re
 import os
-from thulac import thulac
+from functools import lru_cache
+from .lazy_resource import LazyResource
 
-thulac_model = thulac(seg_only=True)
+# the number of messages whose tokens are remembered. Segmentation is by far the slowest part of tokenising, and short messages repeat a lot in chats
+DOCUMENT_CACHE_SIZE = 16384
+_NON_HAN = re.compile(r'[^\u4e00-\u9fff]')
 
 script_dir = os.path.dirname(os.path.abspath(__file__))
 stopwords_file_name = os.path.join(script_dir, "stopwords", "hit_stopwords.txt")
 
-with open(stopwords_file_name, "r", encoding="utf-8-sig") as f:
-    stopwords = set(f.read().splitlines())
-    f.close()
+def _load_thulac_model():
+    from thulac import thulac
+    return thulac(seg_only=True)
+
+def _load_stopwords() -> set:
+    with open(stopwords_file_name, "r", encoding="utf-8-sig") as f:
+        stopwords = set(f.read().splitlines())
+        f.close()
+    return stopwords
+
+# loaded on first use rather than on import (see `LazyResource`): building the THULAC model takes about a second
+thulac_model = LazyResource("THULAC model", _load_thulac_model)
+stopwords = LazyResource("simplified chinese stopwords", _load_stopwords)
+
+def warm_up() -> None:
+    """Loads the THULAC model and stopwords now, rather than when the first document is tokenised."""
+    thulac_model.get()
+    stopwords.get()
 
 def zh_tokenise_document(doc: str) -> list[str]:
     """
@@ -19,6 +37,21 @@ def zh_tokenise_document(doc: str) -> list[str]:
     Returns:
         The tokenised document, as a list of tokens.
     """
-    clean_text = re.sub(r'[^\u4e00-\u9fff]', ' ', doc)
-    tokens = thulac_model.cut(clean_text, text=True).split()
-    return [token for token in tokens if token not in stopwords and token.strip()]
\ No newline at end of file
+    clean_text = _NON_HAN.sub(' ', doc)
+    tokens = thulac_model.get().cut(clean_text, text=True).split()
+    stopword_set = stopwords.get()
+    return [token for token in tokens if token not in stopword_set and token.strip()]
+
+@lru_cache(maxsize=DOCUMENT_CACHE_SIZE)
+def _tokenise_document(doc:str) -> tuple[str]:
+    return tuple(zh_tokenise_document(doc))
+
+def zh_tokenise_batch(docs) -> list[list[str]]:
+    """
+    Tokenises many documents in simplified Chinese (see `zh_tokenise_document`), segmenting each distinct document only once. Documents that aren't strings (e.g. a missing message) have no tokens.
+    Args:
+        docs: An iterable of documents, each all in one string.
+    Returns:
+        The tokenised documents, each as a list of tokens.
+    """
+    return [list(_tokenise_document(doc)) if isinstance(doc, str) else [] for doc in docs]
@@ -1,15 +1,36 @@
 import re
 import os
-import jieba
+from functools import lru_cache
+from .lazy_resource import LazyResource
 import logging
-jieba.setLogLevel(logging.ERROR)
+
+# the number of messages whose tokens are remembered. Segmentation is by far the slowest part of tokenising, and short messages repeat a lot in chats
+DOCUMENT_CACHE_SIZE = 16384
+_NON_HAN = re.compile(r'[^\u4e00-\u9fff]')
 
 script_dir = os.path.dirname(os.path.abspath(__file__))
 stopwords_file_name = os.path.join(script_dir, "stopwords", "traditional_chinese_stop_words.txt")
 
-with open(stopwords_file_name, "r", encoding="utf-8") as f:
-    stopwords = set(f.read().splitlines())
-    f.close()
+def _load_jieba():
+    import jieba
+    jieba.setLogLevel(logging.ERROR)
+    jieba.initialize() # otherwise jieba loads its dictionary on the first cut
+    return jieba
+
+def _load_stopwords() -> set:
+    with open(stopwords_file_name, "r", encoding="utf-8") as f:
+        stopwords = set(f.read().splitlines())
+        f.close()
+    return stopwords
+
+# loaded on first use rather than on import (see `LazyResource`)
+jieba = LazyResource("jieba dictionary", _load_jieba)
+stopwords = LazyResource("traditional chinese stopwords", _load_stopwords)
+
+def warm_up() -> None:
+    """Loads the jieba dictionary and stopwords now, rather than when the first document is tokenised."""
+    jieba.get()
+    stopwords.get()
 
 def cn_tokenise_document(doc:str) -> list[str]:
     """
@@ -19,8 +40,23 @@ def cn_tokenise_document(doc:str) -> list[str]:
     Returns:
         The tokenised document, as a list of tokens.
     """
-    cleaned_words = re.sub(r'[^\u4e00-\u9fff]', ' ', doc)
+    cleaned_words = _NON_HAN.sub(' ', doc)
     # Tokenise the document
-    words = jieba.cut_for_search(cleaned_words)
+    words = jieba.get().cut_for_search(cleaned_words)
     # Remove stopwords
-    return [word for word in words if word.strip() and word not in stopwords]
\ No newline at end of file
+    stopword_set = stopwords.get()
+    return [word for word in words if word.strip() and word not in stopword_set]
+
+@lru_cache(maxsize=DOCUMENT_CACHE_SIZE)
+def _tokenise_document(doc:str) -> tuple[str]:
+    return tuple(cn_tokenise_document(doc))
+
+def cn_tokenise_batch(docs) -> list[list[str]]:
+    """
+    Tokenises many documents in Traditional Chinese (see `cn_tokenise_document`), segmenting each distinct document only once. Documents that aren't strings (e.g. a missing message) have no tokens.
+    Args:
+        docs: An iterable of documents, each all in one string.
+    Returns:
+        The tokenised documents, each as a list of tokens.
+    """
+    return [list(_tokenise_document(doc)) if isinstance(doc, str) else [] for doc in docs]
@@ -1,24 +1,41 @@
 class Tokeniser():
     """
-    Tokeniser class to tokenise messages. Please call the `tokenise` method to tokenise a message (document).
+    Tokeniser class to tokenise messages. Please call the `tokenise` method to tokenise a message (document), or `tokenise_batch` to tokenise many messages at once (e.g. when building a PII), which gives the same tokens.
+
+    The stemmers, stopwords and segmentation models of the language are only loaded when first used (see `lazy_resource.LazyResource`), so creating a `Tokeniser` is cheap. Call `warm_up` to load them ahead of time instead (e.g. in a background thread).
 
     Args:
         language: The language of the message. Will determine which tokenisation algorithm is used. Currently supported languages are '`english`', '`chinese`' (simplified), '`traditional_chinese`', and '`turkish`'. Default is '`english`'.
+        segmentation_workers: For the Chinese languages, the number of worker processes to segment messages in (see `segmentation_pool.SegmentationPool`, which is shared by every `Tokeniser` of the language in the process). The tokens are the same. Default is 0 (segment in the calling thread).
     """
-    def __init__(self, language: str="english"):
+    def __init__(self, language: str="english", segmentation_workers: int=0):
         if language not in ["english", "chinese", "traditional_chinese", "turkish"]:
             raise ValueError(f"Unsupported language: {language}")
         self.language = language
-        if language == "traditional_chinese":
-            from .traditional_chinese_tokeniser import cn_tokenise_document
+        if segmentation_workers > 0 and language in ["chinese", "traditional_chinese"]:
+            from .segmentation_pool import get_segmentation_pool
+            pool = get_segmentation_pool(language, segmentation_workers)
+            self.tokenise = pool.tokenise
+            self.tokenise_batch = pool.tokenise_batch
+            self.warm_up = pool.warm_up
+        elif language == "traditional_chinese":
+            from .traditional_chinese_tokeniser import cn_tokenise_batch, cn_tokenise_document, warm_up
             self.tokenise = cn_tokenise_document
+            self.tokenise_batch = cn_tokenise_batch
+            self.warm_up = warm_up
         elif language == "chinese":
-            from .simplified_chinese_tokeniser import zh_tokenise_document
+            from .simplified_chinese_tokeniser import warm_up, zh_tokenise_batch, zh_tokenise_document
             self.tokenise = zh_tokenise_document
+            self.tokenise_batch = zh_tokenise_batch
+            self.warm_up = warm_up
         elif language == "turkish":
-            from .turkish_tokeniser import tr_tokenise_document
+            from .turkish_tokeniser import tr_tokenise_batch, tr_tokenise_document, warm_up
             self.tokenise = tr_tokenise_document
+            self.tokenise_batch = tr_tokenise_batch
+            self.warm_up = warm_up
         else:
-            from .english_tokeniser import en_tokenise_document
+            from .english_tokeniser import en_tokenise_batch, en_tokenise_document, warm_up
             self.tokenise = en_tokenise_document # fallback to english tokeniser
+            self.tokenise_batch = en_tokenise_batch
+            self.warm_up = warm_up
             
\ No newline at end of file
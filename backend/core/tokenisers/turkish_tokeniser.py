@@ -1,6 +1,11 @@
 import re
 import os
-import snowballstemmer
+from functools import lru_cache
+from .lazy_resource import LazyResource
+
+# the number of surface forms whose pre-processed token is remembered. Turkish is agglutinative, so the same inflected forms come up over and over
+TOKEN_CACHE_SIZE = 65536
+_NON_LETTERS = re.compile(r'[^a-zA-ZçÇğĞıİöÖşŞüÜ]')
 
 # Get the directory of this script and construct the stopwords file path
 # I got stopwords-tr.txt from the following link and put it in the stopwords folder:
@@ -10,25 +15,41 @@ script_dir = os.path.dirname(os.path.abspath(__file__))
 stopwords_file_name = os.path.join(script_dir, "stopwords", "stopwords-tr.txt")
 
 # Load Turkish stopwords from the file
-with open(stopwords_file_name, "r", encoding="utf-8") as f:
-    stopwords = f.read().splitlines()
-    f.close()
+def _load_stopwords() -> set:
+    with open(stopwords_file_name, "r", encoding="utf-8") as f:
+        stopwords = set(f.read().splitlines())
+        f.close()
+    return stopwords
+
+def _load_stemmer():
+    import snowballstemmer
+    return snowballstemmer.stemmer("turkish") # SnowballStemmer for Turkish
+
+# loaded on first use rather than on import (see `LazyResource`)
+stopwords = LazyResource("turkish stopwords", _load_stopwords)
+stemmer = LazyResource("turkish stemmer", _load_stemmer)
 
-stemmer = snowballstemmer.stemmer("turkish") # SnowballStemmer for Turkish
+def warm_up() -> None:
+    # Load the stemmer and stopwords now, rather than when the first token is pre-processed
+    stopwords.get()
+    stemmer.get()
 
 def pre_process_token(token: str) -> str:
     # Check if the token is a stopword, and if so, return None
     # Otherwise, stem the token and return it
-    if token in stopwords:
+    if token in stopwords.get():
         return None
     else:
-        stemmed_token = stemmer.stemWord(token.lower())
+        stemmed_token = stemmer.get().stemWord(token.lower())
         return stemmed_token
 
+# `pre_process_token`, remembering the result for each surface form
+_pre_process_token = lru_cache(maxsize=TOKEN_CACHE_SIZE)(pre_process_token)
+
 def create_tokens_from_document(doc: str) -> list[str]:
     # Split the document at characters that are not letters
     # Includes Turkish-specific letters: ç, Ç, ğ, Ğ, ı, İ, ö, Ö, ş, Ş, ü, Ü
-    tokens = re.split(r'[^a-zA-ZçÇğĞıİöÖşŞüÜ]', doc)
+    tokens = _NON_LETTERS.split(doc)
     # Remove empty tokens and any tokens containing digits
     return [token for token in tokens if token and not any(char.isdigit() for char in token)]
 
@@ -36,7 +57,11 @@ def tr_tokenise_document(doc: str) -> list[str]:
     # Create tokens from the document
     tokens = create_tokens_from_document(doc)
     # Pre-process each token
-    return [pre_process_token(token) for token in tokens if pre_process_token(token)]
+    return [token for token in map(_pre_process_token, tokens) if token]
+
+def tr_tokenise_batch(docs) -> list[list[str]]:
+    # Tokenise many documents; those that aren't strings (e.g. a missing message) have no tokens
+    return [tr_tokenise_document(doc) if isinstance(doc, str) else [] for doc in docs]
 
 # Example usage (commented it out just in case)
 # if __name__ == "__main__":
@@ -1,11 +1,18 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS, cross_origin
 from core.search import Searcher
+from core.pii_cache import pii_cache
+from core.result_cache import result_cache
+from core.tokenisers.lazy_resource import loading_report
+from core import TopNSearch
 
+import atexit
 import os
 import csv
 import sys
 import argparse
+import threading
+import time
 
 csv.field_size_limit(sys.maxsize)
 
@@ -19,18 +26,46 @@ currently_supported_languages = [
     "turkish" # Turkish
 ]
 
-parser = argparse.ArgumentParser(description='GCSearch Server')
-parser.add_argument('--language', type=str, default='english', help='Language for the searcher')
-args = parser.parse_args()
-if args.language not in currently_supported_languages:
-    print(f"Unsupported language: {args.language}. Currently supported languages are: {', '.join(currently_supported_languages)}")
-    language = "english"
-    print(f"Defaulting to {language}")
-else:
-    language = args.language
+language = "english" # the language of the searcher, set by `main`
+searcher = None # the searcher, set up by `main`
+chat_registry = None # the chats in core/out/info, shared with the searcher, set up by `main`
+startup_timings = {} # how long (in seconds) each component of the server took to start, see /api/GetStartupReport
+server_ready = threading.Event() # set once the tokeniser's models and the index have been loaded: by the warm-up thread with --warm-up, otherwise by the first search to finish
 
-searcher = Searcher(language=language)
-print(f"GCSearch Server Initialised with language: {language}")
+# the language codes of `core.TopNSearch`, by searcher language
+topn_search_languages = {
+    "english": "en",
+    "chinese": "zh_simp",
+    "traditional_chinese": "zh_trad",
+    "turkish": "tr"
+}
+
+def warm_up_server() -> None:
+    """
+    Loads the tokeniser models and the index (see `Searcher.warm_up`), then marks the server as ready. The resources `core.TopNSearch` tokenises with are loaded after that, as searches don't wait on them. Run in a background thread with `--warm-up`, so the server answers requests (e.g. `/api/isAlive`) while it warms up.
+    """
+    warm_up_timings = searcher.warm_up()
+    startup_timings.update({f"warm-up: {component}": seconds for component, seconds in warm_up_timings.items()})
+    server_ready.set()
+    start = time.perf_counter()
+    try:
+        TopNSearch.warm_up(topn_search_languages.get(language))
+        warm_up_timings["TopNSearch"] = startup_timings["warm-up: TopNSearch"] = time.perf_counter() - start
+    except Exception as e: # e.g. NLTK failing to download its data while offline, which searching doesn't need
+        print(f"DEBUG ERROR: Could not warm up TopNSearch: {e!r}")
+    print("Warm-up times: " + ", ".join(f"{component} {seconds:.3f}s" for component, seconds in warm_up_timings.items()))
+
+# the endpoints that search, and so load what they need (the tokeniser's models, the PIIs) on first use
+search_endpoints = ["flask_GetTopNResultsFromSearch", "flask_ProximitySearch", "flask_PhraseSearch", "flask_BooleanSearch"]
+
+@app.after_request
+def mark_ready_after_first_search(response):
+    """
+    Without `--warm-up`, everything is loaded on first use instead, so the server is only ready once a search has finished (and loaded it).
+    """
+    if not server_ready.is_set() and request.endpoint in search_endpoints and response.status_code == 200:
+        server_ready.set()
+    return response
 
 currently_supported_platforms = [
     "instagram",
@@ -56,22 +91,51 @@ def detect_encoding(file_path, sample_size=10000):
 @app.route('/api/isAlive', methods=['GET'])
 def flask_isAlive():
     """
-    Simple function to check if the server is alive.
+    Simple function to check if the server is alive, and whether it is ready: whether the tokeniser's models and the index have been loaded, by the warm-up (see `--warm-up`) or, without it, by the first search. A server that isn't ready yet still answers searches, they just wait on whatever they need being loaded.
+
+    Returns:
+        status: (dict) { "status": "alive", "ready": bool }
+    """
+    return jsonify({"status": "alive", "ready": server_ready.is_set()})
+
+@app.route('/api/GetStartupReport', methods=['GET'])
+def flask_getStartupReport():
+    """
+    Gets how long the server took to start, per component, and how long each of the tokeniser's lazily loaded resources (stemmers, stopwords, segmentation models) took to load.
+
+    Returns:
+        report: (dict) { "ready": bool, "startup": { component: seconds }, "resources": { resource: seconds, or None if not loaded yet } }
+    """
+    return jsonify({"ready": server_ready.is_set(), "startup": startup_timings, "resources": loading_report()})
+
+@app.route('/api/GetCacheStats', methods=['GET'])
+def flask_getCacheStats():
+    """
+    Gets the statistics of the searcher's PII cache.
+
+    Returns:
+        stats: (dict) { "entries": int, "bytes": int, "max_bytes": int, "hits": int, "misses": int, "evictions": int, "hit_ratio": float }
+    """
+    return jsonify(searcher.get_cache_stats())
+
+@app.route('/api/GetResultCacheStats', methods=['GET'])
+def flask_getResultCacheStats():
     """
-    return jsonify({"status": "alive"})
+    Gets the statistics of the searcher's result cache.
+
+    Returns:
+        stats: (dict) { "entries": int, "max_entries": int, "hits": int, "misses": int, "evictions": int, "hit_ratio": float }
+    """
+    return jsonify(searcher.get_result_cache_stats())
 
 def flask_getAllParsedChats() -> list[str]:
     """
-    Gets the internal chat names from all the parsed chats, located within the `core/out/*` directories.
+    Gets the internal chat names from all the parsed chats, located within the `core/out/*` directories. These are served from the chat registry, which only rereads info files when they change.
 
     Returns:
         parsed_chats: (list[str]) list of internal chat names (e.g. ["chat_1", "chat_2", ...])
     """
-    parsed_chats = []
-    for filename in os.listdir('core/out/info/'):
-        if filename.endswith('.csv'):
-            parsed_chats.append(filename.split('.')[0])
-    return parsed_chats
+    return chat_registry.get_chat_names()
 
 def flask_sortChatsByPlatform() -> dict[str, list[str]]:
     """
@@ -84,47 +148,19 @@ def flask_sortChatsByPlatform() -> dict[str, list[str]]:
     }
     ```
     """
-    sorted_chats = {}
-    for groupchat in flask_getAllParsedChats():
-        platform = groupchat.split('_')[0]
-        if platform not in sorted_chats:
-            sorted_chats[platform] = []
-        sorted_chats[platform].append(groupchat)
-    return sorted_chats
+    return chat_registry.get_chats_by_platform()
 
 
 def getCurrentUser(platform:str="instagram"):
     """
-    Gets the current user by parsing the chats. It finds the sender present in each of the participants, which by the nature of \"someone's exported their data\". must be the current user
+    Gets the current user by parsing the chats. It finds the sender present in each of the participants, which by the nature of \"someone's exported their data\". must be the current user. This is worked out by the chat registry whenever the chats change, rather than on every call.
     
     Args:
         platform: (str) the name of the platform (e.g. "instagram", "whatsapp", "wechat", "line")
     Returns:
         current_user: (str) The current user's name. If there are multiple users present in all chats, we cannot determine the current user and return None. Additionally, if the code fails for another reason, we return None.
     """
-    users_present_in_all_chats_so_far = set()
-    script_dir = os.path.dirname(__name__)
-    # info is in ./core/out/info
-    info_dir = os.path.join(script_dir, 'core/out/info')
-    encoding = detect_encoding(info_dir)
-    for chat in os.listdir(info_dir):
-        if chat.endswith('.csv'):
-            with open(os.path.join(info_dir, chat), 'r', encoding=encoding, errors='replace') as f:
-                reader = csv.reader(f)
-                rows = [row for row in reader]
-                f.close()
-            participants_str = rows[1][2]
-            participants = [p.strip() for p in participants_str.strip('[]').split(',')]
-            if len(users_present_in_all_chats_so_far) == 0:
-                users_present_in_all_chats_so_far = set(participants)
-            else:
-                users_present_in_all_chats_so_far = users_present_in_all_chats_so_far.intersection(participants)
-
-
-    if len(users_present_in_all_chats_so_far) == 1:
-        return list(users_present_in_all_chats_so_far)[0]
-    else:
-        return None
+    return chat_registry.get_current_user()
 
 @app.route('/api/GetCurrentUser', methods=['GET'])
 def flask_getCurrentUser():
@@ -165,11 +201,7 @@ def flask_getDisplayNameFromChat(chat_name:str) -> str:
     Returns:
         display_name: (str) the display name of the chat
     """
-    encoding = detect_encoding(f'core/out/info/{chat_name}.info.csv')
-    with open(f'core/out/info/{chat_name}.info.csv', 'r', encoding=encoding, errors="replace") as f:
-        reader = csv.reader(f)
-        display_name = [row for row in reader][1][1]
-        return display_name
+    return chat_registry.get_display_name(chat_name)
 
 def flask_getLastMessageFromChat(chat_name:str) -> dict:
     """
@@ -241,6 +273,7 @@ def flask_ProximitySearch():
     Args:
         query: (str) search query
         range: (int) range to search within
+        ordered: (bool) (_default_: False) whether the terms must appear in the order of the query
 
     Returns:
         results: (dict) { doc_id (int): score (int):, ... }
@@ -248,10 +281,49 @@ def flask_ProximitySearch():
     data = request.get_json()
     query = data['query']
     range = int(data['range'])
-    results = searcher.flask_prox_search(query, range)
+    ordered = bool(data.get('ordered', False))
+    results = searcher.flask_prox_search(query, range, ordered=ordered)
     print(f"DEBUG: got {len(results)} results for query \"{query}\"")
     return jsonify(results)
 
+@app.route('/api/PhraseSearch', methods=['POST'])
+def flask_PhraseSearch():
+    """
+    Performs a phrase search for a given query, i.e. finds the messages containing its terms consecutively and in order.
+
+    Args:
+        query: (str) the phrase to search for (with or without quotes)
+        n: (int) (_default_: 25) number of results to return
+
+    Returns:
+        results: (dict) { doc_id (int): score (int):, ... }
+    """
+    data = request.get_json()
+    query = data['query']
+    n = int(data.get('n', 25))
+    results = searcher.flask_phrase_search(query, n)
+    print(f"DEBUG: got {len(results)} results for phrase \"{query}\"")
+    return jsonify(results)
+
+@app.route('/api/BooleanSearch', methods=['POST'])
+def flask_BooleanSearch():
+    """
+    Performs a boolean search for a given query. Queries can use `AND`, `OR`, `NOT`, parentheses, "quoted phrases" and `#n(term1, term2)` proximity, e.g. `(cat OR dog) AND NOT "pet food"`.
+
+    Args:
+        query: (str) boolean search query
+        n: (int) (_default_: 25) number of results to return
+
+    Returns:
+        results: (dict) { doc_id (int): score (int):, ... }
+    """
+    data = request.get_json()
+    query = data['query']
+    n = int(data.get('n', 25))
+    results = searcher.flask_boolean_search(query, n)
+    print(f"DEBUG: got {len(results)} results for boolean query \"{query}\"")
+    return jsonify(results)
+
 @app.route('/api/GetMetaChatDataFromPIIName', methods=['POST'])
 def flask_GetMetaChatDataFromPIIName():
     """
@@ -289,12 +361,7 @@ def flask_getNumChatsInGC(GC_name:str) -> int:
     Returns:
         num_chats: (int) number of chats in the GC
     """
-    encoding=detect_encoding(f'core/out/chatlogs/{GC_name}.chatlog.csv')
-    with open(f'core/out/chatlogs/{GC_name}.chatlog.csv', 'r', encoding=encoding,errors="replace") as f:
-        reader = csv.reader(f)
-        num_chats = len([row for row in reader]) - 1
-        f.close()
-    return num_chats   
+    return searcher.get_num_messages(GC_name)
 
 def flask_getChatDataFromDocIDGivenPIIName(doc_id, pii_name):
     """
@@ -324,9 +391,9 @@ def flask_getChatDataFromDocIDGivenPIIName(doc_id, pii_name):
     return searcher.flask_get_message_details_from_search_result(wrapper)
 
 @app.route('/api/GetChatsBetweenRangeForChatGivenPIIName', methods=['POST'])
-def flask_GetChatsBetweenRangeForGC(include_media:bool=False):
+def flask_GetChatsBetweenRangeForGC(include_media:bool=True):
     """
-    Gets 2n+1 chats around a given chat in a GC given a PII name. Calls `getChatDataFromDocIDGivenPIIName` for each chat, so returns a list of dictionaries (in the format described in that function).
+    Gets 2n+1 chats around a given chat in a GC given a PII name, as a list of dictionaries (in the format described in `getChatDataFromDocIDGivenPIIName`). The chats either side are read as contiguous ranges by `Searcher.get_context_window`, rather than one at a time.
 
     If we do not have enough chats to return on either side of the given chat, we return as many as we can.
 
@@ -334,14 +401,13 @@ def flask_GetChatsBetweenRangeForGC(include_media:bool=False):
         doc_id: (int) the document ID of the chat
         n: (int) number of chats to return on either side of the given chat
         pii_name: (str) name of the positional inverted index. If the PII is called "`<pii_name>`.pii.txt", then `<pii_name>` is "pii".
-        include_media: (bool) (_default_: False) whether to include media messages in the response. If not,these will be skipped over (such that we have 2n+1 non-media messages).
+        include_media: (bool) (_default_: True) whether to include media messages in the response. If not,these will be skipped over (such that we have 2n+1 non-media messages).
 
     Returns:
         chats: (list[dict]) [chat_1, chat_2, ..., chat_(2n+1)]
     """
     data = request.get_json()
     doc_id = int(data['doc_id'])
-    og_doc_id = doc_id
     n = int(data['n'])
     pii_name = data['pii_name']
     print(f"""
@@ -351,50 +417,7 @@ def flask_GetChatsBetweenRangeForGC(include_media:bool=False):
     """)
     if 'include_media' in data:
         include_media = data['include_media']
-    GC_name = flask_getDisplayNameFromChat(pii_name)
-    num_chats_in_GC = flask_getNumChatsInGC(pii_name)
-    chats = []
-    # get the previous n chats
-    chats_left_to_add = n
-    #print(f"DEBUG: We are at doc_id {doc_id} in {pii_name}. We're going to add the next {n} chats before this.")
-    while chats_left_to_add > 0:
-        doc_id -= 1
-        if doc_id <= 0:
-            break
-        #print(f"We're now going to get the chat data from {pii_name} for chat {doc_id}")
-        chat_data = flask_getChatDataFromDocIDGivenPIIName(doc_id, pii_name)
-        #input(f"chat_data: {chat_data}")
-        # we current dont check for media messages
-        #if chat_data[9] and not include_media:
-        #    continue
-        chats.append(chat_data)
-        print(f"added chat +1 (doc_id {doc_id})")
-        chats_left_to_add -= 1
-    print("Added the previous n chats")
-    # now we're out of this loop, we need to reverse the chats list
-    chats = chats[::-1] # this a dumb hack but it works!
-    
-    # get the current chat
-    
-    doc_id = og_doc_id
-    chat_data = flask_getChatDataFromDocIDGivenPIIName(doc_id, pii_name)
-    
-    chats.append(chat_data)
-    chats_left_to_add = n # decrement to indicate we've added the current chat, otherwise we're getting n+1 ones ahead to make up for it
-    
-    # now we get the next n chats
-    chats_left_to_add = n
-    while chats_left_to_add > 0:
-        doc_id += 1
-        if doc_id > num_chats_in_GC:
-            break
-        chat_data = flask_getChatDataFromDocIDGivenPIIName(doc_id, pii_name)
-        #if chat_data['is_media'] and not include_media:
-        #    continue
-        chats.append(chat_data)
-        print(f"added chat +1 (doc_id {doc_id})")
-        chats_left_to_add -= 1
-
+    chats = searcher.get_context_window(pii_name, doc_id, n, include_media)
     return jsonify(chats)
 
 @app.route('/api/CreateChatlogFromExport', methods=['POST'])
@@ -418,6 +441,49 @@ def flask_CreateChatlogFromExports():
     #core.CreateChatlogFromExport(platform, include_media, language)
     return jsonify({"success": "Export processed"})
 
-if __name__ == '__main__':
+def main() -> None:
+    """
+    Parses the command line arguments, sets up the searcher, its caches and the chat registry, then runs the server.
+
+    Nothing is set up at the top level of this script: worker processes (see `core.search_pool` and `core.tokenisers.segmentation_pool`) are spawned, and import it again as `__mp_main__`, so each of them would otherwise build its own searcher and load (and, on exit, save over) the result cache.
+    """
+    global language, searcher, chat_registry
+    parser = argparse.ArgumentParser(description='GCSearch Server')
+    parser.add_argument('--language', type=str, default='english', help='Language for the searcher')
+    parser.add_argument('--pii-cache-mb', type=int, default=512, help='Memory budget (in MB) for the cache of loaded PIIs')
+    parser.add_argument('--scoring', type=str, default='numpy', choices=['numpy', 'python'], help='BM25 scoring engine (both return identical rankings)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes to search chats in parallel with (1 searches in the server process)')
+    parser.add_argument('--result-cache-entries', type=int, default=1024, help='Number of search results to cache')
+    parser.add_argument('--result-cache-file', type=str, default=None, help='File to keep the result cache in across restarts (not persisted if not given)')
+    parser.add_argument('--segmentation-workers', type=int, default=0, help='Number of worker processes to segment Chinese queries in (0 segments in the server process)')
+    parser.add_argument('--warm-up', action='store_true', help='Load the tokeniser models and the index in a background thread at startup, rather than on the first search')
+    args = parser.parse_args()
+    if args.language not in currently_supported_languages:
+        print(f"Unsupported language: {args.language}. Currently supported languages are: {', '.join(currently_supported_languages)}")
+        language = "english"
+        print(f"Defaulting to {language}")
+    else:
+        language = args.language
+
+    start = time.perf_counter()
+    pii_cache.set_max_bytes(args.pii_cache_mb * 1024 * 1024) # before the searcher starts any workers, which get the same budget each
+    searcher = Searcher(language=language, scoring=args.scoring, workers=args.workers, segmentation_workers=args.segmentation_workers)
+    startup_timings["searcher"] = time.perf_counter() - start
+    start = time.perf_counter()
+    result_cache.set_max_entries(args.result_cache_entries)
+    if args.result_cache_file is not None:
+        result_cache.load(args.result_cache_file)
+        atexit.register(result_cache.save)
+    startup_timings["result cache"] = time.perf_counter() - start
+    start = time.perf_counter()
+    chat_registry = searcher.get_chat_registry()
+    startup_timings["chat registry"] = time.perf_counter() - start
+    print(f"GCSearch Server Initialised with language: {language}")
+    print("Startup times: " + ", ".join(f"{component} {seconds:.3f}s" for component, seconds in startup_timings.items()))
+    if args.warm_up:
+        threading.Thread(target=warm_up_server, name="warm-up", daemon=True).start()
     app.run(debug=True)
+
+if __name__ == '__main__':
+    main()
 #print(flask_getCurrentUser())